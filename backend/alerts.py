@@ -0,0 +1,308 @@
+"""
+Price Alerts
+
+"Notify me when AAPL goes above $200" alerts on watchlist tickers. An alert
+fires when the price crosses its threshold: one created with the price
+already past it starts "pending" and becomes "active" once the price is
+back on the other side. Pending and active alerts are kept in a
+PriceLevelIndex by ticker and threshold (pending ones on the opposite
+side), so each quote refresh finds every alert it arms or fires for that
+ticker with two bisections, and marks them in one conditional UPDATE.
+
+Fired alerts are stored on the alert row for later retrieval. Each app
+worker re-syncs its index from the database every ALERT_SYNC_SECONDS, and
+the conditional update makes sure an alert fires only once across workers.
+The worker that fires an alert pushes it straight to the user's Server-Sent
+Events streams on that worker; streams on other workers pick it up from
+the database within ALERT_POLL_SECONDS.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+from sqlmodel import Session, select, update, delete
+from database import engine
+from models import PriceAlert, User, Watchlist
+from price_levels import PriceLevelIndex, fires
+import market_data
+
+
+logger = logging.getLogger(__name__)
+
+ALERT_DIRECTIONS = ("above", "below")
+ALERT_STATUSES = ("pending", "active", "triggered")
+ALERT_SYNC_SECONDS = float(os.getenv("ALERT_SYNC_SECONDS", "60"))
+ALERT_POLL_SECONDS = float(os.getenv("ALERT_POLL_SECONDS", "5"))
+SSE_KEEPALIVE_SECONDS = 15
+
+# The side of the threshold a pending alert waits for the price to return to
+_OPPOSITE = {"above": "below", "below": "above"}
+
+
+def _event(alert_id, ticker, direction, threshold, note, triggered_price, triggered_at) -> dict:
+    return {
+        "id": alert_id,
+        "ticker": ticker,
+        "direction": direction,
+        "threshold": threshold,
+        "note": note,
+        "triggered_price": triggered_price,
+        "triggered_at": triggered_at.isoformat(),
+    }
+
+
+def _fired_since(user_id: int, since: datetime) -> List[dict]:
+    """A user's alerts fired (by any worker) since a moment, oldest first."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(
+                PriceAlert.id, PriceAlert.ticker, PriceAlert.direction, PriceAlert.threshold,
+                PriceAlert.note, PriceAlert.triggered_price, PriceAlert.triggered_at
+            )
+            .where(PriceAlert.user_id == user_id)
+            .where(PriceAlert.status == "triggered")
+            .where(PriceAlert.triggered_at >= since)
+            .order_by(PriceAlert.triggered_at, PriceAlert.id)
+        ).all()
+    return [_event(*row) for row in rows]
+
+
+class AlertHub:
+    """Fans fired alerts out to each user's open SSE streams."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, List[tuple]] = {}  # user id -> [(loop, queue)]
+
+    def _unsubscribe(self, user_id: int, subscriber: tuple):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def publish(self, user_id: int, event: dict):
+        """Thread-safe: deliver an event to every stream the user has open on this worker."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, []))
+        for subscriber in subscribers:
+            loop, queue = subscriber
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The stream's event loop closed without the stream cleaning up
+                self._unsubscribe(user_id, subscriber)
+
+    async def stream(self, user_id: int) -> AsyncIterator[str]:
+        """
+        SSE body for one connection: alert events plus periodic keep-alive
+        comments. Events published on this worker arrive at once; the rest
+        are polled from the database.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        subscriber = (loop, queue)
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(subscriber)
+        since = datetime.utcnow()
+        sent = set()
+        last_write = loop.time()
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    events = [await asyncio.wait_for(queue.get(), timeout=ALERT_POLL_SECONDS)]
+                except asyncio.TimeoutError:
+                    events = await asyncio.to_thread(_fired_since, user_id, since)
+                for event in events:
+                    if event["id"] in sent:
+                        continue
+                    sent.add(event["id"])
+                    last_write = loop.time()
+                    yield f"event: alert\ndata: {json.dumps(event)}\n\n"
+                if loop.time() - last_write >= SSE_KEEPALIVE_SECONDS:
+                    last_write = loop.time()
+                    yield ": keep-alive\n\n"
+        finally:
+            self._unsubscribe(user_id, subscriber)
+
+
+class AlertMonitor:
+    def __init__(self, hub: AlertHub):
+        self.hub = hub
+        self._loaded = False
+        self._index = PriceLevelIndex()
+        self._pending: Dict[int, tuple] = {}  # alert id -> (ticker, direction, threshold)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alerts")
+
+    def _entry(self, alert_id: int, ticker: str, direction: str, threshold: float, status: str) -> tuple:
+        if status == "pending":
+            self._pending[alert_id] = (ticker, direction, threshold)
+            return alert_id, ticker, _OPPOSITE[direction], threshold
+        self._pending.pop(alert_id, None)
+        return alert_id, ticker, direction, threshold
+
+    def add(self, alert: PriceAlert):
+        self._index.add(*self._entry(alert.id, alert.ticker, alert.direction, alert.threshold, alert.status))
+
+    def remove(self, alert_id: int):
+        self._index.remove(alert_id)
+        self._pending.pop(alert_id, None)
+
+    def load(self, session: Session):
+        """Rebuild the index from the pending and active alerts in the database."""
+        rows = session.exec(
+            select(PriceAlert.id, PriceAlert.ticker, PriceAlert.direction, PriceAlert.threshold, PriceAlert.status)
+            .where(PriceAlert.status.in_(("pending", "active")))
+        ).all()
+        self._pending = {}
+        self._index.replace([self._entry(*row) for row in rows])
+        self._loaded = True
+
+    def tickers(self) -> List[str]:
+        return self._index.tickers()
+
+    def on_quote(self, quote: dict):
+        """Quote listener: fire every alert on this ticker the new price crosses, and arm pending ones."""
+        if not self._loaded:
+            return
+        price = quote["price"]
+        armed, fired = [], []
+        for alert_id in self._index.due(quote["ticker"], price):
+            pending = self._pending.get(alert_id)
+            if pending is None:
+                self._index.remove(alert_id)
+                fired.append(alert_id)
+            elif not fires(pending[1], pending[2], price):
+                # Strictly back on the other side of the threshold: the next crossing fires it
+                self.remove(alert_id)
+                self._index.add(alert_id, *pending)
+                armed.append(alert_id)
+        if armed:
+            self._executor.submit(self._arm, armed, quote["ticker"])
+        if fired:
+            self._executor.submit(self._fire, fired, quote["ticker"], price)
+
+    def _arm(self, alert_ids: List[int], ticker: str):
+        try:
+            with Session(engine) as session:
+                session.exec(
+                    update(PriceAlert)
+                    .where(PriceAlert.id.in_(alert_ids))
+                    .where(PriceAlert.status == "pending")
+                    .values(status="active")
+                )
+                session.commit()
+        except Exception:
+            logger.exception(f"Failed to arm alerts for {ticker}")
+
+    def _fire(self, alert_ids: List[int], ticker: str, price: float):
+        now = datetime.utcnow()
+        try:
+            with Session(engine) as session:
+                fired = session.exec(
+                    update(PriceAlert)
+                    .where(PriceAlert.id.in_(alert_ids))
+                    .where(PriceAlert.status == "active")
+                    .values(status="triggered", triggered_price=price, triggered_at=now)
+                    .returning(
+                        PriceAlert.user_id, PriceAlert.id, PriceAlert.ticker,
+                        PriceAlert.direction, PriceAlert.threshold, PriceAlert.note
+                    )
+                ).all()
+                session.commit()
+        except Exception:
+            logger.exception(f"Failed to fire alerts for {ticker}")
+            return
+
+        for user_id, *alert in fired:
+            self.hub.publish(user_id, _event(*alert, price, now))
+        if fired:
+            logger.info(f"Fired {len(fired)} price alerts for {ticker} at {price}")
+
+
+hub = AlertHub()
+monitor = AlertMonitor(hub)
+market_data.add_quote_listener(monitor.on_quote)
+market_data.add_watched_tickers(monitor.tickers)
+
+
+def create_alert(session: Session, user: User, ticker: str, direction: str, threshold: float, note: Optional[str] = None) -> PriceAlert:
+    """Create an alert on one of the user's watchlist tickers. Raises ValueError on bad input."""
+    ticker = ticker.upper()
+    direction = (direction or "").lower()
+    if direction not in ALERT_DIRECTIONS:
+        raise ValueError(f"Invalid direction. Use one of: {', '.join(ALERT_DIRECTIONS)}")
+    if not threshold or threshold <= 0:
+        raise ValueError("Threshold must be positive")
+
+    item = session.exec(
+        select(Watchlist).where(Watchlist.user_id == user.id).where(Watchlist.ticker == ticker)
+    ).first()
+    if item is None:
+        raise ValueError(f"Add {ticker} to your watchlist first")
+
+    # Already past the threshold: wait for the price to come back before watching for a crossing
+    quote = market_data.get_quote(ticker)
+    past = quote is not None and fires(direction, threshold, quote["price"])
+
+    alert = PriceAlert(
+        ticker=ticker, direction=direction, threshold=threshold, note=note,
+        status="pending" if past else "active", watchlist_id=item.id, user_id=user.id
+    )
+    session.add(alert)
+    session.commit()
+    session.refresh(alert)
+    monitor.add(alert)
+    return alert
+
+
+def list_alerts(session: Session, user_id: int, status: Optional[str] = None) -> List[PriceAlert]:
+    query = select(PriceAlert).where(PriceAlert.user_id == user_id)
+    if status:
+        query = query.where(PriceAlert.status == status)
+    return session.exec(query.order_by(PriceAlert.created_at.desc(), PriceAlert.id.desc())).all()
+
+
+def delete_alert(session: Session, user_id: int, alert_id: int) -> bool:
+    deleted = session.exec(
+        delete(PriceAlert).where(PriceAlert.id == alert_id).where(PriceAlert.user_id == user_id)
+    ).rowcount
+    session.commit()
+    monitor.remove(alert_id)
+    return bool(deleted)
+
+
+def delete_alerts(session: Session, user_id: int, ticker: Optional[str] = None, watchlist_id: Optional[int] = None):
+    """Remove a user's alerts, optionally only those on a ticker or watchlist item, ahead of deleting it."""
+    query = select(PriceAlert.id).where(PriceAlert.user_id == user_id)
+    if ticker is not None:
+        query = query.where(PriceAlert.ticker == ticker.upper())
+    if watchlist_id is not None:
+        query = query.where(PriceAlert.watchlist_id == watchlist_id)
+    alert_ids = session.exec(query).all()
+    if alert_ids:
+        session.exec(delete(PriceAlert).where(PriceAlert.id.in_(alert_ids)))
+    for alert_id in alert_ids:
+        monitor.remove(alert_id)
+
+
+def _sync():
+    with Session(engine) as session:
+        monitor.load(session)
+
+
+async def run_index_sync():
+    """Load the alert index, then re-sync it from the database periodically until cancelled."""
+    while True:
+        try:
+            await asyncio.to_thread(_sync)
+        except Exception:
+            logger.exception("Alert index sync failed")
+        await asyncio.sleep(ALERT_SYNC_SECONDS)
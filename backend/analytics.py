@@ -0,0 +1,417 @@
+"""
+Portfolio Analytics
+
+Vectorized portfolio math over a user's transaction ledger. Transactions are
+loaded into columnar arrays once and holdings, average cost, realized and
+unrealized P/L, weights, sector exposure and concentration are computed with
+NumPy/pandas group operations instead of per-transaction Python loops.
+
+Portfolio history joins the ledger against a date x ticker matrix of daily
+closes: every transaction and cash movement is scattered onto the first
+trading day on or after it, and positions, cash and flows are cumulative
+sums down that calendar.
+
+Share counts, cash and P/L are accumulated as int64 fixed-point units
+(money.to_units), so running positions close to exactly zero and totals
+over long ledgers carry no floating-point drift.
+"""
+
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from sqlmodel import Session, select
+from models import Transaction, CashTransaction
+from money import SCALE, to_units, from_units
+
+
+LEDGER_COLUMNS = ["id", "ticker", "type", "quantity", "price", "date"]
+CASH_COLUMNS = ["date", "amount"]
+
+HISTORY_PERIODS = {
+    "1mo": pd.DateOffset(months=1),
+    "3mo": pd.DateOffset(months=3),
+    "6mo": pd.DateOffset(months=6),
+    "ytd": None,
+    "1y": pd.DateOffset(years=1),
+    "2y": pd.DateOffset(years=2),
+    "5y": pd.DateOffset(years=5),
+    "max": None,
+}
+
+
+def load_ledger(session: Session, user_id: int) -> pd.DataFrame:
+    """Load a user's transactions as a DataFrame ordered by (date, id)."""
+    rows = session.exec(
+        select(Transaction.id, Transaction.ticker, Transaction.type, Transaction.quantity, Transaction.price, Transaction.date)
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.date, Transaction.id)
+    ).all()
+    ledger = pd.DataFrame.from_records(rows, columns=LEDGER_COLUMNS)
+    ledger["quantity"] = ledger["quantity"].astype(float)
+    ledger["price"] = ledger["price"].astype(float)
+    return ledger
+
+
+def load_cash_flows(session: Session, user_id: int) -> pd.DataFrame:
+    """Load a user's deposits (positive) and withdrawals (negative) ordered by date."""
+    rows = session.exec(
+        select(CashTransaction.date, CashTransaction.type, CashTransaction.amount)
+        .where(CashTransaction.user_id == user_id)
+        .order_by(CashTransaction.date, CashTransaction.id)
+    ).all()
+    flows = pd.DataFrame.from_records(rows, columns=["date", "type", "amount"])
+    flows["amount"] = np.where(flows["type"] == "deposit", 1.0, -1.0) * flows["amount"].astype(float)
+    return flows[CASH_COLUMNS]
+
+
+def linear_scan(a: np.ndarray, c: np.ndarray) -> np.ndarray:
+    """
+    Solve x_k = a_k * x_{k-1} + c_k (with x_{-1} = 0) for every k.
+
+    Uses a log-depth prefix scan over the affine maps (a, c), so the work is
+    a handful of whole-array NumPy operations instead of a Python loop.
+    """
+    a = a.astype(float).copy()
+    c = c.astype(float).copy()
+    shift = 1
+    while shift < len(a):
+        c[shift:] = c[shift:] + a[shift:] * c[:-shift]
+        a[shift:] = a[shift:] * a[:-shift]
+        shift *= 2
+    return c
+
+
+def replay_average_cost(ledger: pd.DataFrame) -> pd.DataFrame:
+    """
+    Annotate each transaction with the running position under average cost.
+
+    Adds qty_before/qty_after, cost_before/cost_after and realized_pl columns.
+    Cost follows cost_k = r_k * cost_{k-1} + buy_k, where r_k is the share of
+    the position kept by a sell (1 for buys), which is solved for all tickers
+    at once with linear_scan.
+    """
+    if ledger.empty:
+        df = ledger.copy()
+        for column in ("qty_before", "qty_after", "cost_before", "cost_after", "realized_pl"):
+            df[column] = pd.Series(dtype=float)
+        return df
+
+    # Contiguous per-ticker runs, keeping (date, id) order within each ticker
+    df = ledger.sort_values(["ticker", "date", "id"], kind="stable")
+
+    is_buy = (df["type"] == "buy").to_numpy()
+    is_sell = (df["type"] == "sell").to_numpy()
+    quantity = df["quantity"].to_numpy(dtype=float)
+    price = df["price"].to_numpy(dtype=float)
+    signed_units = np.where(is_buy, 1, np.where(is_sell, -1, 0)) * to_units(quantity)
+
+    # Exact running positions: a position sold down to nothing is exactly zero
+    units_after = pd.Series(signed_units, index=df.index).groupby(df["ticker"], sort=False).cumsum().to_numpy()
+    qty_after = from_units(units_after)
+    qty_before = from_units(units_after - signed_units)
+
+    # Share of the position kept by each sell; sells against no position keep cost unchanged.
+    # Overselling clamps to zero: the short remainder carries no cost basis.
+    selling_position = is_sell & (qty_before > 0)
+    ratio = np.ones(len(df))
+    np.divide(np.maximum(qty_after, 0.0), qty_before, out=ratio, where=selling_position)
+
+    # A zero multiplier at each ticker's first row keeps tickers independent in the scan
+    first_row = np.r_[True, df["ticker"].to_numpy()[1:] != df["ticker"].to_numpy()[:-1]]
+    buy_value = from_units(to_units(np.where(is_buy, quantity * price, 0.0)))
+    cost_after = from_units(to_units(linear_scan(np.where(first_row, 0.0, ratio), buy_value)))
+    cost_before = np.where(first_row, 0.0, np.r_[0.0, cost_after[:-1]])
+
+    avg_cost_before = np.divide(cost_before, qty_before, out=np.zeros(len(df)), where=qty_before > 0)
+    closed_qty = np.where(selling_position, np.minimum(quantity, qty_before), 0.0)
+
+    df = df.copy()
+    df["qty_before"] = qty_before
+    df["qty_after"] = qty_after
+    df["cost_before"] = cost_before
+    df["cost_after"] = cost_after
+    df["realized_pl"] = from_units(to_units(closed_qty * (price - avg_cost_before)))
+    return df.loc[ledger.index]
+
+
+def compute_holdings(ledger: pd.DataFrame) -> pd.DataFrame:
+    """Per-ticker quantity, total_cost, avg_cost and realized_pl, indexed by ticker."""
+    replayed = replay_average_cost(ledger)
+    if replayed.empty:
+        return pd.DataFrame(columns=["quantity", "total_cost", "avg_cost", "realized_pl"], dtype=float)
+
+    by_ticker = replayed.assign(realized_units=to_units(replayed["realized_pl"])).groupby("ticker", sort=False)
+    holdings = pd.DataFrame({
+        "quantity": by_ticker["qty_after"].last(),
+        "total_cost": by_ticker["cost_after"].last(),
+        "realized_pl": by_ticker["realized_units"].sum() / SCALE,
+    })
+    holdings["avg_cost"] = np.divide(
+        holdings["total_cost"].to_numpy(), holdings["quantity"].to_numpy(),
+        out=np.zeros(len(holdings)), where=holdings["quantity"].to_numpy() > 0
+    )
+    return holdings
+
+
+def portfolio_analytics(
+    holdings: pd.DataFrame,
+    prices: Dict[str, float],
+    sectors: Optional[Dict[str, Optional[str]]] = None
+) -> dict:
+    """Combine holdings with current prices into weights, P/L, sector exposure and concentration."""
+    sectors = sectors or {}
+    realized_total = from_units(to_units(holdings["realized_pl"]).sum()) if not holdings.empty else 0.0
+    open_positions = holdings[holdings["quantity"] > 0].copy()
+
+    tickers = open_positions.index.to_numpy()
+    open_positions["current_price"] = np.array([prices.get(str(t).upper(), np.nan) for t in tickers], dtype=float)
+    value_units = to_units(open_positions["quantity"] * open_positions["current_price"].fillna(0.0))
+    cost_units = to_units(open_positions["total_cost"])
+    unrealized_units = np.where(open_positions["current_price"].notna(), value_units - cost_units, 0)
+    open_positions["market_value"] = from_units(value_units)
+    open_positions["unrealized_pl"] = from_units(unrealized_units)
+
+    total_value = from_units(value_units.sum())
+    total_cost = from_units(cost_units.sum())
+    weights = open_positions["market_value"] / total_value if total_value > 0 else open_positions["market_value"] * 0.0
+    open_positions["weight"] = weights
+    open_positions["unrealized_pl_pct"] = np.divide(
+        open_positions["unrealized_pl"].to_numpy() * 100, open_positions["total_cost"].to_numpy(),
+        out=np.zeros(len(open_positions)), where=open_positions["total_cost"].to_numpy() > 0
+    )
+    open_positions["sector"] = [sectors.get(str(t).upper()) or "Unknown" for t in tickers]
+
+    sector_values = (
+        pd.Series(value_units, index=open_positions.index).groupby(open_positions["sector"]).sum() / SCALE
+    ).sort_values(ascending=False)
+    sorted_weights = np.sort(weights.to_numpy())[::-1]
+    hhi = float(np.square(sorted_weights).sum())
+
+    holdings_out = []
+    for ticker, row in open_positions.sort_values("market_value", ascending=False).iterrows():
+        holdings_out.append({
+            "ticker": ticker,
+            "quantity": float(row["quantity"]),
+            "avg_cost": float(row["avg_cost"]),
+            "cost_basis": float(row["total_cost"]),
+            "current_price": None if np.isnan(row["current_price"]) else float(row["current_price"]),
+            "market_value": float(row["market_value"]),
+            "weight": float(row["weight"]),
+            "unrealized_pl": float(row["unrealized_pl"]),
+            "unrealized_pl_pct": float(row["unrealized_pl_pct"]),
+            "realized_pl": float(row["realized_pl"]),
+            "sector": row["sector"],
+        })
+
+    return {
+        "holdings": holdings_out,
+        "totals": {
+            "market_value": total_value,
+            "cost_basis": total_cost,
+            "unrealized_pl": from_units(unrealized_units.sum()),
+            "realized_pl": realized_total,
+        },
+        "sectors": [
+            {"sector": sector, "market_value": float(value), "weight": float(value / total_value) if total_value > 0 else 0.0}
+            for sector, value in sector_values.items()
+        ],
+        "concentration": {
+            "hhi": hhi,
+            "effective_holdings": 1.0 / hhi if hhi > 0 else 0.0,
+            "top_holding_weight": float(sorted_weights[:1].sum()),
+            "top5_weight": float(sorted_weights[:5].sum()),
+        },
+    }
+
+
+def _as_days(dates) -> pd.DatetimeIndex:
+    """Timezone-naive UTC midnights, whatever mix of naive/aware datetimes the database returned."""
+    return pd.DatetimeIndex(pd.to_datetime(pd.Series(dates, dtype=object), utc=True)).tz_localize(None).normalize()
+
+
+def period_start(period: str, ledger: pd.DataFrame, cash_flows: Optional[pd.DataFrame] = None) -> pd.Timestamp:
+    """First calendar day covered by a HISTORY_PERIODS period."""
+    today = pd.Timestamp.utcnow().tz_localize(None).normalize()
+    if period == "ytd":
+        return pd.Timestamp(year=today.year, month=1, day=1)
+    if period == "max":
+        dates = [_as_days(frame["date"]).min() for frame in (ledger, cash_flows) if frame is not None and not frame.empty]
+        return min(dates) if dates else today
+    return today - HISTORY_PERIODS[period]
+
+
+def tickers_held_since(ledger: pd.DataFrame, start: pd.Timestamp) -> List[str]:
+    """Tickers with an open position at start or any trade after it, i.e. those needing prices."""
+    if ledger.empty:
+        return []
+    days = _as_days(ledger["date"])
+    signed = np.where(ledger["type"] == "buy", 1, -1) * to_units(ledger["quantity"])
+    tickers = ledger["ticker"].str.upper()
+    open_at_start = pd.Series(signed[days < start]).groupby(tickers[days < start].to_numpy()).sum()
+    needed = set(open_at_start.index[open_at_start != 0]) | set(tickers[days >= start])
+    return sorted(needed)
+
+
+def _scatter(dates: pd.DatetimeIndex, when: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Row of each event on the calendar: the first trading day on or after it.
+
+    Row 0 also collects everything before the calendar starts, and events
+    after the last day land on an overflow row len(dates).
+    """
+    return dates.searchsorted(when, side="left")
+
+
+def time_weighted_return(values: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    """
+    Daily returns with external flows treated as arriving at the start of each day.
+
+    r_t = V_t / (V_{t-1} + F_t) - 1; days with nothing invested return 0.
+    """
+    base = values[:-1] + flows[1:]
+    return np.divide(values[1:], base, out=np.ones(len(base)), where=base > 1e-9) - 1.0
+
+
+def money_weighted_return(values: np.ndarray, flows: np.ndarray, years: np.ndarray) -> Optional[float]:
+    """
+    Annualized internal rate of return of the starting value, the flows and the
+    ending value, solved with Newton's method. None if it does not converge.
+    """
+    amounts = -flows.astype(float)
+    amounts[0] = -values[0]
+    amounts[-1] += values[-1]
+    if years[-1] <= 0 or not (amounts < 0).any() or not (amounts > 0).any():
+        return None
+
+    rate = 0.1
+    for _ in range(100):
+        discount = (1.0 + rate) ** -years
+        npv = amounts @ discount
+        slope = -(years * amounts) @ (discount / (1.0 + rate))
+        if slope == 0:
+            return None
+        step = npv / slope
+        rate = max(rate - step, -0.9999)
+        if abs(step) < 1e-10:
+            return float(rate)
+    return None
+
+
+def portfolio_history(
+    ledger: pd.DataFrame,
+    closes: pd.DataFrame,
+    start: pd.Timestamp,
+    cash_flows: Optional[pd.DataFrame] = None
+) -> dict:
+    """
+    Daily holdings value, cash and total value from start, plus returns.
+
+    With cash_flows (paper trading) the account's deposits and withdrawals
+    are the external flows and cash is tracked alongside holdings. Without
+    them the money put into buys and taken out by sells are the flows.
+    Missing closes fall back to the last traded price.
+    """
+    today = pd.Timestamp.utcnow().tz_localize(None).normalize()
+    dates = closes.index[closes.index >= start] if not closes.empty else pd.DatetimeIndex([])
+    if dates.empty:
+        dates = pd.bdate_range(start, max(start, today))
+    rows = len(dates) + 1
+
+    codes, tickers = pd.factorize(ledger["ticker"].str.upper())
+    is_buy = (ledger["type"] == "buy").to_numpy()
+    quantity = ledger["quantity"].to_numpy(dtype=float)
+    price = ledger["price"].to_numpy(dtype=float)
+    trade_rows = _scatter(dates, _as_days(ledger["date"])) if len(ledger) else np.zeros(0, dtype=int)
+
+    share_units = np.zeros((rows, len(tickers)), dtype=np.int64)
+    np.add.at(share_units, (trade_rows, codes), np.where(is_buy, 1, -1) * to_units(quantity))
+    shares = from_units(share_units.cumsum(axis=0)[:-1])
+
+    last_traded = np.full((rows, len(tickers)), np.nan)
+    last_traded[trade_rows, codes] = price
+    marks = closes.reindex(index=dates, columns=tickers).ffill()
+    marks = marks.fillna(pd.DataFrame(last_traded[:-1], index=dates, columns=tickers).ffill()).fillna(0.0)
+    holdings_units = to_units(shares * marks.to_numpy()).sum(axis=1)
+    holdings_value = from_units(holdings_units)
+
+    trade_cash = np.where(is_buy, -1, 1) * to_units(quantity * price)
+    if cash_flows is not None:
+        flow_rows = _scatter(dates, _as_days(cash_flows["date"])) if len(cash_flows) else np.zeros(0, dtype=int)
+        flow_amounts = to_units(cash_flows["amount"])
+        cash_units = np.zeros(rows, dtype=np.int64)
+        np.add.at(cash_units, np.r_[flow_rows, trade_rows], np.r_[flow_amounts, trade_cash])
+        cash_units = cash_units.cumsum()[:-1]
+        cash = from_units(cash_units)
+        total_value = from_units(holdings_units + cash_units)
+    else:
+        flow_rows, flow_amounts = trade_rows, -trade_cash
+        cash = None
+        total_value = holdings_value
+
+    # Flows on the first day are already part of the starting value
+    flow_units = np.zeros(rows, dtype=np.int64)
+    np.add.at(flow_units, flow_rows, flow_amounts)
+    flows = from_units(flow_units[:-1])
+    flows[0] = 0.0
+
+    return _history(dates, holdings_value, cash, total_value, flows)
+
+
+def period_returns(dates: pd.DatetimeIndex, total_value: np.ndarray, flows: np.ndarray) -> dict:
+    """Time- and money-weighted returns of a value series, annualized for spans of a year or more."""
+    years = (dates - dates[0]).days.to_numpy() / 365.25
+    twr = float(np.prod(1.0 + time_weighted_return(total_value, flows)) - 1.0)
+    irr = money_weighted_return(total_value, flows, years)
+    span = float(years[-1])
+    return {
+        "time_weighted": twr,
+        "time_weighted_annualized": (1.0 + twr) ** (1.0 / span) - 1.0 if span >= 1 and twr > -1 else None,
+        "money_weighted": (1.0 + irr) ** span - 1.0 if irr is not None else None,
+        "money_weighted_annualized": irr if span >= 1 else None,
+    }
+
+
+def _history(
+    dates: pd.DatetimeIndex,
+    holdings_value: np.ndarray,
+    cash: Optional[np.ndarray],
+    total_value: np.ndarray,
+    flows: np.ndarray
+) -> dict:
+    series = [
+        {
+            "date": day.strftime("%Y-%m-%d"),
+            "holdings_value": float(h),
+            "cash": None if cash is None else float(c),
+            "total_value": float(v),
+            "net_flow": float(f),
+        }
+        for day, h, c, v, f in zip(
+            dates, holdings_value, cash if cash is not None else np.zeros(len(dates)), total_value, flows
+        )
+    ]
+
+    return {
+        "start": dates[0].strftime("%Y-%m-%d"),
+        "end": dates[-1].strftime("%Y-%m-%d"),
+        "series": series,
+        "returns": period_returns(dates, total_value, flows),
+    }
+
+
+def snapshot_history(snapshots: pd.DataFrame, paper_trading: bool) -> dict:
+    """
+    The portfolio_history result built from stored daily snapshots.
+
+    Flows are the day-over-day change in net contributions; the first
+    snapshot's contributions are part of its starting value.
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(snapshots["snapshot_date"]))
+    flows = np.r_[0.0, np.diff(snapshots["net_contributions"].to_numpy(dtype=float))]
+    return _history(
+        dates,
+        snapshots["holdings_value"].to_numpy(dtype=float),
+        snapshots["cash_balance"].to_numpy(dtype=float) if paper_trading else None,
+        snapshots["total_value"].to_numpy(dtype=float),
+        flows,
+    )
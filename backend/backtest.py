@@ -0,0 +1,445 @@
+"""
+Backtesting
+
+Replays a strategy over historical daily closes and produces the same
+Transaction and CashTransaction records, history and P/L figures that a
+paper-trading account would have.
+
+Prices are loaded once from the shared daily close cache into a date x
+ticker array. A strategy is reduced to a schedule of events (rebalance or
+contribution days with target weights); only those days are stepped through,
+with vector operations across all tickers. Positions, cash and account value
+for every bar are then cumulative sums over the resulting trades, as in
+analytics.portfolio_history.
+
+Parameter sweeps run across a process pool, the price array being shipped
+once per worker chunk rather than once per parameter set.
+"""
+
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from analytics import (
+    LEDGER_COLUMNS,
+    CASH_COLUMNS,
+    compute_holdings,
+    portfolio_analytics,
+    portfolio_history,
+    period_returns,
+    time_weighted_return,
+)
+from risk import max_drawdown, RISK_FREE_RATE, TRADING_DAYS
+import market_data
+
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("buy_and_hold", "rebalance", "dca", "sma_cross")
+FREQUENCIES = {"monthly": "M", "quarterly": "Q", "yearly": "Y"}
+MAX_TICKERS = int(os.getenv("BACKTEST_MAX_TICKERS", "100"))
+MAX_PARAM_SETS = int(os.getenv("BACKTEST_MAX_PARAM_SETS", "64"))
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(os.cpu_count() or 2)))
+EPSILON = 1e-9
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the app process runs threads a fork would copy mid-flight
+            _pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# --- Strategy schedules ---
+
+def _target_weights(tickers: List[str], weights: Optional[Dict[str, float]]) -> np.ndarray:
+    """Weights aligned to tickers, normalized to sum to 1; equal weights by default."""
+    if not weights:
+        return np.full(len(tickers), 1.0 / len(tickers))
+    upper = {t.upper(): float(w) for t, w in weights.items()}
+    unknown = set(upper) - set(tickers)
+    if unknown:
+        raise ValueError(f"Weights given for tickers not in the backtest: {', '.join(sorted(unknown))}")
+    w = np.array([upper.get(t, 0.0) for t in tickers])
+    if (w < 0).any() or w.sum() <= 0:
+        raise ValueError("Weights must be non-negative and not all zero")
+    return w / w.sum()
+
+
+def _period_starts(dates: pd.DatetimeIndex, frequency: str) -> np.ndarray:
+    """Boolean mask of the first trading day of each month, quarter or year."""
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Invalid frequency. Use one of: {', '.join(FREQUENCIES)}")
+    periods = dates.to_period(FREQUENCIES[frequency]).asi8
+    return np.r_[True, periods[1:] != periods[:-1]]
+
+
+def _warmup_days(strategy: str, params: dict) -> int:
+    """Calendar days of history needed before the start for a strategy's indicators."""
+    if strategy == "sma_cross":
+        return int(int(params.get("slow", 200)) * 7 / 5) + 10
+    return 0
+
+
+def _schedule(
+    strategy: str,
+    params: dict,
+    tickers: List[str],
+    dates: pd.DatetimeIndex,
+    prices: np.ndarray,
+    start_row: int,
+    initial_cash: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    """
+    Event rows, the target weights (rows x tickers) and deposit on each, and
+    whether events rebalance the whole account (True) or only invest its cash.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Invalid strategy. Use one of: {', '.join(STRATEGIES)}")
+    weights = _target_weights(tickers, params.get("weights"))
+    in_range = np.arange(len(dates)) >= start_row
+
+    if strategy == "buy_and_hold":
+        rows = np.array([start_row])
+        return rows, weights[None, :], np.array([initial_cash]), False
+
+    if strategy == "rebalance":
+        mask = _period_starts(dates, params.get("frequency", "quarterly")) & in_range
+        mask[start_row] = True
+        rows = np.flatnonzero(mask)
+        deposits = np.zeros(len(rows))
+        deposits[0] = initial_cash
+        return rows, np.tile(weights, (len(rows), 1)), deposits, True
+
+    if strategy == "dca":
+        contribution = float(params.get("contribution", 0.0))
+        if contribution < 0:
+            raise ValueError("Contribution must not be negative")
+        mask = _period_starts(dates, params.get("frequency", "monthly")) & in_range
+        mask[start_row] = True
+        rows = np.flatnonzero(mask)
+        deposits = np.full(len(rows), contribution)
+        deposits[0] += initial_cash
+        return rows, np.tile(weights, (len(rows), 1)), deposits, False
+
+    # sma_cross: hold each ticker, at its weight, while its fast average is above its slow one
+    fast, slow = int(params.get("fast", 50)), int(params.get("slow", 200))
+    if not 0 < fast < slow:
+        raise ValueError("sma_cross needs 0 < fast < slow")
+    closes = pd.DataFrame(prices)
+    signal = (
+        closes.rolling(fast, min_periods=fast).mean().to_numpy()
+        > closes.rolling(slow, min_periods=slow).mean().to_numpy()
+    )
+    held = signal * weights
+    changed = np.r_[True, (signal[1:] != signal[:-1]).any(axis=1)] & in_range
+    changed[start_row] = True
+    rows = np.flatnonzero(changed)
+    deposits = np.zeros(len(rows))
+    deposits[0] = initial_cash
+    return rows, held[rows], deposits, True
+
+
+# --- Engine ---
+
+def simulate(
+    prices: np.ndarray,
+    rows: np.ndarray,
+    targets: np.ndarray,
+    deposits: np.ndarray,
+    rebalance: bool
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Step through the event rows and return the trades as (row, ticker index,
+    signed quantity, price) arrays, sells before buys on each day.
+
+    Tickers without a price on an event day keep their weight in cash.
+    """
+    n = prices.shape[1]
+    shares = np.zeros(n)
+    cash = 0.0
+    trade_rows, trade_codes, trade_qty = [], [], []
+
+    for row, target, deposit in zip(rows, targets, deposits):
+        price = prices[row]
+        tradable = ~np.isnan(price)
+        marks = np.where(tradable, price, 0.0)
+        weights = np.where(tradable, target, 0.0)
+        cash += deposit
+
+        if rebalance:
+            value = cash + shares @ marks
+            wanted = np.divide(weights * value, marks, out=np.zeros(n), where=tradable)
+            delta = np.where(tradable, wanted - shares, 0.0)
+        else:
+            delta = np.divide(weights * cash, marks, out=np.zeros(n), where=tradable)
+        delta[np.abs(delta) < EPSILON] = 0.0
+
+        cash -= delta @ marks
+        shares += delta
+        codes = np.flatnonzero(delta)
+        codes = codes[np.argsort(delta[codes] > 0, kind="stable")]
+        trade_rows.append(np.full(len(codes), row))
+        trade_codes.append(codes)
+        trade_qty.append(delta[codes])
+
+    trade_rows = np.concatenate(trade_rows) if trade_rows else np.zeros(0, dtype=int)
+    trade_codes = np.concatenate(trade_codes) if trade_codes else np.zeros(0, dtype=int)
+    trade_qty = np.concatenate(trade_qty) if trade_qty else np.zeros(0)
+    return trade_rows, trade_codes, trade_qty, prices[trade_rows, trade_codes]
+
+
+def _account_values(
+    prices: np.ndarray,
+    trades: tuple,
+    rows: np.ndarray,
+    deposits: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Holdings value, cash and external flows for every bar."""
+    trade_rows, trade_codes, trade_qty, trade_price = trades
+    bars = len(prices)
+    shares = np.zeros((bars, prices.shape[1]))
+    np.add.at(shares, (trade_rows, trade_codes), trade_qty)
+    holdings_value = (shares.cumsum(axis=0) * np.nan_to_num(prices)).sum(axis=1)
+    flows = np.bincount(rows, weights=deposits, minlength=bars)
+    cash = (flows - np.bincount(trade_rows, weights=trade_qty * trade_price, minlength=bars)).cumsum()
+    return holdings_value, cash, flows
+
+
+def _ledger(tickers: List[str], dates: pd.DatetimeIndex, trades: tuple) -> pd.DataFrame:
+    trade_rows, trade_codes, trade_qty, trade_price = trades
+    return pd.DataFrame({
+        "id": np.arange(len(trade_rows)),
+        "ticker": np.asarray(tickers, dtype=object)[trade_codes],
+        "type": np.where(trade_qty > 0, "buy", "sell"),
+        "quantity": np.abs(trade_qty),
+        "price": trade_price,
+        "date": dates[trade_rows],
+    }, columns=LEDGER_COLUMNS)
+
+
+def _records(frame: pd.DataFrame) -> List[dict]:
+    """Rows shaped like Transaction/CashTransaction records; built as plain dicts, ORM objects are slow in bulk."""
+    frame = frame.assign(date=frame["date"].dt.strftime("%Y-%m-%dT%H:%M:%S"))
+    return frame.to_dict("records")
+
+
+def _metrics(
+    tickers: List[str],
+    dates: pd.DatetimeIndex,
+    prices: np.ndarray,
+    start_row: int,
+    rows: np.ndarray,
+    deposits: np.ndarray,
+    trades: tuple
+) -> dict:
+    """Returns, risk and P/L of a simulated account over the bars from start_row."""
+    holdings_value, cash, flows = _account_values(prices, trades, rows, deposits)
+    days = dates[start_row:]
+    total_value = (holdings_value + cash)[start_row:]
+    flows = flows[start_row:].copy()
+    # Deposits on the first day are already part of the starting value
+    flows[0] = 0.0
+
+    daily = time_weighted_return(total_value, flows)
+    volatility = float(daily.std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(daily) > 1 else 0.0
+    returns = period_returns(days, total_value, flows)
+    annual = returns["time_weighted_annualized"]
+    if annual is None:
+        annual = float(daily.mean() * TRADING_DAYS) if len(daily) else 0.0
+
+    last = pd.DataFrame(prices, columns=tickers).ffill().iloc[-1]
+    pl = portfolio_analytics(
+        compute_holdings(_ledger(tickers, dates, trades)),
+        {t: float(p) for t, p in last.items() if not np.isnan(p)}
+    )["totals"]
+
+    return {
+        "start": days[0].strftime("%Y-%m-%d"),
+        "end": days[-1].strftime("%Y-%m-%d"),
+        "final_value": float(total_value[-1]),
+        "cash": float(cash[-1]),
+        "total_deposited": float(deposits.sum()),
+        **returns,
+        "volatility": volatility,
+        "sharpe_ratio": (annual - RISK_FREE_RATE) / volatility if volatility > 0 else None,
+        "max_drawdown": max_drawdown(daily),
+        "trades": int(len(trades[0])),
+        "realized_pl": pl["realized_pl"],
+        "unrealized_pl": pl["unrealized_pl"],
+    }
+
+
+def _run(
+    tickers: List[str],
+    dates: pd.DatetimeIndex,
+    prices: np.ndarray,
+    start_row: int,
+    strategy: str,
+    params: dict,
+    initial_cash: float
+) -> Tuple[dict, tuple, np.ndarray, np.ndarray]:
+    rows, targets, deposits, rebalance = _schedule(strategy, params, tickers, dates, prices, start_row, initial_cash)
+    trades = simulate(prices, rows, targets, deposits, rebalance)
+    return _metrics(tickers, dates, prices, start_row, rows, deposits, trades), trades, rows, deposits
+
+
+def _run_chunk(
+    tickers: List[str],
+    dates: pd.DatetimeIndex,
+    prices: np.ndarray,
+    start_row: int,
+    runs: List[Tuple[str, dict]],
+    initial_cash: float
+) -> List[dict]:
+    """Process pool entry point: metrics for several (strategy, params) runs over one price array."""
+    results = []
+    for strategy, params in runs:
+        try:
+            results.append({"metrics": _run(tickers, dates, prices, start_row, strategy, params, initial_cash)[0]})
+        except ValueError as e:
+            results.append({"error": str(e)})
+    return results
+
+
+# --- Entry points ---
+
+def load_prices(
+    tickers: List[str],
+    start: datetime,
+    end: Optional[datetime] = None,
+    warmup_days: int = 0
+) -> Tuple[List[str], pd.DatetimeIndex, np.ndarray, int]:
+    """
+    Daily closes from the shared cache as (tickers, dates, prices, start_row).
+
+    Prices are forward-filled and NaN before a ticker's first close; rows
+    before start_row are indicator warm-up. Raises ValueError without data.
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end) if end is not None else None
+    tickers = list(dict.fromkeys(t.upper() for t in tickers))
+    if not tickers:
+        raise ValueError("At least one ticker is required")
+    if len(tickers) > MAX_TICKERS:
+        raise ValueError(f"At most {MAX_TICKERS} tickers per backtest")
+
+    closes = market_data.get_daily_closes(tickers, start - pd.Timedelta(days=warmup_days))
+    if end is not None:
+        closes = closes[closes.index <= end]
+    missing = [t for t in tickers if t not in closes.columns]
+    if missing:
+        raise ValueError(f"No price history for: {', '.join(missing)}")
+
+    closes = closes[tickers].ffill()
+    dates = pd.DatetimeIndex(closes.index)
+    start_row = int(dates.searchsorted(start, side="left"))
+    if start_row >= len(dates):
+        raise ValueError("No trading days in the requested range")
+    return tickers, dates, closes.to_numpy(dtype=float), start_row
+
+
+def run_backtest(
+    tickers: List[str],
+    start: datetime,
+    end: Optional[datetime],
+    strategy: str,
+    params: dict,
+    initial_cash: float
+) -> dict:
+    """
+    One backtest in full: metrics, daily history, final holdings, and the
+    Transaction and CashTransaction records the strategy would have made.
+    """
+    tickers, dates, prices, start_row = load_prices(tickers, start, end, _warmup_days(strategy, params))
+    metrics, trades, rows, deposits = _run(tickers, dates, prices, start_row, strategy, params, initial_cash)
+
+    ledger = _ledger(tickers, dates, trades)
+    funded = deposits > 0
+    cash_flows = pd.DataFrame({"date": dates[rows[funded]], "amount": deposits[funded]}, columns=CASH_COLUMNS)
+    closes = pd.DataFrame(prices, index=dates, columns=tickers)
+    history = portfolio_history(ledger, closes, dates[start_row], cash_flows)
+
+    notes = np.full(len(cash_flows), "Backtest contribution", dtype=object)
+    if initial_cash > 0 and len(notes):
+        notes[0] = "Backtest initial deposit"
+
+    last = closes.ffill().iloc[-1]
+    positions = portfolio_analytics(
+        compute_holdings(ledger), {t: float(p) for t, p in last.items() if not np.isnan(p)}
+    )
+
+    return {
+        "strategy": strategy,
+        "params": params,
+        "metrics": metrics,
+        "history": history["series"],
+        "holdings": positions["holdings"],
+        "transactions": _records(ledger[["ticker", "type", "quantity", "price", "date"]]),
+        "cash_transactions": _records(cash_flows.assign(type="deposit", note=notes)[["type", "amount", "date", "note"]]),
+    }
+
+
+def run_sweep(
+    tickers: List[str],
+    start: datetime,
+    end: Optional[datetime],
+    strategy: str,
+    params: dict,
+    param_sets: List[dict],
+    initial_cash: float
+) -> dict:
+    """
+    Metrics for several parameter sets, each overriding params (and
+    optionally the strategy), computed in parallel across the process pool.
+    """
+    if not param_sets:
+        raise ValueError("param_sets must not be empty")
+    if len(param_sets) > MAX_PARAM_SETS:
+        raise ValueError(f"At most {MAX_PARAM_SETS} parameter sets per sweep")
+
+    runs = []
+    for overrides in param_sets:
+        merged = {**params, **overrides}
+        runs.append((merged.pop("strategy", strategy), merged))
+    warmup = max(_warmup_days(s, p) for s, p in runs)
+    tickers, dates, prices, start_row = load_prices(tickers, start, end, warmup)
+
+    chunks = [runs[i::BACKTEST_WORKERS] for i in range(min(BACKTEST_WORKERS, len(runs)))]
+    if len(chunks) > 1:
+        futures = [
+            _get_pool().submit(_run_chunk, tickers, dates, prices, start_row, chunk, initial_cash)
+            for chunk in chunks
+        ]
+        chunk_results = [future.result() for future in futures]
+    else:
+        chunk_results = [_run_chunk(tickers, dates, prices, start_row, runs, initial_cash)]
+
+    # Undo the round-robin split so results line up with param_sets
+    results = [None] * len(runs)
+    for offset, chunk in enumerate(chunk_results):
+        for i, result in enumerate(chunk):
+            results[offset + i * len(chunks)] = result
+    return {
+        "results": [
+            {"strategy": s, "params": p, **result} for (s, p), result in zip(runs, results)
+        ],
+    }
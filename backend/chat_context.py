@@ -0,0 +1,154 @@
+"""
+Chat Context and Conversation State
+
+Builds the assistant's context from cached positions and quotes, and keeps
+server-side conversation state so follow-up turns only carry what changed.
+
+Each conversation starts with a stable system prefix (identical for every
+user and turn, so providers can reuse it for prompt caching), followed by a
+full portfolio context message. Later turns append a short update only when
+some portfolio field differs from what the model has already seen.
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlmodel import Session
+from models import User
+from positions import get_open_positions
+import market_data
+
+
+CONVERSATION_TTL_SECONDS = float(os.getenv("CONVERSATION_TTL_SECONDS", "3600"))
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", "1000"))
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+
+SYSTEM_PREFIX = "\n".join([
+    "You are a helpful financial advisor assistant for NVest AI, an AI-powered portfolio tracking app.",
+    "Messages starting with [Portfolio context] or [Portfolio update] describe the user's account; "
+    "an update replaces the matching fields of the earlier context.",
+    "Provide insights based on the user's portfolio and market trends.",
+    "Keep answers short, concise and helpful.",
+])
+
+_FIELD_LABELS = {
+    "date": "Today is",
+    "mode": "Mode:",
+    "cash_balance": "Cash Balance:",
+    "portfolio_value": "Portfolio Value (stocks):",
+    "total_account_value": "Total Account Value:",
+    "holdings": "Current holdings:",
+}
+
+
+def build_context_fields(session: Session, user: User) -> Dict[str, str]:
+    """Collect the user's portfolio context from cached positions and quotes."""
+    holdings = get_open_positions(session, user.id)
+    quotes = market_data.get_quotes(holdings.keys())
+
+    total_value = 0.0
+    for ticker, position in holdings.items():
+        quote = quotes.get(ticker.upper())
+        if quote:
+            total_value += position["quantity"] * quote["price"]
+
+    holdings_text = ", ".join(f"{t} ({p['quantity']} shares)" for t, p in holdings.items())
+
+    fields = {
+        "date": datetime.now().strftime("%A, %B %d, %Y"),
+        "holdings": holdings_text or "None",
+    }
+    if user.paper_trading_enabled:
+        fields["mode"] = "Virtual Trading (practice with virtual money)"
+        fields["cash_balance"] = f"${user.cash_balance:,.2f}"
+        fields["portfolio_value"] = f"${total_value:,.2f}"
+        fields["total_account_value"] = f"${user.cash_balance + total_value:,.2f}"
+    else:
+        fields["portfolio_value"] = f"${total_value:,.2f}"
+    return fields
+
+
+def render_context(fields: Dict[str, str], header: str = "[Portfolio context]") -> str:
+    lines = [header]
+    for key, label in _FIELD_LABELS.items():
+        if key in fields:
+            lines.append(f"{label} {fields[key]}")
+    return "\n".join(lines)
+
+
+class Conversation:
+    def __init__(self, conversation_id: str, user_id: int):
+        self.id = conversation_id
+        self.user_id = user_id
+        self.fields: Dict[str, str] = {}
+        self.messages: List[dict] = []
+        self.updated_at = time.time()
+
+    def prepare_turn(self, fields: Dict[str, str], user_query: str) -> List[dict]:
+        """
+        Record the context delta (if any) and the new user message.
+
+        Returns the history preceding the new user message, as a list of
+        {"role": "context" | "user" | "assistant", "content": str}.
+        """
+        if not self.messages:
+            self.messages.append({"role": "context", "content": render_context(fields)})
+        else:
+            changed = {k: v for k, v in fields.items() if self.fields.get(k) != v}
+            if changed:
+                self.messages.append({"role": "context", "content": render_context(changed, "[Portfolio update]")})
+        self.fields = dict(fields)
+        self.messages.append({"role": "user", "content": user_query})
+        self.updated_at = time.time()
+        return self.messages[:-1]
+
+    def record_reply(self, reply: str):
+        self.messages.append({"role": "assistant", "content": reply})
+        self._trim()
+
+    def discard_turn(self):
+        """Drop the pending user message after a failed generation."""
+        if self.messages and self.messages[-1]["role"] == "user":
+            self.messages.pop()
+
+    def _trim(self):
+        if len(self.messages) <= MAX_HISTORY_MESSAGES:
+            return
+        # Re-seed with the full current context so nothing the model relied on is lost
+        tail = self.messages[-(MAX_HISTORY_MESSAGES - 1):]
+        while tail and tail[0]["role"] != "user":
+            tail.pop(0)
+        self.messages = [{"role": "context", "content": render_context(self.fields)}] + tail
+
+
+class ConversationStore:
+    """In-memory LRU of conversations, scoped per user."""
+
+    def __init__(self):
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, user_id: int, conversation_id: Optional[str] = None) -> Conversation:
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            conversation = self._conversations.get(conversation_id) if conversation_id else None
+            if conversation is None or conversation.user_id != user_id:
+                conversation = Conversation(uuid.uuid4().hex, user_id)
+                self._conversations[conversation.id] = conversation
+            self._conversations.move_to_end(conversation.id)
+            return conversation
+
+    def _evict(self, now: float):
+        expired = [cid for cid, c in self._conversations.items() if now - c.updated_at > CONVERSATION_TTL_SECONDS]
+        for cid in expired:
+            del self._conversations[cid]
+        while len(self._conversations) > MAX_CONVERSATIONS:
+            self._conversations.popitem(last=False)
+
+
+conversations = ConversationStore()
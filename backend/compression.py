@@ -0,0 +1,135 @@
+"""
+Response Compression
+
+ASGI middleware that compresses API responses with brotli (when the brotli
+package is installed and the client accepts it) or gzip. Whole responses
+are compressed only above COMPRESS_MIN_BYTES, since small JSON bodies gain
+little and cost CPU. Streamed responses (NDJSON exports, reports, import
+progress) are compressed chunk by chunk and flushed after each one, so
+progress lines still arrive as they are produced.
+
+Left alone: Server-Sent Events, content that is already compressed
+(images, XLSX) and responses that already have a Content-Encoding, such
+as the precompressed frontend files. A compressed response's ETag becomes
+weak, because it no longer names the identity bytes.
+"""
+
+import os
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from http_cache import accepted_encodings
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+# Fast levels: these bodies are compressed on every request, unlike the frontend's
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "image/svg+xml", "text/",
+)
+EXCLUDED_TYPES = ("text/event-stream",)
+
+
+def _encoding(accept_encoding: str) -> Optional[str]:
+    """br or gzip, whichever is best of those the client accepts."""
+    accepted = accepted_encodings(accept_encoding)
+    if BROTLI_AVAILABLE and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return (
+        "content-encoding" not in headers
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+        and not content_type.startswith(EXCLUDED_TYPES)
+    )
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._gzip = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """Compress a chunk and flush it; the last chunk also ends the stream."""
+        if self.encoding == "br":
+            return self._brotli.process(data) + (self._brotli.finish() if final else self._brotli.flush())
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk decides the headers
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                if start is not None:
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not _compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding)
+                body = compressor.compress(body, final=not more_body)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+            else:
+                body = compressor.compress(body, final=not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,5 +1,10 @@
 import os
+import logging
+from sqlalchemy import Float, inspect, text
 from sqlmodel import SQLModel, create_engine
+from money import Fixed, PLACES
+
+logger = logging.getLogger(__name__)
 
 # Check for DATABASE_URL environment variable (used for Cloud SQL)
 database_url = os.getenv("DATABASE_URL")
@@ -18,8 +23,34 @@ else:
     connect_args = {"check_same_thread": False}
     engine = create_engine(sqlite_url, connect_args=connect_args)
 
+def _migrate_fixed_columns():
+    """
+    Convert money columns that databases created before the Fixed type still
+    have as floating point to NUMERIC(20, PLACES). Only on PostgreSQL: SQLite
+    can't alter a column's type and stores either kind as REAL, so there the
+    old columns stay and Fixed rounds every value on its way in and out.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if isinstance(column.type, Fixed) and isinstance(existing.get(column.name), Float):
+                    logger.info(f"Converting {table.name}.{column.name} to NUMERIC(20, {PLACES})")
+                    connection.execute(text(
+                        f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" '
+                        f'TYPE NUMERIC(20, {PLACES}) USING round("{column.name}"::numeric, {PLACES})'
+                    ))
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    # create_all skips existing tables, so add indexes declared on them since
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    _migrate_fixed_columns()
 
 from sqlmodel import Session
 
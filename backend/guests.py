@@ -0,0 +1,144 @@
+"""
+Guest Accounts
+
+Every guest login creates a throwaway user. Logging out deletes it, and a
+background reaper purges guests whose tokens have all expired, so guests
+who just close the tab don't pile up.
+
+Deletion is set-based: one DELETE ... WHERE user_id IN (...) per table, in
+dependency order, for a whole batch of users in one transaction. The reaper
+works through expired guests GUEST_REAPER_BATCH at a time and logs the users
+and rows each run reclaimed.
+
+The reaper runs in the app every GUEST_REAPER_MINUTES (GUEST_REAPER) and
+can be run once from cron:
+
+    python guests.py
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import insert, literal
+from sqlmodel import Session, select, delete
+from database import create_db_and_tables, engine
+from models import (
+    User, Transaction, CashTransaction, Watchlist, TaxLot, LotRelief,
+    PortfolioSnapshot, Order, PriceAlert, GuestSession, LedgerEvent, LedgerSnapshot
+)
+from auth import REFRESH_TOKEN_EXPIRE_DAYS
+from positions import invalidate_positions
+from leaderboard import board as leaderboard
+import orders
+import alerts
+
+
+logger = logging.getLogger(__name__)
+
+GUEST_REAPER = os.getenv("GUEST_REAPER", "true").lower() in ("1", "true", "yes")
+GUEST_REAPER_MINUTES = float(os.getenv("GUEST_REAPER_MINUTES", "60"))
+GUEST_REAPER_BATCH = int(os.getenv("GUEST_REAPER_BATCH", "200"))
+# A guest's refresh token is never renewed, so nothing can use the account after it expires
+GUEST_TTL_DAYS = float(os.getenv("GUEST_TTL_DAYS", str(REFRESH_TOKEN_EXPIRE_DAYS + 1)))
+
+# Children before parents, so foreign keys hold at every step
+USER_DATA_MODELS = [
+    LotRelief, TaxLot, Order, PriceAlert, PortfolioSnapshot, LedgerSnapshot, LedgerEvent,
+    CashTransaction, Transaction, Watchlist, GuestSession,
+]
+
+def register_guest(session: Session, user: User):
+    """Start a new guest's expiry clock. Not committed."""
+    session.add(GuestSession(user_id=user.id))
+
+
+def delete_users(session: Session, user_ids: List[int]) -> Dict[str, int]:
+    """
+    Delete users and everything they own with one DELETE per table, and drop
+    them from the in-memory order book, alert index and caches. Not
+    committed; returns the rows deleted per table.
+    """
+    if not user_ids:
+        return {}
+
+    open_orders = session.exec(
+        select(Order.id).where(Order.user_id.in_(user_ids)).where(Order.status == "open")
+    ).all()
+    alert_ids = session.exec(select(PriceAlert.id).where(PriceAlert.user_id.in_(user_ids))).all()
+
+    deleted = {}
+    for model in USER_DATA_MODELS:
+        deleted[model.__tablename__] = session.exec(delete(model).where(model.user_id.in_(user_ids))).rowcount
+    deleted[User.__tablename__] = session.exec(delete(User).where(User.id.in_(user_ids))).rowcount
+
+    for order_id in open_orders:
+        orders.book.remove(order_id)
+    for alert_id in alert_ids:
+        alerts.monitor.remove(alert_id)
+    for user_id in user_ids:
+        invalidate_positions(user_id)
+        leaderboard.remove_user(user_id)
+    return deleted
+
+
+def _track_untracked(session: Session, now: datetime):
+    """Guests from before expiry tracking start their clock now."""
+    tracked = select(GuestSession.user_id)
+    session.execute(
+        insert(GuestSession.__table__).from_select(
+            ["user_id", "created_at"],
+            select(User.id, literal(now)).where(User.is_guest == True)  # noqa: E712
+            .where(User.id.not_in(tracked))
+        )
+    )
+    session.commit()
+
+
+def reap_expired_guests(now: Optional[datetime] = None) -> dict:
+    """Delete every guest created more than GUEST_TTL_DAYS ago, a batch per transaction."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=GUEST_TTL_DAYS)
+    started = time.monotonic()
+    users = 0
+    rows: Dict[str, int] = {}
+
+    with Session(engine) as session:
+        _track_untracked(session, now)
+        while True:
+            user_ids = session.exec(
+                select(GuestSession.user_id)
+                .join(User, User.id == GuestSession.user_id)
+                .where(User.is_guest == True)  # noqa: E712
+                .where(GuestSession.created_at < cutoff)
+                .limit(GUEST_REAPER_BATCH)
+            ).all()
+            if not user_ids:
+                break
+            deleted = delete_users(session, list(user_ids))
+            session.commit()
+            users += deleted.pop(User.__tablename__)
+            for table, count in deleted.items():
+                rows[table] = rows.get(table, 0) + count
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Reaped {users} expired guests and {sum(rows.values())} rows in {elapsed:.2f}s: {rows}")
+    return {"users_deleted": users, "rows_deleted": rows, "seconds": elapsed}
+
+
+async def run_reaper():
+    """Purge expired guests every GUEST_REAPER_MINUTES until cancelled."""
+    while True:
+        try:
+            await asyncio.to_thread(reap_expired_guests)
+        except Exception:
+            logger.exception("Guest reaper failed")
+        await asyncio.sleep(GUEST_REAPER_MINUTES * 60)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    create_db_and_tables()
+    reap_expired_guests()
@@ -0,0 +1,85 @@
+"""
+HTTP Caching
+
+ETag and Cache-Control for the endpoints the frontend polls. Each ETag is a
+hash of the data version behind the response: for market data, the fetch
+time of the cached quote, history or info; for a user's portfolio, their
+latest ledger event and the quotes it was valued at. Endpoints compute the
+tag and pass respond() a function that builds the body, so a request whose
+If-None-Match matches gets a 304 without the body being built. The batch
+and chat tools call the plain helpers behind these endpoints instead.
+
+Market data is the same for everyone, so it's public and may be reused by
+browsers and a CDN until its cache entry would expire (capped per
+endpoint). Per-user responses are private and revalidated on every use.
+"""
+
+import os
+import time
+import hashlib
+from typing import Any, Callable
+from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
+
+
+QUOTE_MAX_AGE = int(os.getenv("HTTP_QUOTE_MAX_AGE", "15"))
+HISTORY_MAX_AGE = int(os.getenv("HTTP_HISTORY_MAX_AGE", "300"))
+INFO_MAX_AGE = int(os.getenv("HTTP_INFO_MAX_AGE", "3600"))
+
+# Stored, but checked with the server before every use
+PRIVATE = "private, no-cache"
+
+
+def etag(*version, weak: bool = False) -> str:
+    """
+    An ETag for a data version (any reprs). Strong when the version fixes
+    the exact bytes of the body, weak when it only fixes its meaning.
+    """
+    digest = hashlib.blake2b(repr(version).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def public(max_age: int, fetched_at: float, ttl: float) -> str:
+    """Cache-Control for shared data: max_age, or less if the server's copy expires sooner."""
+    remaining = int(ttl - (time.time() - fetched_at))
+    return f"public, max-age={max(0, min(max_age, remaining))}"
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Content codings an Accept-Encoding header allows (q > 0)."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = params.strip().replace(" ", "")
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def matches(request: Request, tag: str) -> bool:
+    """Whether the request's If-None-Match names this ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    opaque = tag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def respond(request: Request, tag: str, cache_control: str, build: Callable[[], Any]) -> Response:
+    """
+    The JSON body build() returns, or a 304 if the client already has this
+    version, in which case build() never runs. Both carry the ETag and
+    Cache-Control.
+    """
+    headers = {"ETag": tag, "Cache-Control": cache_control}
+    if matches(request, tag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(build(), headers=headers)
@@ -0,0 +1,60 @@
+"""
+Shared HTTP Client
+
+A single pooled httpx.AsyncClient for outbound calls from the MCP modules
+and the chat tools, so connections are reused (keep-alive, HTTP/2 when the
+h2 package is installed) instead of opening a client per caller.
+
+The owning process is responsible for calling close_client() on shutdown:
+the FastAPI app does it in its shutdown hook, the MCP server when its
+stdio loop exits.
+"""
+
+import os
+import logging
+from typing import Optional
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the process-wide client, creating it on first use or after close."""
+    global _client
+
+    if _client is None or _client.is_closed:
+        if not HTTP2_AVAILABLE:
+            logger.info("h2 not installed, shared HTTP client will use HTTP/1.1")
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT_SECONDS,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client and release its pooled connections."""
+    global _client
+
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -0,0 +1,375 @@
+"""
+Bulk Transaction Import
+
+Streams CSV and OFX broker exports into a user's transactions. The upload
+is parsed incrementally, rows are validated in chunks of IMPORT_CHUNK_ROWS
+and each valid chunk is written with one executemany INSERT and committed,
+so a file of any size is never held in memory or written row by row.
+
+Positions, tax lots, the leaderboard entry and stale snapshots are rebuilt
+once at the end rather than per row. Paper-trading accounts are checked
+against a running cash balance and share count, applied in file order.
+
+OFX trades name securities by CUSIP and the ticker list comes after them,
+so OFX trades are held until the file is read, then written in chunks.
+"""
+
+import os
+import csv
+import io
+import re
+import logging
+from datetime import datetime
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import case, insert
+from sqlmodel import Session, select, func
+from database import engine
+from models import Transaction, User
+from positions import get_positions, invalidate_positions
+from leaderboard import board as leaderboard
+from trading import adjust_cash, reserved_cash, reserved_shares_by_ticker
+import lots
+import ledger
+import snapshots
+
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = {"csv": "csv", "ofx": "ofx", "qfx": "ofx"}
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "1000"))
+MAX_REPORTED_ERRORS = 100
+READ_BYTES = 64 * 1024
+
+COLUMN_ALIASES = {
+    "date": ("date", "tradedate", "transactiondate", "rundate", "datetime"),
+    "ticker": ("ticker", "symbol"),
+    "type": ("type", "action", "side", "transactiontype"),
+    "quantity": ("quantity", "shares", "qty", "units"),
+    "price": ("price", "unitprice", "pricepershare", "shareprice", "priceshare"),
+}
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y%m%d", "%d-%b-%Y", "%Y-%m-%d %H:%M:%S")
+OFX_TRADES = {
+    "BUYSTOCK": "buy", "BUYMF": "buy", "BUYOTHER": "buy",
+    "SELLSTOCK": "sell", "SELLMF": "sell", "SELLOTHER": "sell",
+}
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z]", "", name.lower())
+
+
+def _number(value: str) -> float:
+    value = value.strip().replace("$", "").replace(",", "")
+    if value.startswith("(") and value.endswith(")"):
+        value = "-" + value[1:-1]
+    return float(value)
+
+
+def _trade_type(action: str) -> Optional[str]:
+    """buy or sell for a broker's action text, None for non-trades such as dividends."""
+    action = action.strip().lower()
+    if "buy" in action or "bought" in action or "purchase" in action:
+        return "buy"
+    if "sell" in action or "sold" in action:
+        return "sell"
+    return None
+
+
+def parse_date(value: str) -> datetime:
+    value = value.strip()
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {value!r}")
+
+
+# --- Parsers: yield (row number, raw fields) ---
+
+def csv_columns(header: List[str]) -> Dict[str, int]:
+    """Map each required field to its column index. Raises ValueError if one is missing."""
+    normalized = [_normalize(h) for h in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[field] = normalized.index(alias)
+                break
+    missing = [field for field in COLUMN_ALIASES if field not in columns]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+    return columns
+
+
+def _csv_rows(reader: Iterator[List[str]], columns: Dict[str, int]) -> Iterator[Tuple[int, dict]]:
+    for line, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        yield line, {field: row[i] if i < len(row) else "" for field, i in columns.items()}
+
+
+def parse_csv(stream: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    """
+    Rows of a CSV export, read lazily from a binary stream. The header is
+    read right away, so a file without the needed columns raises ValueError
+    before anything is imported.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("The file is empty")
+    return _csv_rows(reader, csv_columns(header))
+
+
+def _ofx_date(value: str) -> str:
+    digits = value.strip()[:14]
+    return datetime.strptime(digits[:8], "%Y%m%d").replace(
+        hour=int(digits[8:10] or 0), minute=int(digits[10:12] or 0), second=int(digits[12:14] or 0)
+    ).isoformat()
+
+
+def parse_ofx(stream: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    """
+    Buy and sell trades of an OFX investment statement (SGML 1.x or XML 2.x),
+    tokenized chunk by chunk. Trades are yielded once the security list has
+    mapped their CUSIPs to tickers.
+    """
+    trades: List[dict] = []
+    tickers: Dict[str, str] = {}
+    trade: Optional[dict] = None
+    security: Optional[dict] = None
+    buffer = ""
+
+    def handle(closing: bool, tag: str, text: str):
+        nonlocal trade, security
+        tag = tag.upper()
+        text = text.strip()
+        if tag in OFX_TRADES:
+            if closing and trade is not None:
+                trades.append(trade)
+                trade = None
+            elif not closing:
+                trade = {"type": OFX_TRADES[tag]}
+        elif tag == "SECINFO":
+            if closing and security is not None:
+                if security.get("uniqueid") and security.get("ticker"):
+                    tickers[security["uniqueid"]] = security["ticker"]
+                security = None
+            elif not closing:
+                security = {}
+        elif not closing and text:
+            target = trade if trade is not None else security
+            if target is not None:
+                key = {"UNIQUEID": "uniqueid", "TICKER": "ticker", "TRADEDATE": "date",
+                       "UNITS": "quantity", "UNITPRICE": "price"}.get(tag)
+                if key:
+                    target[key] = text
+
+    while True:
+        chunk = stream.read(READ_BYTES)
+        if chunk:
+            buffer += chunk.decode("utf-8", errors="replace")
+        # Keep a possibly incomplete trailing tag for the next chunk
+        cut = buffer.rfind("<") if chunk else len(buffer)
+        for match in _OFX_TAG.finditer(buffer, 0, max(cut, 0)):
+            handle(match.group(1) == "/", match.group(2), match.group(3))
+        buffer = buffer[max(cut, 0):]
+        if not chunk:
+            break
+
+    for number, trade in enumerate(trades, start=1):
+        try:
+            date = _ofx_date(trade.get("date", ""))
+        except ValueError:
+            date = trade.get("date", "")
+        yield number, {
+            "date": date,
+            "ticker": tickers.get(trade.get("uniqueid", ""), ""),
+            "type": trade["type"],
+            "quantity": trade.get("quantity", ""),
+            "price": trade.get("price", ""),
+        }
+
+
+# --- Ingest ---
+
+class _PaperAccount:
+    """Running cash and share counts for validating a paper account's import in file order."""
+
+    def __init__(self, session: Session, user: User):
+        signed = case(
+            (Transaction.type == "buy", Transaction.quantity),
+            (Transaction.type == "sell", -Transaction.quantity),
+            else_=0.0,
+        )
+        self.shares = {
+            ticker.upper(): float(quantity or 0.0)
+            for ticker, quantity in session.exec(
+                select(Transaction.ticker, func.sum(signed))
+                .where(Transaction.user_id == user.id)
+                .group_by(Transaction.ticker)
+            ).all()
+        }
+        for ticker, quantity in reserved_shares_by_ticker(session, user.id).items():
+            self.shares[ticker] = self.shares.get(ticker, 0.0) - quantity
+        self.cash = user.cash_balance - reserved_cash(session, user.id)
+        self.cash_change = 0.0
+
+    def apply(self, row: dict):
+        value = row["quantity"] * row["price"]
+        if row["type"] == "buy":
+            if self.cash < value:
+                raise ValueError(f"Insufficient cash balance. Available: ${self.cash:.2f}, Required: ${value:.2f}")
+            self.cash -= value
+            self.cash_change -= value
+            self.shares[row["ticker"]] = self.shares.get(row["ticker"], 0.0) + row["quantity"]
+        else:
+            owned = self.shares.get(row["ticker"], 0.0)
+            if owned < row["quantity"]:
+                raise ValueError(f"Insufficient shares. Owned: {owned}, Selling: {row['quantity']}")
+            self.cash += value
+            self.cash_change += value
+            self.shares[row["ticker"]] = owned - row["quantity"]
+
+
+
+def parse(stream: IO[bytes], file_format: str) -> Iterator[Tuple[int, dict]]:
+    """Parsed rows of an upload in one of IMPORT_FORMATS."""
+    if IMPORT_FORMATS[file_format] == "csv":
+        return parse_csv(stream)
+    return parse_ofx(stream)
+
+
+def _validate(raw: dict) -> Optional[dict]:
+    """A Transaction row from parsed fields, None for non-trade rows. Raises ValueError."""
+    trade_type = _trade_type(raw["type"])
+    if trade_type is None:
+        return None
+    ticker = raw["ticker"].strip().upper()
+    if not ticker:
+        raise ValueError("Missing ticker")
+    try:
+        quantity = abs(_number(raw["quantity"]))
+        price = _number(raw["price"])
+    except ValueError:
+        raise ValueError(f"Invalid quantity or price: {raw['quantity']!r}, {raw['price']!r}")
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive")
+    if price < 0:
+        raise ValueError("Price must not be negative")
+    return {"ticker": ticker, "type": trade_type, "quantity": quantity, "price": price, "date": parse_date(raw["date"])}
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _rebuild_derived(
+    session: Session,
+    user: User,
+    earliest: datetime,
+    latest_existing: Optional[datetime],
+    last_existing_id: Optional[int]
+):
+    """Bring lots, positions, snapshots and the leaderboard up to date after an import."""
+    # Imported trades inside existing history change every later lot relief, so rebuild FIFO from scratch
+    if latest_existing is not None and earliest < latest_existing:
+        lots.delete_lots(session, user.id)
+        lots.ensure_lots(session, user.id)
+    elif not lots.ensure_lots(session, user.id):
+        lots.apply_transactions_fifo(session, user.id, after_id=last_existing_id)
+    snapshots.delete_snapshots(session, user.id, since=earliest.date())
+    session.commit()
+
+    invalidate_positions(user.id)
+    if user.paper_trading_enabled:
+        leaderboard.update_account(user, get_positions(session, user.id))
+
+
+def import_transactions(user_id: int, rows: Iterable[Tuple[int, dict]]) -> Iterator[dict]:
+    """
+    Validate and insert parsed rows chunk by chunk, yielding a progress report
+    after each chunk and a summary with per-row errors at the end (the CSV
+    line number, or the trade's position in an OFX file).
+    """
+    counts = {"rows": 0, "imported": 0, "skipped": 0, "rejected": 0}
+    errors: List[dict] = []
+    earliest: Optional[datetime] = None
+
+    with Session(engine) as session:
+        user = session.get(User, user_id)
+        paper = _PaperAccount(session, user) if user.paper_trading_enabled else None
+        latest_existing, last_existing_id = session.exec(
+            select(func.max(Transaction.date), func.max(Transaction.id)).where(Transaction.user_id == user_id)
+        ).one()
+
+        failure = None
+        try:
+            for chunk in _chunks(rows, IMPORT_CHUNK_ROWS):
+                batch = []
+                for line, raw in chunk:
+                    counts["rows"] += 1
+                    try:
+                        row = _validate(raw)
+                        if row is None:
+                            counts["skipped"] += 1
+                            continue
+                        if paper is not None:
+                            paper.apply(row)
+                    except ValueError as e:
+                        counts["rejected"] += 1
+                        if len(errors) < MAX_REPORTED_ERRORS:
+                            errors.append({"row": line, "error": str(e)})
+                        continue
+                    row["user_id"] = user_id
+                    batch.append(row)
+
+                if batch:
+                    session.execute(insert(Transaction.__table__), batch)
+                    ledger.record_many(session, user_id, [
+                        {
+                            "kind": row["type"], "ticker": row["ticker"], "quantity": row["quantity"],
+                            "price": row["price"], "date": row["date"],
+                            "cash_delta": (row["quantity"] * row["price"] * (1 if row["type"] == "sell" else -1))
+                            if paper is not None else 0.0,
+                        }
+                        for row in batch
+                    ])
+                    # Net cash of the batch in one conditional update, in case trades spent it meanwhile
+                    if paper is not None:
+                        if not adjust_cash(session, user, paper.cash_change):
+                            raise ValueError("Insufficient cash balance: the account changed during the import")
+                        paper.cash_change = 0.0
+                    session.commit()
+                    counts["imported"] += len(batch)
+                    first = min(row["date"] for row in batch)
+                    earliest = first if earliest is None else min(earliest, first)
+                yield {"status": "progress", **counts}
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            session.rollback()
+            failure = str(e)
+            logger.warning(f"Import for user {user_id} stopped after {counts['imported']} rows: {e}")
+        finally:
+            # Also when the client disconnects (GeneratorExit at a yield) or anything else fails:
+            # the chunks already committed must get their lots, snapshots and caches rebuilt
+            session.rollback()
+            if earliest is not None:
+                _rebuild_derived(session, user, earliest, latest_existing, last_existing_id)
+
+    summary = {"status": "error" if failure else "done", **counts, "errors": errors}
+    if failure:
+        summary["detail"] = failure
+    yield summary
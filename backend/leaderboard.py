@@ -0,0 +1,215 @@
+"""
+Paper Trading Leaderboard
+
+Ranks paper-trading accounts by return on net deposits. Account values are
+kept in memory and updated incrementally: a quote update revalues only the
+accounts holding that ticker, and a trade or cash movement revalues only
+that account. Rankings live in a SortedList (a B-tree-like list of
+sorted sublists), so moving an account, "my rank" and removal are all
+O(log n) and the top N is a slice.
+
+The board is loaded lazily on first use with one bulk query over all paper
+accounts, priced from cached quotes, then the latest end-of-day snapshots,
+then average cost.
+"""
+
+import logging
+import threading
+from typing import Dict, Optional, Set
+from sqlalchemy import case
+from sqlmodel import Session, select, func
+from sortedcontainers import SortedList
+from models import User, Transaction, PortfolioSnapshot
+import market_data
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 100
+
+
+def display_handle(email: str) -> str:
+    """Public name for an account that doesn't expose the email address."""
+    local = email.split("@")[0]
+    if local.startswith("guest_"):
+        return f"Guest {local[6:10]}"
+    return local[:2] + "***"
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._accounts: Dict[int, dict] = {}
+        self._holders: Dict[str, Set[int]] = {}
+        self._prices: Dict[str, float] = {}
+        self._ranking = SortedList()  # (-return, user_id)
+
+    # --- internal, called with _lock held ---
+
+    def _value(self, account: dict) -> float:
+        return account["cash"] + sum(qty * self._prices.get(t, 0.0) for t, qty in account["shares"].items())
+
+    def _rank_key(self, user_id: int, account: dict) -> tuple:
+        net = account["net_deposits"]
+        return (-((account["value"] - net) / net) if net > 0 else 0.0, user_id)
+
+    def _place(self, user_id: int, account: dict):
+        """Recompute an account's value and move it to its new position in the ranking."""
+        old_key = account.get("key")
+        if old_key is not None:
+            self._ranking.discard(old_key)
+        account["value"] = self._value(account)
+        account["key"] = self._rank_key(user_id, account)
+        self._ranking.add(account["key"])
+
+    def _drop(self, user_id: int):
+        account = self._accounts.pop(user_id, None)
+        if account is None:
+            return
+        self._ranking.discard(account["key"])
+        for ticker in account["shares"]:
+            holders = self._holders.get(ticker)
+            if holders:
+                holders.discard(user_id)
+
+    def _set(self, user_id: int, handle: str, shares: Dict[str, float], cash: float, net_deposits: float):
+        self._drop(user_id)
+        account = {"handle": handle, "shares": shares, "cash": cash, "net_deposits": net_deposits}
+        for ticker in shares:
+            self._holders.setdefault(ticker, set()).add(user_id)
+        self._accounts[user_id] = account
+        self._place(user_id, account)
+
+    def _entry(self, rank: int, user_id: int) -> dict:
+        account = self._accounts[user_id]
+        net = account["net_deposits"]
+        return {
+            "rank": rank,
+            "user": account["handle"],
+            "total_value": account["value"],
+            "net_deposits": net,
+            "return_pct": (account["value"] - net) / net * 100 if net > 0 else 0.0,
+        }
+
+    # --- public ---
+
+    def ensure_loaded(self, session: Session):
+        """Build the board from the database on first use."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load(session)
+
+    def _load(self, session: Session):
+        users = session.exec(
+            select(User.id, User.email, User.cash_balance, User.total_deposited, User.total_withdrawn)
+            .where(User.paper_trading_enabled == True)  # noqa: E712
+        ).all()
+        signed = case(
+            (Transaction.type == "buy", Transaction.quantity),
+            (Transaction.type == "sell", -Transaction.quantity),
+            else_=0.0,
+        )
+        bought = case((Transaction.type == "buy", Transaction.quantity), else_=0.0)
+        rows = session.exec(
+            select(
+                Transaction.user_id, Transaction.ticker, func.sum(signed),
+                func.sum(bought * Transaction.price), func.sum(bought)
+            )
+            .join(User, User.id == Transaction.user_id)
+            .where(User.paper_trading_enabled == True)  # noqa: E712
+            .group_by(Transaction.user_id, Transaction.ticker)
+        ).all()
+
+        shares: Dict[int, Dict[str, float]] = {}
+        prices: Dict[str, float] = {}
+        for user_id, ticker, quantity, buy_value, buy_quantity in rows:
+            if quantity and quantity > 0:
+                user_shares = shares.setdefault(user_id, {})
+                user_shares[ticker.upper()] = user_shares.get(ticker.upper(), 0.0) + float(quantity)
+                if buy_quantity:
+                    prices.setdefault(ticker.upper(), float(buy_value) / float(buy_quantity))
+
+        # Cached quotes over the latest snapshot prices over average cost, never a live fetch here
+        latest = session.exec(select(func.max(PortfolioSnapshot.snapshot_date))).one()
+        if latest is not None:
+            for holdings in session.exec(
+                select(PortfolioSnapshot.holdings).where(PortfolioSnapshot.snapshot_date == latest)
+            ).all():
+                for holding in holdings or []:
+                    prices[holding["ticker"].upper()] = holding["price"]
+        for ticker in {t for user_shares in shares.values() for t in user_shares}:
+            quote = market_data.peek_quote(ticker)
+            if quote:
+                prices[ticker] = quote["price"]
+
+        with self._lock:
+            self._prices.update(prices)
+            for user_id, email, cash, deposited, withdrawn in users:
+                self._set(
+                    user_id, display_handle(email), shares.get(user_id, {}),
+                    float(cash or 0.0), float((deposited or 0.0) - (withdrawn or 0.0))
+                )
+            self._loaded = True
+        logger.info(f"Leaderboard loaded with {len(users)} paper trading accounts")
+
+    def update_account(self, user: User, positions: Dict[str, dict]):
+        """Revalue one account after its trades or cash change; positions as from positions.get_positions."""
+        if not self._loaded:
+            return
+        shares = {}
+        with self._lock:
+            if not user.paper_trading_enabled:
+                self._drop(user.id)
+                return
+            for ticker, position in positions.items():
+                if position["quantity"] <= 0:
+                    continue
+                key = ticker.upper()
+                shares[key] = shares.get(key, 0.0) + position["quantity"]
+                if key not in self._prices:
+                    quote = market_data.peek_quote(key)
+                    self._prices[key] = quote["price"] if quote else position["total_cost"] / position["quantity"]
+            self._set(
+                user.id, display_handle(user.email), shares,
+                user.cash_balance, user.total_deposited - user.total_withdrawn
+            )
+
+    def remove_user(self, user_id: int):
+        with self._lock:
+            self._drop(user_id)
+
+    def on_quote(self, quote: dict):
+        """Quote listener: revalue only the accounts holding this ticker."""
+        if not self._loaded:
+            return
+        ticker = quote["ticker"]
+        with self._lock:
+            if self._prices.get(ticker) == quote["price"]:
+                return
+            self._prices[ticker] = quote["price"]
+            for user_id in self._holders.get(ticker, ()):
+                self._place(user_id, self._accounts[user_id])
+
+    def top(self, limit: int = DEFAULT_TOP_N) -> dict:
+        with self._lock:
+            return {
+                "total": len(self._ranking),
+                "leaders": [self._entry(i + 1, key[1]) for i, key in enumerate(self._ranking[:limit])],
+            }
+
+    def rank(self, user_id: int) -> Optional[dict]:
+        with self._lock:
+            account = self._accounts.get(user_id)
+            if account is None:
+                return None
+            position = self._ranking.bisect_left(account["key"])
+            return {**self._entry(position + 1, user_id), "total": len(self._ranking)}
+
+
+board = Leaderboard()
+market_data.add_quote_listener(board.on_quote)
@@ -0,0 +1,301 @@
+"""
+Account Ledger
+
+An append-only log of every event that changes a paper-trading account:
+deposits, withdrawals, buys, sells and resets. Events are only ever
+inserted. User.cash_balance and the Transaction/CashTransaction tables are
+fast read models of the current state, and the ledger can rebuild them.
+
+A reset starts a new epoch instead of erasing the account's past: the
+reset event zeroes cash and positions for replay, and everything before it
+stays in the log. The working tables only hold the current epoch.
+
+Any account's state as of any moment is its nearest earlier LedgerSnapshot
+plus the events appended after it. A background job snapshots accounts
+with LEDGER_SNAPSHOT_EVERY or more events past their latest snapshot, so
+that tail stays short. As-of queries go by when an event was recorded,
+which is append order, not by the trade date an import may have backdated.
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import case, insert
+from sqlmodel import Session, select, func
+from database import engine
+from models import User, Transaction, LedgerEvent, LedgerSnapshot
+from money import to_units, from_units
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_KINDS = ("opening", "reset", "deposit", "withdrawal", "buy", "sell")
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "200"))
+LEDGER_SNAPSHOT_MINUTES = float(os.getenv("LEDGER_SNAPSHOT_MINUTES", "15"))
+
+_EVENT_COLUMNS = ("user_id", "kind", "ticker", "quantity", "price", "cash_delta", "note", "date", "recorded_at")
+
+
+def _current_epoch(user_id: int):
+    return (
+        select(func.coalesce(func.max(LedgerEvent.epoch), 0))
+        .where(LedgerEvent.user_id == user_id)
+        .scalar_subquery()
+    )
+
+
+def record(
+    session: Session,
+    user_id: int,
+    kind: str,
+    cash_delta: float = 0.0,
+    ticker: Optional[str] = None,
+    quantity: Optional[float] = None,
+    price: Optional[float] = None,
+    note: Optional[str] = None,
+    date: Optional[datetime] = None
+):
+    """Append one event in the caller's transaction. A reset opens the next epoch."""
+    record_many(session, user_id, [{
+        "kind": kind, "cash_delta": cash_delta, "ticker": ticker,
+        "quantity": quantity, "price": price, "note": note, "date": date,
+    }])
+
+
+def record_many(session: Session, user_id: int, events: List[dict]):
+    """Append events in order with one executemany insert, in the caller's transaction."""
+    if not events:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {
+            column: event.get(column) for column in _EVENT_COLUMNS
+        } | {
+            "user_id": user_id,
+            "ticker": event["ticker"].upper() if event.get("ticker") else None,
+            "cash_delta": event.get("cash_delta") or 0.0,
+            "date": event.get("date") or now,
+            "recorded_at": now,
+        }
+        for event in events
+    ]
+    if any(row["kind"] == "reset" for row in rows):
+        # Resets are appended alone, so the epoch bump applies to exactly one row
+        for row in rows:
+            epoch = _current_epoch(user_id) + (1 if row["kind"] == "reset" else 0)
+            session.execute(insert(LedgerEvent.__table__).values(epoch=epoch, **row))
+        return
+    session.execute(insert(LedgerEvent.__table__).values(epoch=_current_epoch(user_id)), rows)
+
+
+def data_version(session: Session, user_id: int) -> int:
+    """
+    The user's latest event id. Every trade, cash movement and reset appends
+    one, so it changes exactly when their holdings or cash do.
+    """
+    return session.exec(select(func.coalesce(func.max(LedgerEvent.id), 0)).where(LedgerEvent.user_id == user_id)).one()
+
+
+# --- Replay ---
+
+class _State:
+    """Account state in fixed-point units while replaying events."""
+
+    def __init__(self, snapshot: Optional[LedgerSnapshot] = None):
+        if snapshot is None:
+            self.reset(0)
+            self.event_id = None
+            self.recorded_at = None
+            return
+        self.epoch = snapshot.epoch
+        self.cash = int(to_units(snapshot.cash_balance))
+        self.deposited = int(to_units(snapshot.total_deposited))
+        self.withdrawn = int(to_units(snapshot.total_withdrawn))
+        self.positions = {ticker: int(to_units(quantity)) for ticker, quantity in (snapshot.positions or {}).items()}
+        self.event_id = snapshot.event_id
+        self.recorded_at = snapshot.recorded_at
+
+    def reset(self, epoch: int):
+        self.epoch = epoch
+        self.cash = self.deposited = self.withdrawn = 0
+        self.positions: Dict[str, int] = {}
+
+    def apply(self, event_id, epoch, kind, ticker, quantity, cash_delta, recorded_at):
+        if kind in ("reset", "opening"):
+            self.reset(epoch)
+        delta = int(to_units(cash_delta or 0.0))
+        self.cash += delta
+        if kind == "deposit":
+            self.deposited += delta
+        elif kind == "withdrawal":
+            self.withdrawn -= delta
+        elif kind in ("buy", "sell"):
+            units = int(to_units(quantity)) * (1 if kind == "buy" else -1)
+            held = self.positions.get(ticker, 0) + units
+            if held:
+                self.positions[ticker] = held
+            else:
+                self.positions.pop(ticker, None)
+        self.event_id = event_id
+        self.recorded_at = recorded_at
+
+    def as_dict(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "event_id": self.event_id,
+            "recorded_at": self.recorded_at,
+            "cash_balance": from_units(self.cash),
+            "total_deposited": from_units(self.deposited),
+            "total_withdrawn": from_units(self.withdrawn),
+            "positions": {ticker: from_units(units) for ticker, units in sorted(self.positions.items())},
+        }
+
+
+def account_state(session: Session, user_id: int, as_of: Optional[datetime] = None) -> dict:
+    """
+    Cash, deposit/withdrawal totals and share positions as of a moment
+    (default now): the nearest snapshot at or before it plus the event tail.
+    """
+    query = select(LedgerSnapshot).where(LedgerSnapshot.user_id == user_id)
+    if as_of is not None:
+        query = query.where(LedgerSnapshot.recorded_at <= as_of)
+    snapshot = session.exec(query.order_by(LedgerSnapshot.event_id.desc()).limit(1)).first()
+
+    tail = (
+        select(
+            LedgerEvent.id, LedgerEvent.epoch, LedgerEvent.kind, LedgerEvent.ticker,
+            LedgerEvent.quantity, LedgerEvent.cash_delta, LedgerEvent.recorded_at
+        )
+        .where(LedgerEvent.user_id == user_id)
+        .order_by(LedgerEvent.id)
+    )
+    if snapshot is not None:
+        tail = tail.where(LedgerEvent.id > snapshot.event_id)
+    if as_of is not None:
+        tail = tail.where(LedgerEvent.recorded_at <= as_of)
+
+    state = _State(snapshot)
+    events = session.exec(tail).all()
+    for event in events:
+        state.apply(*event)
+    return {**state.as_dict(), "tail_events": len(events)}
+
+
+# --- Snapshots ---
+
+def _take_snapshot(session: Session, user_id: int) -> Optional[dict]:
+    state = account_state(session, user_id)
+    if state["event_id"] is None or not state["tail_events"]:
+        return None
+    session.add(LedgerSnapshot(
+        user_id=user_id,
+        event_id=state["event_id"],
+        epoch=state["epoch"],
+        recorded_at=state["recorded_at"],
+        cash_balance=state["cash_balance"],
+        total_deposited=state["total_deposited"],
+        total_withdrawn=state["total_withdrawn"],
+        positions=state["positions"],
+    ))
+    return state
+
+
+def snapshot_ledgers(min_events: int = LEDGER_SNAPSHOT_EVERY) -> int:
+    """
+    Snapshot every account with at least min_events events past its latest
+    snapshot. Also checks each one's User balance against the ledger and
+    logs any mismatch. Returns the number of snapshots written.
+    """
+    with Session(engine) as session:
+        latest = (
+            select(LedgerSnapshot.user_id, func.max(LedgerSnapshot.event_id).label("event_id"))
+            .group_by(LedgerSnapshot.user_id)
+            .subquery()
+        )
+        user_ids = session.exec(
+            select(LedgerEvent.user_id)
+            .outerjoin(latest, latest.c.user_id == LedgerEvent.user_id)
+            .where(LedgerEvent.id > func.coalesce(latest.c.event_id, 0))
+            .group_by(LedgerEvent.user_id)
+            .having(func.count() >= min_events)
+        ).all()
+
+        written = 0
+        for user_id in user_ids:
+            state = _take_snapshot(session, user_id)
+            if state is None:
+                continue
+            written += 1
+            user = session.get(User, user_id)
+            if user is not None and user.paper_trading_enabled and to_units(user.cash_balance) != to_units(state["cash_balance"]):
+                logger.warning(
+                    f"User {user_id} cash balance {user.cash_balance} differs from ledger {state['cash_balance']}"
+                )
+        session.commit()
+
+    if written:
+        logger.info(f"Stored {written} ledger snapshots")
+    return written
+
+
+def backfill(session: Session):
+    """
+    Open the ledger of accounts from before it existed: an opening event and
+    a snapshot holding their current cash, totals and positions.
+    """
+    has_events = select(LedgerEvent.user_id).distinct()
+    users = session.exec(
+        select(User).where(User.id.not_in(has_events)).where(
+            User.paper_trading_enabled | User.id.in_(select(Transaction.user_id).distinct())
+        )
+    ).all()
+    if not users:
+        return
+
+    signed = case((Transaction.type == "buy", Transaction.quantity), else_=-Transaction.quantity)
+    positions: Dict[int, Dict[str, float]] = {}
+    for user_id, ticker, quantity in session.exec(
+        select(Transaction.user_id, Transaction.ticker, func.sum(signed))
+        .where(Transaction.user_id.in_([user.id for user in users]))
+        .group_by(Transaction.user_id, Transaction.ticker)
+    ).all():
+        if to_units(quantity or 0.0):
+            positions.setdefault(user_id, {})[ticker.upper()] = from_units(to_units(quantity))
+
+    now = datetime.utcnow()
+    event_ids = session.execute(
+        insert(LedgerEvent.__table__).returning(LedgerEvent.__table__.c.id, sort_by_parameter_order=True),
+        [
+            {
+                "user_id": user.id, "epoch": 0, "kind": "opening",
+                "ticker": None, "quantity": None, "price": None, "note": "Opening balance",
+                "cash_delta": user.cash_balance if user.paper_trading_enabled else 0.0,
+                "date": now, "recorded_at": now,
+            }
+            for user in users
+        ],
+    ).scalars().all()
+    session.execute(insert(LedgerSnapshot.__table__), [
+        {
+            "user_id": user.id, "event_id": event_id, "epoch": 0, "recorded_at": now,
+            "cash_balance": user.cash_balance if user.paper_trading_enabled else 0.0,
+            "total_deposited": user.total_deposited if user.paper_trading_enabled else 0.0,
+            "total_withdrawn": user.total_withdrawn if user.paper_trading_enabled else 0.0,
+            "positions": positions.get(user.id, {}),
+        }
+        for user, event_id in zip(users, event_ids)
+    ])
+    session.commit()
+    logger.info(f"Opened the ledger for {len(users)} existing accounts")
+
+
+async def run_snapshotter():
+    """Snapshot long event tails every LEDGER_SNAPSHOT_MINUTES until cancelled."""
+    while True:
+        await asyncio.sleep(LEDGER_SNAPSHOT_MINUTES * 60)
+        try:
+            await asyncio.to_thread(snapshot_ledgers)
+        except Exception:
+            logger.exception("Ledger snapshot job failed")
@@ -1,11 +1,14 @@
 import os
 import json
 import logging
-from typing import Optional
+from datetime import datetime
+from typing import Optional, List
 from google import genai
 from google.genai import types
 from openai import OpenAI
 from duckduckgo_search import DDGS
+from response_cache import CACHE_ENABLED, ResponseCache, is_cacheable
+from http_client import get_client
 
 
 logger = logging.getLogger(__name__)
@@ -29,28 +32,100 @@ class LLMService:
                 self.openai_client = OpenAI(api_key=self.openai_key)
             except Exception as e:
                 logger.error(f"Failed to initialize OpenAI client: {e}")
+        
+        # Opt-in cache for generic market questions shared across users
+        self.response_cache = ResponseCache() if CACHE_ENABLED else None
+
+    async def generate_response(
+        self,
+        context: str,
+        user_query: str,
+        access_token: Optional[str] = None,
+        history: Optional[List[dict]] = None,
+        cache_key: Optional[str] = None
+    ) -> str:
+        """
+        Generate a reply to user_query.
 
-    async def generate_response(self, context: str, user_query: str, access_token: Optional[str] = None) -> str:
+        context is sent as the system prompt and should be kept stable across
+        turns so providers can cache it. history holds the earlier messages of
+        the conversation as {"role": "context" | "user" | "assistant", "content": str}.
+        """
+        history = history or []
+        
+        if self.response_cache and is_cacheable(user_query, history):
+            provider = "openai" if self.openai_client else "gemini"
+            cached = self.response_cache.lookup(provider, user_query)
+            if cached is not None:
+                logger.info("[Cache] Serving cached response")
+                return cached
+            
+            # Answer without the user's portfolio context so the reply is safe to share
+            shared_history = [{"role": "context", "content": f"Today is {datetime.now().strftime('%A, %B %d, %Y')}."}]
+            response = await self._generate(context, user_query, access_token, shared_history, cache_key)
+            if response and not response.startswith(("Error", "No AI API keys", "I apologize")):
+                self.response_cache.store(provider, user_query, response)
+            return response
+        
+        return await self._generate(context, user_query, access_token, history, cache_key)
+
+    async def _generate(
+        self,
+        context: str,
+        user_query: str,
+        access_token: Optional[str],
+        history: List[dict],
+        cache_key: Optional[str]
+    ) -> str:
         # Prioritize OpenAI for stability (simple ddgs, no MCP complexity)
         if self.openai_client:
-            return await self._generate_openai(context, user_query, access_token)
+            return await self._generate_openai(context, user_query, access_token, history, cache_key)
         elif self.gemini_client:
-            return await self._generate_gemini(context, user_query, access_token)
+            return await self._generate_gemini(context, user_query, access_token, history)
         else:
             return "No AI API keys found. Please set GEMINI_API_KEY or OPENAI_API_KEY in your environment variables."
 
-    async def _generate_gemini(self, context: str, user_query: str, access_token: Optional[str] = None) -> str:
+    @staticmethod
+    def _gemini_contents(history: List[dict], user_query: str) -> list:
+        """Convert history into Gemini contents, merging consecutive messages of the same role."""
+        contents = []
+        for message in history + [{"role": "user", "content": user_query}]:
+            role = "model" if message["role"] == "assistant" else "user"
+            if contents and contents[-1].role == role:
+                contents[-1].parts.append(types.Part(text=message["content"]))
+            else:
+                contents.append(types.Content(role=role, parts=[types.Part(text=message["content"])]))
+        return contents
+
+    @staticmethod
+    def _openai_messages(context: str, history: List[dict], user_query: str) -> list:
+        messages = [{"role": "system", "content": context}]
+        for message in history:
+            role = "system" if message["role"] == "context" else message["role"]
+            messages.append({"role": role, "content": message["content"]})
+        messages.append({"role": "user", "content": user_query})
+        return messages
+
+    async def _generate_gemini(
+        self,
+        context: str,
+        user_query: str,
+        access_token: Optional[str] = None,
+        history: Optional[List[dict]] = None
+    ) -> str:
         """Generate response using Gemini with Google Search grounding."""
+        history = history or []
         try:
             logger.info("[Gemini] Calling Gemini with Google Search...")
             
-            # Use Google Search grounding (built-in to Gemini)
+            # Use Google Search grounding (built-in to Gemini). The system instruction
+            # is identical across turns so implicit context caching can reuse it.
             grounding_tool = types.Tool(google_search=types.GoogleSearch())
-            config = types.GenerateContentConfig(tools=[grounding_tool])
+            config = types.GenerateContentConfig(tools=[grounding_tool], system_instruction=context)
             
             response = self.gemini_client.models.generate_content(
                 model="gemini-2.0-flash-lite",
-                contents=f"{context}\n\nUser Question: {user_query}",
+                contents=self._gemini_contents(history, user_query),
                 config=config
             )
             
@@ -71,14 +146,14 @@ class LLMService:
             
             logger.info("[Gemini] Empty response, falling back to OpenAI")
             if self.openai_client:
-                return self._generate_openai(context, user_query)
+                return await self._generate_openai(context, user_query, access_token, history)
             return "I apologize, but I couldn't generate a response."
                 
         except Exception as e:
             logger.error(f"[Gemini] Error: {e}")
             if self.openai_client:
                 logger.info("[Gemini] Falling back to OpenAI...")
-                return self._generate_openai(context, user_query)
+                return await self._generate_openai(context, user_query, access_token, history)
             return f"Error communicating with AI: {str(e)}"
 
     def _web_search(self, query: str) -> str:
@@ -93,65 +168,74 @@ class LLMService:
 
     async def _execute_portfolio_tool(self, tool_name: str, arguments: dict, access_token: str) -> str:
         """Execute portfolio management tools by calling the backend API."""
-        import httpx
         
         headers = {"Authorization": f"Bearer {access_token}"}
         api_url = os.getenv("PORTFOLIO_API_URL", "http://localhost:8080")
         
-        async with httpx.AsyncClient() as client:
-            try:
-                if tool_name == "buy_stock":
-                    transaction_data = {
-                        "ticker": arguments["ticker"].upper(),
-                        "type": "buy",
-                        "quantity": arguments["quantity"],
-                        "price": arguments["price"]
-                    }
-                    # Only add date if explicitly provided
-                    if arguments.get("date"):
-                        transaction_data["date"] = arguments["date"]
-                    
-                    response = await client.post(
-                        f"{api_url}/api/transactions",
-                        json=transaction_data,
-                        headers=headers
-                    )
-                    response.raise_for_status()
-                    return f"✅ Successfully bought {arguments['quantity']} shares of {arguments['ticker'].upper()} at ${arguments['price']:.2f}"
-                
-                elif tool_name == "sell_stock":
-                    transaction_data = {
-                        "ticker": arguments["ticker"].upper(),
-                        "type": "sell",
-                        "quantity": arguments["quantity"],
-                        "price": arguments["price"]
-                    }
-                    # Only add date if explicitly provided
-                    if arguments.get("date"):
-                        transaction_data["date"] = arguments["date"]
-                    
-                    response = await client.post(
-                        f"{api_url}/api/transactions",
-                        json=transaction_data,
-                        headers=headers
-                    )
-                    response.raise_for_status()
-                    return f"✅ Successfully sold {arguments['quantity']} shares of {arguments['ticker'].upper()} at ${arguments['price']:.2f}"
+        client = get_client()
+        try:
+            if tool_name == "buy_stock":
+                transaction_data = {
+                    "ticker": arguments["ticker"].upper(),
+                    "type": "buy",
+                    "quantity": arguments["quantity"],
+                    "price": arguments["price"]
+                }
+                # Only add date if explicitly provided
+                if arguments.get("date"):
+                    transaction_data["date"] = arguments["date"]
                 
-                elif tool_name == "get_stock_price":
-                    response = await client.get(
-                        f"{api_url}/api/stock/{arguments['ticker'].upper()}/current",
-                        headers=headers
-                    )
-                    response.raise_for_status()
-                    data = response.json()
-                    return f"📈 {arguments['ticker'].upper()}: ${data['price']:.2f}"
+                response = await client.post(
+                    f"{api_url}/api/transactions",
+                    json=transaction_data,
+                    headers=headers
+                )
+                response.raise_for_status()
+                return f"✅ Successfully bought {arguments['quantity']} shares of {arguments['ticker'].upper()} at ${arguments['price']:.2f}"
+            
+            elif tool_name == "sell_stock":
+                transaction_data = {
+                    "ticker": arguments["ticker"].upper(),
+                    "type": "sell",
+                    "quantity": arguments["quantity"],
+                    "price": arguments["price"]
+                }
+                # Only add date if explicitly provided
+                if arguments.get("date"):
+                    transaction_data["date"] = arguments["date"]
                 
-                return f"Unknown tool: {tool_name}"
-            except Exception as e:
-                return f"Error executing {tool_name}: {str(e)}"
+                response = await client.post(
+                    f"{api_url}/api/transactions",
+                    json=transaction_data,
+                    headers=headers
+                )
+                response.raise_for_status()
+                return f"✅ Successfully sold {arguments['quantity']} shares of {arguments['ticker'].upper()} at ${arguments['price']:.2f}"
+            
+            elif tool_name == "get_stock_price":
+                response = await client.get(
+                    f"{api_url}/api/stock/{arguments['ticker'].upper()}/current",
+                    headers=headers
+                )
+                response.raise_for_status()
+                data = response.json()
+                return f"📈 {arguments['ticker'].upper()}: ${data['price']:.2f}"
+            
+            return f"Unknown tool: {tool_name}"
+        except Exception as e:
+            return f"Error executing {tool_name}: {str(e)}"
 
-    async def _generate_openai(self, context: str, user_query: str, access_token: str = None) -> str:
+    async def _generate_openai(
+        self,
+        context: str,
+        user_query: str,
+        access_token: str = None,
+        history: Optional[List[dict]] = None,
+        cache_key: Optional[str] = None
+    ) -> str:
+        # Identical leading messages let OpenAI serve the prefix from its prompt cache;
+        # the cache key keeps a user's turns routed to the same cache.
+        extra_body = {"prompt_cache_key": cache_key} if cache_key else None
         try:
             # Define the tools available to OpenAI
             tools = [
@@ -241,17 +325,15 @@ class LLMService:
                 }
             ]
 
-            messages = [
-                {"role": "system", "content": context},
-                {"role": "user", "content": user_query}
-            ]
+            messages = self._openai_messages(context, history or [], user_query)
 
             # First call: Ask OpenAI
             response = self.openai_client.chat.completions.create(
                 model="gpt-4o", 
                 messages=messages,
                 tools=tools,
-                tool_choice="auto"
+                tool_choice="auto",
+                extra_body=extra_body
             )
             
             response_message = response.choices[0].message
@@ -291,7 +373,8 @@ class LLMService:
                 # Second call: Get the final answer from OpenAI using the tool results
                 second_response = self.openai_client.chat.completions.create(
                     model="gpt-4o",
-                    messages=messages
+                    messages=messages,
+                    extra_body=extra_body
                 )
                 return second_response.choices[0].message.content
             
@@ -0,0 +1,354 @@
+"""
+Tax Lots
+
+Every buy opens a lot and every sell relieves open lots of the same ticker,
+first-in-first-out, last-in-first-out or by specific lot IDs. Each relief is
+stored with its exact cost and proceeds, so realized P/L per sale is a sum
+over stored rows instead of a replay of the full transaction history.
+
+Lots are updated incrementally as transactions are added. A sale only
+relieves lots opened on or before its date, so a trade dated before the
+ticker's later ones redoes that ticker's lots from its date, FIFO. Accounts
+with transactions from before lot tracking are backfilled once, FIFO, on
+first use.
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+from sqlalchemy import bindparam, insert, update
+from sqlmodel import Session, select, delete, func
+from models import Transaction, TaxLot, LotRelief
+from money import quantize, rounded
+
+
+RELIEF_METHODS = ("fifo", "lifo", "specific")
+EPSILON = 1e-9
+
+
+def parse_lot_ids(lot_ids: Optional[Union[str, List[int]]]) -> Optional[List[int]]:
+    """Parse lot IDs given as a comma-separated string or a list, raising ValueError on bad input."""
+    if not lot_ids:
+        return None
+    parts = lot_ids.split(",") if isinstance(lot_ids, str) else lot_ids
+    try:
+        return [int(part) for part in parts if str(part).strip()]
+    except ValueError:
+        raise ValueError("lot_ids must be a comma-separated list of lot IDs")
+
+
+def _open_lots(session: Session, user_id: int, ticker: str, as_of: datetime) -> List[TaxLot]:
+    return session.exec(
+        select(TaxLot)
+        .where(TaxLot.user_id == user_id)
+        .where(TaxLot.ticker == ticker)
+        .where(TaxLot.remaining_quantity > EPSILON)
+        .where(TaxLot.open_date <= as_of)
+        .order_by(TaxLot.open_date, TaxLot.id)
+    ).all()
+
+
+def _select_lots(lots: List[TaxLot], quantity: float, method: str, lot_ids: Optional[List[int]]) -> List[TaxLot]:
+    """Order the open lots in the sequence a sale should relieve them."""
+    if method == "fifo":
+        return lots
+    if method == "lifo":
+        return lots[::-1]
+    if method != "specific":
+        raise ValueError(f"Invalid lot method. Use one of: {', '.join(RELIEF_METHODS)}")
+
+    if not lot_ids:
+        raise ValueError("Specific-ID relief requires lot_ids")
+    by_id = {lot.id: lot for lot in lots}
+    unknown = [lot_id for lot_id in lot_ids if lot_id not in by_id]
+    if unknown:
+        raise ValueError(f"Lots not open for this ticker: {', '.join(map(str, unknown))}")
+    selected = [by_id[lot_id] for lot_id in dict.fromkeys(lot_ids)]
+    available = sum(lot.remaining_quantity for lot in selected)
+    if available < quantity - EPSILON:
+        raise ValueError(f"Selected lots hold {available} shares, selling {quantity}")
+    return selected
+
+
+def apply_transaction(
+    session: Session,
+    transaction: Transaction,
+    method: str = "fifo",
+    lot_ids: Optional[List[int]] = None
+) -> List[LotRelief]:
+    """
+    Open or relieve lots for a transaction already flushed to the session.
+
+    A sell relieves only lots opened by its date. Sells beyond those
+    (oversells on non-paper accounts) relieve what is there; the remainder has no cost basis and no realized P/L.
+    Raises ValueError for an invalid method or lot selection.
+    """
+    if transaction.type == "buy":
+        session.add(TaxLot(
+            ticker=transaction.ticker,
+            quantity=transaction.quantity,
+            remaining_quantity=transaction.quantity,
+            cost_per_share=transaction.price,
+            open_date=transaction.date,
+            transaction_id=transaction.id,
+            user_id=transaction.user_id,
+        ))
+        return []
+    if transaction.type != "sell":
+        return []
+
+    lots = _open_lots(session, transaction.user_id, transaction.ticker, transaction.date)
+    to_sell = transaction.quantity
+    reliefs = []
+
+    for lot in _select_lots(lots, to_sell, method, lot_ids):
+        if to_sell <= EPSILON:
+            break
+        quantity = min(lot.remaining_quantity, to_sell)
+        lot.remaining_quantity -= quantity
+        to_sell -= quantity
+
+        relief = LotRelief(
+            ticker=transaction.ticker,
+            quantity=quantity,
+            cost_per_share=lot.cost_per_share,
+            proceeds_per_share=transaction.price,
+            realized_pl=quantity * (transaction.price - lot.cost_per_share),
+            date=transaction.date,
+            lot_id=lot.id,
+            transaction_id=transaction.id,
+            user_id=transaction.user_id,
+        )
+        session.add(lot)
+        session.add(relief)
+        reliefs.append(relief)
+
+    return reliefs
+
+
+def apply_transactions_fifo(
+    session: Session,
+    user_id: int,
+    after_id: Optional[int] = None,
+    ticker: Optional[str] = None,
+    since: Optional[datetime] = None
+) -> int:
+    """
+    Apply FIFO lots for a user's transactions (those with id > after_id, or
+    of one ticker dated since on) in bulk: the replay runs in memory against
+    the open lots and the new lots, reliefs and remaining quantities are
+    written with executemany, instead of a query and flush per transaction.
+    Returns the transactions applied.
+    """
+    query = (
+        select(Transaction.id, Transaction.ticker, Transaction.type, Transaction.quantity, Transaction.price, Transaction.date)
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.date, Transaction.id)
+    )
+    lot_query = (
+        select(TaxLot.id, TaxLot.ticker, TaxLot.remaining_quantity, TaxLot.cost_per_share)
+        .where(TaxLot.user_id == user_id)
+        .where(TaxLot.remaining_quantity > EPSILON)
+        .order_by(TaxLot.open_date, TaxLot.id)
+    )
+    if after_id is not None:
+        query = query.where(Transaction.id > after_id)
+    if ticker is not None:
+        query = query.where(Transaction.ticker == ticker)
+        lot_query = lot_query.where(TaxLot.ticker == ticker)
+    if since is not None:
+        query = query.where(Transaction.date >= since)
+    transactions = session.exec(query).all()
+    if not transactions:
+        return 0
+
+    # Open lots per ticker, oldest first; each is [key, remaining, cost] where key is
+    # ("lot", id) for a stored lot or ("new", index) for one opened by this replay
+    queues: Dict[str, deque] = {}
+    for lot_id, ticker, remaining, cost in session.exec(lot_query).all():
+        queues.setdefault(ticker, deque()).append([("lot", lot_id), remaining, cost])
+
+    new_lots, reliefs, touched = [], [], {}
+    for transaction_id, ticker, kind, quantity, price, date in transactions:
+        queue = queues.setdefault(ticker, deque())
+        if kind == "buy":
+            lot = [("new", len(new_lots)), quantity, price]
+            new_lots.append({
+                "ticker": ticker, "quantity": quantity, "remaining_quantity": quantity, "cost_per_share": price,
+                "open_date": date, "transaction_id": transaction_id, "user_id": user_id,
+            })
+            queue.append(lot)
+        elif kind == "sell":
+            to_sell = quantity
+            while to_sell > EPSILON and queue:
+                lot = queue[0]
+                relieved = min(lot[1], to_sell)
+                lot[1] -= relieved
+                to_sell -= relieved
+                touched[lot[0]] = lot
+                reliefs.append({
+                    "ticker": ticker, "quantity": relieved, "cost_per_share": lot[2], "proceeds_per_share": price,
+                    "realized_pl": relieved * (price - lot[2]), "date": date, "lot": lot[0],
+                    "transaction_id": transaction_id, "user_id": user_id,
+                })
+                if lot[1] <= EPSILON:
+                    queue.popleft()
+
+    for (source, index), lot in touched.items():
+        if source == "new":
+            new_lots[index]["remaining_quantity"] = lot[1]
+    new_ids = []
+    if new_lots:
+        new_ids = session.execute(
+            insert(TaxLot.__table__).returning(TaxLot.__table__.c.id, sort_by_parameter_order=True), new_lots
+        ).scalars().all()
+    updates = [{"lot_id": key[1], "remaining": lot[1]} for key, lot in touched.items() if key[0] == "lot"]
+    if updates:
+        table = TaxLot.__table__
+        session.execute(
+            update(table).where(table.c.id == bindparam("lot_id")).values(remaining_quantity=bindparam("remaining")),
+            updates
+        )
+    if reliefs:
+        for relief in reliefs:
+            source, index = relief.pop("lot")
+            relief["lot_id"] = new_ids[index] if source == "new" else index
+        session.execute(insert(LotRelief.__table__), reliefs)
+    return len(transactions)
+
+
+def rebuild_lots(session: Session, user_id: int, ticker: str, since: datetime) -> int:
+    """
+    Redo a ticker's lots from a date on, FIFO, for a trade dated before
+    others already applied: reliefs from that date are undone, lots opened
+    since are dropped, and the ticker's transactions from that date are
+    replayed. Earlier reliefs, including specific-ID ones, are kept.
+    Returns the transactions replayed.
+    """
+    opened_since = select(TaxLot.id).where(
+        TaxLot.user_id == user_id, TaxLot.ticker == ticker, TaxLot.open_date >= since
+    )
+    undo = (
+        (LotRelief.user_id == user_id) & (LotRelief.ticker == ticker)
+        & ((LotRelief.date >= since) | LotRelief.lot_id.in_(opened_since))
+    )
+    restored = session.exec(
+        select(LotRelief.lot_id, func.sum(LotRelief.quantity)).where(undo).group_by(LotRelief.lot_id)
+    ).all()
+    if restored:
+        table = TaxLot.__table__
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("lot_id"))
+            .values(remaining_quantity=rounded(table.c.remaining_quantity + bindparam("relieved"))),
+            [{"lot_id": lot_id, "relieved": quantity} for lot_id, quantity in restored]
+        )
+    session.exec(delete(LotRelief).where(undo))
+    session.exec(delete(TaxLot).where(TaxLot.id.in_(opened_since)))
+    return apply_transactions_fifo(session, user_id, ticker=ticker, since=since)
+
+
+def ensure_lots(session: Session, user_id: int) -> bool:
+    """
+    Backfill lots FIFO for a user whose transactions predate lot tracking.
+
+    Must run before a new transaction is added to the session. Returns True
+    if anything was written, in which case the caller commits.
+    """
+    if session.exec(select(TaxLot.id).where(TaxLot.user_id == user_id).limit(1)).first() is not None:
+        return False
+    return apply_transactions_fifo(session, user_id) > 0
+
+
+def delete_lots(session: Session, user_id: int):
+    """Remove a user's lots and reliefs, ahead of deleting their transactions."""
+    session.exec(delete(LotRelief).where(LotRelief.user_id == user_id))
+    session.exec(delete(TaxLot).where(TaxLot.user_id == user_id))
+
+
+def open_lots(session: Session, user_id: int) -> List[dict]:
+    """All open lots, oldest first within each ticker."""
+    lots = session.exec(
+        select(TaxLot)
+        .where(TaxLot.user_id == user_id)
+        .where(TaxLot.remaining_quantity > EPSILON)
+        .order_by(TaxLot.ticker, TaxLot.open_date, TaxLot.id)
+    ).all()
+    return [
+        {
+            "lot_id": lot.id,
+            "ticker": lot.ticker,
+            "open_date": lot.open_date,
+            "quantity": lot.quantity,
+            "remaining_quantity": lot.remaining_quantity,
+            "cost_per_share": lot.cost_per_share,
+            "cost_basis": lot.remaining_quantity * lot.cost_per_share,
+        }
+        for lot in lots
+    ]
+
+
+def lot_cost_basis(session: Session, user_id: int) -> Dict[str, float]:
+    """Cost basis of the open lots per ticker."""
+    rows = session.exec(
+        select(TaxLot.ticker, func.sum(TaxLot.remaining_quantity * TaxLot.cost_per_share))
+        .where(TaxLot.user_id == user_id)
+        .where(TaxLot.remaining_quantity > EPSILON)
+        .group_by(TaxLot.ticker)
+    ).all()
+    return {ticker: quantize(cost or 0.0) for ticker, cost in rows}
+
+
+def realized_by_ticker(session: Session, user_id: int) -> Dict[str, float]:
+    """Realized P/L of the relieved lots per ticker."""
+    rows = session.exec(
+        select(LotRelief.ticker, func.sum(LotRelief.realized_pl))
+        .where(LotRelief.user_id == user_id)
+        .group_by(LotRelief.ticker)
+    ).all()
+    return {ticker: quantize(total or 0.0) for ticker, total in rows}
+
+
+def total_realized_pl(session: Session, user_id: int) -> float:
+    total = session.exec(select(func.sum(LotRelief.realized_pl)).where(LotRelief.user_id == user_id)).one()
+    return float(total or 0.0)
+
+
+def realized_sales(session: Session, user_id: int) -> dict:
+    """Realized P/L per sale, with the lots each sale relieved, plus per-ticker totals."""
+    reliefs = session.exec(
+        select(LotRelief)
+        .where(LotRelief.user_id == user_id)
+        .order_by(LotRelief.date, LotRelief.transaction_id, LotRelief.id)
+    ).all()
+
+    sales: Dict[int, dict] = {}
+    by_ticker: Dict[str, float] = {}
+    for relief in reliefs:
+        sale = sales.setdefault(relief.transaction_id, {
+            "transaction_id": relief.transaction_id,
+            "ticker": relief.ticker,
+            "date": relief.date,
+            "quantity": 0.0,
+            "proceeds": 0.0,
+            "cost_basis": 0.0,
+            "realized_pl": 0.0,
+            "lots": [],
+        })
+        sale["quantity"] += relief.quantity
+        sale["proceeds"] += relief.quantity * relief.proceeds_per_share
+        sale["cost_basis"] += relief.quantity * relief.cost_per_share
+        sale["realized_pl"] += relief.realized_pl
+        sale["lots"].append({
+            "lot_id": relief.lot_id,
+            "quantity": relief.quantity,
+            "cost_per_share": relief.cost_per_share,
+            "realized_pl": relief.realized_pl,
+        })
+        by_ticker[relief.ticker] = by_ticker.get(relief.ticker, 0.0) + relief.realized_pl
+
+    return {
+        "sales": list(sales.values()),
+        "by_ticker": by_ticker,
+        "total_realized_pl": sum(by_ticker.values()),
+    }
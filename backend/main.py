@@ -1,14 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends, Body, APIRouter, status, Header, Query
+from fastapi import FastAPI, HTTPException, Depends, Body, APIRouter, status, Header, Query, UploadFile, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session, select, delete
 from database import create_db_and_tables, engine, get_session
-from models import Transaction, Watchlist, User, CashTransaction
+from models import Transaction, Watchlist, User, CashTransaction, PortfolioSnapshot, Order, PriceAlert, LedgerEvent
+from positions import get_open_positions, get_positions, invalidate_positions, lot_holdings
+from leaderboard import board as leaderboard, DEFAULT_TOP_N, MAX_TOP_N
+import lots
+from analytics import (
+    HISTORY_PERIODS,
+    load_cash_flows,
+    load_ledger,
+    period_start,
+    portfolio_analytics,
+    portfolio_history,
+    snapshot_history,
+    tickers_held_since
+)
+import market_data
+from risk import portfolio_risk
+import snapshots
+import orders
+import alerts
+import backtest
+import rebalance
+import importer
+import reports
+import guests
+import ledger
+import http_cache
+import spa
+from compression import CompressionMiddleware
+from money import quantize, to_units, from_units
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PAGE_ORDERS, keyset_page, select_rows, export_ndjson
+from trading import TradeError, adjust_cash, record_transaction
+from http_client import close_client
 import yfinance as yf
-from typing import List, Dict
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
 import os
 import json
+import orjson
+import asyncio
 from datetime import datetime
 from auth import (
     get_password_hash, 
@@ -35,7 +71,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# orjson serializes NumPy values and datetimes natively; hot list endpoints return it directly
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 origins = [
@@ -51,11 +88,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(CompressionMiddleware)
 
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    with Session(engine) as session:
+        ledger.backfill(session)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.background_tasks = [
+        asyncio.create_task(market_data.run_refresher()),
+        asyncio.create_task(orders.run_book_sync()),
+        asyncio.create_task(alerts.run_index_sync()),
+    ]
+    if snapshots.SNAPSHOT_SCHEDULER:
+        app.state.background_tasks.append(asyncio.create_task(snapshots.run_scheduler()))
+    if guests.GUEST_REAPER:
+        app.state.background_tasks.append(asyncio.create_task(guests.run_reaper()))
+    app.state.background_tasks.append(asyncio.create_task(ledger.run_snapshotter()))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in getattr(app.state, "background_tasks", []):
+        task.cancel()
+    backtest.shutdown()
+    await close_client()
 
 # --- Auth Endpoints ---
 
@@ -128,6 +189,8 @@ def guest_login(session: Session = Depends(get_session)):
     
     guest_user = User(email=guest_email, is_guest=True, provider="guest")
     session.add(guest_user)
+    session.flush()
+    guests.register_guest(session, guest_user)
     session.commit()
     
     access_token = create_access_token(data={"sub": guest_email})
@@ -146,36 +209,30 @@ def read_users_me(current_user: User = Depends(get_current_user)):
 @api_router.post("/auth/logout")
 def logout(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     if current_user.is_guest:
-        # Fetch the user in the current session
-        user = session.get(User, current_user.id)
-        if user:
-            # Delete all guest user's transactions
-            transactions = session.exec(select(Transaction).where(Transaction.user_id == user.id)).all()
-            for transaction in transactions:
-                session.delete(transaction)
-            
-            # Delete all guest user's watchlist items
-            watchlist_items = session.exec(select(Watchlist).where(Watchlist.user_id == user.id)).all()
-            for item in watchlist_items:
-                session.delete(item)
-            
-            # Delete the guest user
-            session.delete(user)
-            session.commit()
-            
-            return {"message": "Guest user and all data deleted"}
+        # All of the guest's data goes in one transaction, a DELETE per table
+        guests.delete_users(session, [current_user.id])
+        session.commit()
+        return {"message": "Guest user and all data deleted"}
     
     return {"message": "Logged out"}
 
 # --- Watchlist Endpoints ---
 
-@api_router.get("/watchlist", response_model=List[Watchlist])
+@api_router.get("/watchlist")
 def get_watchlist(
+    request: Request,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    watchlist = session.exec(select(Watchlist).where(Watchlist.user_id == current_user.id)).all()
-    return watchlist
+    """Watchlist rows as {id, ticker, user_id}"""
+    rows = session.exec(
+        select(Watchlist.id, Watchlist.ticker).where(Watchlist.user_id == current_user.id).order_by(Watchlist.id)
+    ).all()
+    tag = http_cache.etag(current_user.id, [tuple(row) for row in rows], weak=True)
+    return http_cache.respond(
+        request, tag, http_cache.PRIVATE,
+        lambda: [{"id": row_id, "ticker": ticker, "user_id": current_user.id} for row_id, ticker in rows]
+    )
 
 @api_router.post("/watchlist", response_model=Watchlist)
 def add_to_watchlist(
@@ -203,6 +260,44 @@ def add_to_watchlist(
     session.refresh(item)
     return item
 
+@api_router.get("/watchlist/quotes")
+def get_watchlist_quotes(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Watchlist items with their current quotes in a single round trip"""
+    watchlist = session.exec(select(Watchlist).where(Watchlist.user_id == current_user.id)).all()
+    quotes = market_data.get_quotes(item.ticker for item in watchlist)
+    
+    results = []
+    for item in watchlist:
+        quote = quotes.get(item.ticker.upper())
+        results.append({
+            "id": item.id,
+            "ticker": item.ticker,
+            "price": quote["price"] if quote else None,
+            "previous_close": quote["previous_close"] if quote else None,
+            "company_name": quote["company_name"] if quote else item.ticker
+        })
+    return results
+
+@api_router.delete("/watchlist/ticker/{ticker}")
+def remove_ticker_from_watchlist(
+    ticker: str,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    alerts.delete_alerts(session, current_user.id, ticker=ticker)
+    result = session.exec(
+        delete(Watchlist)
+        .where(Watchlist.user_id == current_user.id)
+        .where(Watchlist.ticker == ticker.upper())
+    )
+    session.commit()
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail=f"{ticker.upper()} is not in your watchlist")
+    return {"ok": True}
+
 @api_router.delete("/watchlist/{item_id}")
 def remove_from_watchlist(
     item_id: int, 
@@ -212,25 +307,148 @@ def remove_from_watchlist(
     item = session.get(Watchlist, item_id)
     if not item or item.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Item not found")
+    alerts.delete_alerts(session, current_user.id, watchlist_id=item.id)
     session.delete(item)
     session.commit()
     return {"ok": True}
 
+# --- Price Alert Endpoints ---
+
+@api_router.post("/alerts", response_model=PriceAlert)
+def create_alert(
+    alert: PriceAlert,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Alert when a watchlist ticker goes above or below a threshold"""
+    try:
+        return alerts.create_alert(session, current_user, alert.ticker, alert.direction, alert.threshold, alert.note)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/alerts", response_model=List[PriceAlert])
+def get_alerts(
+    status: Optional[str] = Query(default=None),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """List alerts, optionally only pending, active or triggered ones"""
+    if status and status not in alerts.ALERT_STATUSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid status. Use one of: {', '.join(alerts.ALERT_STATUSES)}"
+        )
+    return alerts.list_alerts(session, current_user.id, status)
+
+@api_router.get("/alerts/stream")
+async def stream_alerts(
+    token: str = Query(..., description="Access token; EventSource can't send headers")
+):
+    """Server-Sent Events stream of the user's alerts as they fire"""
+    # A short-lived session, so the open stream doesn't hold a pooled connection
+    def authenticate():
+        with Session(engine) as session:
+            return get_current_user(token, session)
+    user = await run_in_threadpool(authenticate)
+    return StreamingResponse(
+        alerts.hub.stream(user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.delete("/alerts/{alert_id}")
+def delete_alert(
+    alert_id: int,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    if not alerts.delete_alert(session, current_user.id, alert_id):
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return {"ok": True}
+
 # --- Transaction Endpoints ---
 
-@api_router.get("/transactions", response_model=List[Transaction])
+def _date_range(model, start: Optional[str], end: Optional[str]) -> list:
+    """Conditions for a model's date between start and end (inclusive days, YYYY-MM-DD)."""
+    conditions = []
+    try:
+        if start:
+            conditions.append(model.date >= datetime.strptime(start, "%Y-%m-%d"))
+        if end:
+            conditions.append(model.date < datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    return conditions
+
+def _orjson(data) -> ORJSONResponse:
+    """Serialize straight to orjson, skipping jsonable_encoder"""
+    return ORJSONResponse(data)
+
+def _ledger_response(
+    session: Session, model, columns: List[str], conditions: list, order: str,
+    limit: Optional[int], cursor: Optional[str], format: str, paginate: bool
+):
+    """
+    A plain list of rows: all of them, or one page when limit or cursor is
+    given, with the next page's cursor in X-Next-Cursor. paginate=True
+    returns the {"items", "next_cursor"} envelope instead.
+    """
+    if order not in PAGE_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Invalid order. Use one of: {', '.join(PAGE_ORDERS)}")
+    if format == "ndjson":
+        return StreamingResponse(export_ndjson(model, columns, conditions, order), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="Invalid format. Use json or ndjson")
+    if not paginate and limit is None and cursor is None:
+        return _orjson(select_rows(session, model, columns, conditions, order))
+    try:
+        page = keyset_page(session, model, columns, conditions, order, limit or DEFAULT_PAGE_SIZE, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if paginate:
+        return _orjson(page)
+    headers = {"X-Next-Cursor": page["next_cursor"]} if page["next_cursor"] else None
+    return ORJSONResponse(page["items"], headers=headers)
+
+@api_router.get("/transactions")
 def get_transactions(
     session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    ticker: Optional[str] = None,
+    type: Optional[str] = Query(default=None, description="buy or sell"),
+    start: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    end: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    order: str = Query(default="desc"),
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="page size; every row if omitted"),
+    cursor: Optional[str] = None,
+    paginate: bool = Query(default=False, description="return {items, next_cursor} instead of a list"),
+    format: str = Query(default="json", description="json for a list or page, ndjson to export every match")
 ):
-    transactions = session.exec(select(Transaction).where(Transaction.user_id == current_user.id)).all()
-    return transactions
+    """
+    Transactions ordered by (date, id), newest first by default.
+    
+    Returns a list of every match, or of one page with limit; the next page's
+    cursor is in the X-Next-Cursor header, to pass back as cursor.
+    paginate=true returns {"items", "next_cursor"} instead, and format=ndjson
+    streams every matching row.
+    """
+    conditions = [Transaction.user_id == current_user.id, *_date_range(Transaction, start, end)]
+    if ticker:
+        conditions.append(Transaction.ticker == ticker.upper())
+    if type:
+        conditions.append(Transaction.type == type.lower())
+    return _ledger_response(
+        session, Transaction, ["id", "ticker", "type", "quantity", "price", "date", "user_id"],
+        conditions, order, limit, cursor, format, paginate
+    )
 
 @api_router.post("/transactions", response_model=Transaction)
 def add_transaction(
     transaction: Transaction, 
     session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    lot_method: str = "fifo",
+    lot_ids: Optional[str] = None
 ):
     # Force conversion if it's a string
     if isinstance(transaction.date, str):
@@ -240,47 +458,41 @@ def add_transaction(
         except ValueError:
             pass
     
-    # Paper trading: Check cash balance and update
-    if current_user.paper_trading_enabled:
-        transaction_value = transaction.quantity * transaction.price
-        
-        if transaction.type == "buy":
-            # Check if user has enough cash
-            if current_user.cash_balance < transaction_value:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Insufficient cash balance. Available: ${current_user.cash_balance:.2f}, Required: ${transaction_value:.2f}"
-                )
-            # Deduct cash
-            current_user.cash_balance -= transaction_value
-            
-        elif transaction.type == "sell":
-            # Check if user has enough shares to sell
-            # Calculate current quantity for this ticker
-            txs = session.exec(
-                select(Transaction)
-                .where(Transaction.user_id == current_user.id)
-                .where(Transaction.ticker == transaction.ticker)
-            ).all()
-            
-            current_qty = sum([t.quantity if t.type == "buy" else -t.quantity for t in txs])
-            
-            if current_qty < transaction.quantity:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Insufficient shares. Owned: {current_qty}, Selling: {transaction.quantity}"
-                )
+    try:
+        return record_transaction(session, current_user, transaction, lot_method, lots.parse_lot_ids(lot_ids))
+    except (TradeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-            # Add cash from sale
-            current_user.cash_balance += transaction_value
-        
-        session.add(current_user)
-            
-    transaction.user_id = current_user.id
-    session.add(transaction)
-    session.commit()
-    session.refresh(transaction)
-    return transaction
+@api_router.post("/transactions/import")
+def import_transactions(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(default=None, description="csv, ofx or qfx; defaults to the file extension"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Bulk import trades from a CSV or OFX broker export.
+    
+    CSV needs date, ticker/symbol, type/action, quantity/shares and price
+    columns; rows that aren't buys or sells (dividends, fees) are skipped.
+    The response is NDJSON: a progress line per chunk, then a summary with
+    any rejected rows.
+    """
+    file_format = (format or os.path.splitext(file.filename or "")[1].lstrip(".")).lower()
+    if file_format not in importer.IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format. Use one of: {', '.join(importer.IMPORT_FORMATS)}"
+        )
+    
+    try:
+        rows = importer.parse(file.file, file_format)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        (json.dumps(report) + "\n" for report in importer.import_transactions(current_user.id, rows)),
+        media_type="application/x-ndjson"
+    )
 
 
 # --- Paper Trading Endpoints ---
@@ -295,7 +507,14 @@ def enable_paper_trading(
     """Enable paper trading for user with initial deposit"""
     # Removed "already enabled" check to allow resetting portfolio via this endpoint
     
-    # Wipe existing data to start fresh
+    # A reset starts a new ledger epoch; the old one stays in the ledger, the working tables start fresh
+    ledger.record(session, current_user.id, "reset", note="Paper trading reset")
+    ledger.record(
+        session, current_user.id, "deposit", cash_delta=initial_deposit, note="Initial paper trading deposit"
+    )
+    orders.delete_orders(session, current_user.id)
+    lots.delete_lots(session, current_user.id)
+    snapshots.delete_snapshots(session, current_user.id)
     session.exec(delete(Transaction).where(Transaction.user_id == current_user.id))
     session.exec(delete(CashTransaction).where(CashTransaction.user_id == current_user.id))
     
@@ -316,6 +535,8 @@ def enable_paper_trading(
     session.add(cash_txn)
     session.commit()
     session.refresh(current_user)
+    invalidate_positions(current_user.id)
+    leaderboard.update_account(current_user, {})
     
     return {
         "message": "Paper trading enabled",
@@ -352,13 +573,11 @@ def manage_cash(
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
     if transaction_type == "deposit":
-        current_user.cash_balance += amount
-        current_user.total_deposited += amount
+        adjust_cash(session, current_user, amount, deposited=amount)
     elif transaction_type == "withdrawal":
-        if current_user.cash_balance < amount:
+        # Cash held by open buy orders can't be withdrawn
+        if not adjust_cash(session, current_user, -amount, withdrawn=amount):
             raise HTTPException(status_code=400, detail="Insufficient cash balance")
-        current_user.cash_balance -= amount
-        current_user.total_withdrawn += amount
     else:
         raise HTTPException(status_code=400, detail="Invalid transaction type")
     
@@ -369,11 +588,14 @@ def manage_cash(
         note=note,
         user_id=current_user.id
     )
+    ledger.record(
+        session, current_user.id, transaction_type,
+        cash_delta=amount if transaction_type == "deposit" else -amount, note=note, date=cash_txn.date
+    )
     
-    session.add(current_user)
     session.add(cash_txn)
     session.commit()
-    session.refresh(current_user)
+    leaderboard.update_account(current_user, get_positions(session, current_user.id))
     
     return {
         "message": f"{transaction_type.capitalize()} successful",
@@ -381,6 +603,72 @@ def manage_cash(
         "new_balance": current_user.cash_balance
     }
 
+@api_router.get("/paper-trading/cash-history")
+def get_cash_history(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+    type: Optional[str] = Query(default=None, description="deposit or withdrawal"),
+    start: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    end: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    order: str = Query(default="desc"),
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="page size; every row if omitted"),
+    cursor: Optional[str] = None,
+    paginate: bool = Query(default=False, description="return {items, next_cursor} instead of a list"),
+    format: str = Query(default="json", description="json for a list or page, ndjson to export every match")
+):
+    """Deposits and withdrawals, paginated like /transactions"""
+    if not current_user.paper_trading_enabled:
+        raise HTTPException(status_code=400, detail="Paper trading not enabled")
+    
+    conditions = [CashTransaction.user_id == current_user.id, *_date_range(CashTransaction, start, end)]
+    if type:
+        conditions.append(CashTransaction.type == type.lower())
+    return _ledger_response(
+        session, CashTransaction, ["id", "type", "amount", "date", "note", "user_id"],
+        conditions, order, limit, cursor, format, paginate
+    )
+
+@api_router.get("/paper-trading/ledger")
+def get_ledger_state(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+    as_of: Optional[str] = Query(default=None, description="ISO datetime (UTC); default now")
+):
+    """Cash, totals and positions rebuilt from the ledger, as of any moment including earlier epochs"""
+    moment = None
+    if as_of:
+        try:
+            moment = datetime.fromisoformat(as_of)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid as_of. Use an ISO datetime")
+    return ledger.account_state(session, current_user.id, moment)
+
+@api_router.get("/paper-trading/ledger/events")
+def get_ledger_events(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+    epoch: Optional[int] = None,
+    kind: Optional[str] = None,
+    start: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    end: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    order: str = Query(default="desc"),
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="page size; every row if omitted"),
+    cursor: Optional[str] = None,
+    paginate: bool = Query(default=False, description="return {items, next_cursor} instead of a list"),
+    format: str = Query(default="json", description="json for a list or page, ndjson to export every match")
+):
+    """Every ledger event across all epochs, paginated like /transactions"""
+    conditions = [LedgerEvent.user_id == current_user.id, *_date_range(LedgerEvent, start, end)]
+    if epoch is not None:
+        conditions.append(LedgerEvent.epoch == epoch)
+    if kind:
+        conditions.append(LedgerEvent.kind == kind.lower())
+    return _ledger_response(
+        session, LedgerEvent,
+        ["id", "epoch", "kind", "ticker", "quantity", "price", "cash_delta", "note", "date", "recorded_at"],
+        conditions, order, limit, cursor, format, paginate
+    )
+
 @api_router.get("/paper-trading/profit-loss")
 def get_profit_loss(
     session: Session = Depends(get_session),
@@ -391,25 +679,24 @@ def get_profit_loss(
         raise HTTPException(status_code=400, detail="Paper trading not enabled")
     
     # Get portfolio summary
-    summary = get_portfolio_summary(session, current_user)
+    summary = portfolio_summary(session, current_user)
     portfolio_value = summary['total_value']
     
     # Calculate total account value (cash + portfolio)
-    total_account_value = current_user.cash_balance + portfolio_value
+    total_account_value = quantize(current_user.cash_balance + portfolio_value)
     
     # Calculate net deposits (deposits - withdrawals)
-    net_deposits = current_user.total_deposited - current_user.total_withdrawn
+    net_deposits = quantize(current_user.total_deposited - current_user.total_withdrawn)
     
     # Profit/Loss = Total Account Value - Net Deposits
-    profit_loss = total_account_value - net_deposits
+    profit_loss = quantize(total_account_value - net_deposits)
     profit_loss_pct = (profit_loss / net_deposits * 100) if net_deposits > 0 else 0
     
-    # Calculate Unrealized P/L (Current Value of Holdings - Cost Basis of Holdings)
-    # total_cost_basis is now returned by get_portfolio_summary
-    unrealized_pl = portfolio_value - summary.get('total_cost_basis', 0.0)
-    
-    # Calculate Realized P/L (Total P/L - Unrealized P/L)
-    realized_pl = profit_loss - unrealized_pl
+    # Unrealized P/L against the open tax lots, realized P/L from the recorded lot reliefs
+    if lots.ensure_lots(session, current_user.id):
+        session.commit()
+    unrealized_pl = quantize(portfolio_value - from_units(to_units(list(lots.lot_cost_basis(session, current_user.id).values())).sum()))
+    realized_pl = lots.total_realized_pl(session, current_user.id)
 
     return {
         "cash_balance": current_user.cash_balance,
@@ -422,6 +709,71 @@ def get_profit_loss(
         "realized_pl": realized_pl
     }
 
+@api_router.post("/paper-trading/orders", response_model=Order)
+def place_order(
+    order: Order,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Place a limit, stop or stop-limit order, reserving cash or shares until it fills"""
+    if not current_user.paper_trading_enabled:
+        raise HTTPException(status_code=400, detail="Paper trading not enabled")
+    
+    try:
+        return orders.place_order(session, current_user, order)
+    except TradeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/paper-trading/orders", response_model=List[Order])
+def get_orders(
+    status: Optional[str] = Query(default=None),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """List orders, optionally filtered by status"""
+    if status and status not in orders.ORDER_STATUSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid status. Use one of: {', '.join(orders.ORDER_STATUSES)}"
+        )
+    return orders.list_orders(session, current_user.id, status)
+
+@api_router.delete("/paper-trading/orders/{order_id}")
+def cancel_order(
+    order_id: int,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Cancel an open order and release its reservation"""
+    if not orders.cancel_order(session, current_user.id, order_id):
+        raise HTTPException(status_code=404, detail="Open order not found")
+    return {"message": "Order cancelled"}
+
+@api_router.get("/paper-trading/leaderboard")
+def get_leaderboard(
+    limit: int = Query(default=DEFAULT_TOP_N, ge=1, le=MAX_TOP_N),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Top paper trading accounts by return on net deposits"""
+    leaderboard.ensure_loaded(session)
+    return leaderboard.top(limit)
+
+@api_router.get("/paper-trading/leaderboard/me")
+def get_my_rank(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Current user's leaderboard rank"""
+    if not current_user.paper_trading_enabled:
+        raise HTTPException(status_code=400, detail="Paper trading not enabled")
+    
+    leaderboard.ensure_loaded(session)
+    rank = leaderboard.rank(current_user.id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Not on the leaderboard yet")
+    return rank
+
 # --- Stock Data Endpoints (Public) ---
 
 @api_router.get("/stock/search")
@@ -454,6 +806,26 @@ def search_ticker(q: str):
         logger.error(f"Error searching for ticker: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/stock/quotes")
+def get_stock_quotes(tickers: str = Query(..., description="Comma-separated ticker symbols")):
+    """
+    Get current quotes for several tickers at once.
+    """
+    symbols = [t.strip().upper() for t in tickers.split(",") if t.strip()]
+    if len(symbols) > 100:
+        raise HTTPException(status_code=400, detail="At most 100 tickers per request")
+    
+    quotes = market_data.get_quotes(symbols)
+    return {
+        ticker: {
+            "ticker": ticker,
+            "price": quote["price"],
+            "previous_close": quote["previous_close"],
+            "company_name": quote["company_name"]
+        }
+        for ticker, quote in quotes.items()
+    }
+
 @api_router.get("/stock/{ticker}")
 def get_stock_data(ticker: str):
     stock = yf.Ticker(ticker)
@@ -466,113 +838,83 @@ def get_stock_data(ticker: str):
     }
 
 @api_router.get("/stock/{ticker}/history")
-def get_stock_history(ticker: str, period: str = "1mo"):
-    stock = yf.Ticker(ticker)
-    hist = stock.history(period=period)
-    data = []
-    for date, row in hist.iterrows():
-        data.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "close": row["Close"]
-        })
-    return data
+def get_stock_history(request: Request, ticker: str, period: str = "1mo"):
+    data, fetched_at = market_data.get_history(ticker, period)
+    return http_cache.respond(
+        request, http_cache.etag(ticker.upper(), period, fetched_at),
+        http_cache.public(http_cache.HISTORY_MAX_AGE, fetched_at, market_data.HISTORY_TTL_SECONDS),
+        lambda: data
+    )
 
 
-@api_router.get("/stock/{ticker}/current")
-def get_current_price(ticker: str):
+def _quote_or_404(ticker: str) -> dict:
     try:
-        stock = yf.Ticker(ticker)
-        price = None
-        previous_close = None
-        
-        # 1. Try fast_info (Most reliable for Docker/Server environments)
-        try:
-            price = stock.fast_info.last_price
-            previous_close = stock.fast_info.previous_close
-        except Exception:
-            logger.warning(f"fast_info failed for {ticker}", exc_info=False)
-
-        # 2. Fallback to history if fast_info failed
-        if price is None:
-            try:
-                hist = stock.history(period="5d")
-                if not hist.empty:
-                    price = hist["Close"].iloc[-1]
-                    previous_close = hist["Close"].iloc[-2] if len(hist) > 1 else price
-            except Exception:
-                logger.warning(f"history fetch failed for {ticker}", exc_info=False)
-
-        # 3. Last resort: .info (often fails in Docker/Cloud)
-        if price is None:
-            try:
-                info = stock.info
-                price = info.get("currentPrice") or info.get("regularMarketPrice")
-                previous_close = info.get("previousClose") or info.get("regularMarketPreviousClose")
-            except Exception:
-                logger.warning(f"info fetch failed for {ticker}", exc_info=False)
-        
-        # Get company name (lenient) - indices often fail this
-        company_name = ticker
-        try:
-            info = stock.info
-            company_name = info.get("shortName") or info.get("longName") or ticker
-        except Exception:
-            pass # Keep default ticker name
-            
-        if len(company_name) > 30:
-            company_name = company_name[:27] + "..."
-        
-        if price is not None:
-            return {
-                "ticker": ticker, 
-                "price": price,
-                "previous_close": previous_close,
-                "company_name": company_name
-            }
-        else:
-            raise HTTPException(status_code=404, detail=f"Price not found for {ticker}")
-    except HTTPException:
-        raise
+        # Served from the shared quote cache (fast_info -> history -> info fallbacks)
+        quote = market_data.get_quote(ticker)
     except Exception as e:
         logger.error(f"Error serving price for {ticker}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    if quote is None:
+        raise HTTPException(status_code=404, detail=f"Price not found for {ticker}")
+    return quote
+
+def _price_body(ticker: str, quote: dict) -> dict:
+    return {
+        "ticker": ticker, 
+        "price": quote["price"],
+        "previous_close": quote["previous_close"],
+        "company_name": quote["company_name"]
+    }
+
+@api_router.get("/stock/{ticker}/current")
+def get_current_price(request: Request, ticker: str):
+    quote = _quote_or_404(ticker)
+    return http_cache.respond(
+        request, http_cache.etag(ticker, quote["fetched_at"]),
+        http_cache.public(http_cache.QUOTE_MAX_AGE, quote["fetched_at"], market_data.QUOTE_TTL_SECONDS),
+        lambda: _price_body(ticker, quote)
+    )
+
 
+def _info_body(ticker: str, info: dict) -> dict:
+    return {
+        "symbol": ticker.upper(),
+        "name": info.get("longName") or info.get("shortName") or ticker,
+        "sector": info.get("sector"),
+        "industry": info.get("industry"),
+        "description": info.get("longBusinessSummary"),
+        "website": info.get("website"),
+        "current_price": info.get("currentPrice") or info.get("regularMarketPrice"),
+        "previous_close": info.get("previousClose"),
+        "market_cap": info.get("marketCap"),
+        "pe_ratio": info.get("trailingPE"),
+        "forward_pe": info.get("forwardPE"),
+        "dividend_yield": info.get("dividendYield"),
+        "fifty_two_week_high": info.get("fiftyTwoWeekHigh"),
+        "fifty_two_week_low": info.get("fiftyTwoWeekLow"),
+        "volume": info.get("volume"),
+        "avg_volume": info.get("averageVolume"),
+        "beta": info.get("beta"),
+        "eps": info.get("trailingEps"),
+        "revenue": info.get("totalRevenue"),
+        "profit_margin": info.get("profitMargins"),
+    }
 
 @api_router.get("/stock/{ticker}/info")
-def get_stock_info(ticker: str):
+def get_stock_info(request: Request, ticker: str):
     """
     Get comprehensive stock information for research.
     """
     try:
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        
-        # Extract key metrics
-        return {
-            "symbol": ticker.upper(),
-            "name": info.get("longName") or info.get("shortName") or ticker,
-            "sector": info.get("sector"),
-            "industry": info.get("industry"),
-            "description": info.get("longBusinessSummary"),
-            "website": info.get("website"),
-            "current_price": info.get("currentPrice") or info.get("regularMarketPrice"),
-            "previous_close": info.get("previousClose"),
-            "market_cap": info.get("marketCap"),
-            "pe_ratio": info.get("trailingPE"),
-            "forward_pe": info.get("forwardPE"),
-            "dividend_yield": info.get("dividendYield"),
-            "fifty_two_week_high": info.get("fiftyTwoWeekHigh"),
-            "fifty_two_week_low": info.get("fiftyTwoWeekLow"),
-            "volume": info.get("volume"),
-            "avg_volume": info.get("averageVolume"),
-            "beta": info.get("beta"),
-            "eps": info.get("trailingEps"),
-            "revenue": info.get("totalRevenue"),
-            "profit_margin": info.get("profitMargins"),
-        }
+        info, fetched_at = market_data.get_info(ticker)
     except Exception as e:
         logger.error(f"Error fetching info for {ticker}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch stock info: {str(e)}")
+    return http_cache.respond(
+        request, http_cache.etag(ticker, fetched_at),
+        http_cache.public(http_cache.INFO_MAX_AGE, fetched_at, market_data.INFO_TTL_SECONDS),
+        lambda: _info_body(ticker, info)
+    )
 
 
 @api_router.get("/stock/{ticker}/news")
@@ -682,71 +1024,21 @@ def get_stock_news(ticker: str):
             raise HTTPException(status_code=500, detail=f"Failed to fetch news: {str(e)}")
 
 
-@api_router.get("/portfolio/summary")
-def get_portfolio_summary(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
-):
-    transactions = session.exec(
-        select(Transaction)
-        .where(Transaction.user_id == current_user.id)
-        .order_by(Transaction.date)
-    ).all()
-    
-    holdings = {}
-    
-    for t in transactions:
-        if t.ticker not in holdings:
-            holdings[t.ticker] = {"quantity": 0, "total_cost": 0.0}
-        
-        if t.type == "buy":
-            holdings[t.ticker]["quantity"] += t.quantity
-            holdings[t.ticker]["total_cost"] += (t.quantity * t.price)
-        elif t.type == "sell":
-            if holdings[t.ticker]["quantity"] > 0:
-                avg_cost = holdings[t.ticker]["total_cost"] / holdings[t.ticker]["quantity"]
-                holdings[t.ticker]["total_cost"] -= (t.quantity * avg_cost)
-                holdings[t.ticker]["quantity"] -= t.quantity
-            else:
-                holdings[t.ticker]["quantity"] -= t.quantity
-    
+def _summary_body(holdings: dict, quotes: dict) -> dict:
     summary = []
-    total_portfolio_value = 0.0
-    total_cost_basis = 0.0
+    # Totals in fixed-point units, so they're exact sums of the rounded values shown
+    value_units = 0
+    cost_units = 0
     
     for ticker, data in holdings.items():
         if data["quantity"] > 0:
-            stock = yf.Ticker(ticker)
-            current_price = 0.0
+            quote = quotes.get(ticker.upper())
+            current_price = quote["price"] if quote else 0.0
+            company_name = quote["company_name"] if quote else ticker
             
-            # 1. Fetch Price (Robust)
-            try:
-                current_price = stock.fast_info.last_price
-            except Exception:
-                # Fallback to history if fast_info fails
-                try:
-                     hist = stock.history(period="5d")
-                     if not hist.empty:
-                         current_price = hist["Close"].iloc[-1]
-                except Exception:
-                     pass
-
-            # 2. Fetch Company Name (Optional, often fails in Docker)
-            company_name = ticker
-            try:
-                info = stock.info
-                name_res = info.get("shortName") or info.get("longName")
-                if name_res:
-                    company_name = name_res
-            except Exception:
-                pass
-            
-            if len(company_name) > 30:
-                company_name = company_name[:27] + "..."
-            
-            market_value = data["quantity"] * current_price
-            total_portfolio_value += market_value
-            total_cost_basis += data["total_cost"]
+            market_value = quantize(data["quantity"] * current_price)
+            value_units += to_units(market_value)
+            cost_units += to_units(data["total_cost"])
             
             summary.append({
                 "ticker": ticker,
@@ -760,13 +1052,389 @@ def get_portfolio_summary(
             
     return {
         "holdings": summary, 
-        "total_value": total_portfolio_value,
-        "total_cost_basis": total_cost_basis
+        "total_value": from_units(value_units),
+        "total_cost_basis": from_units(cost_units)
     }
 
+def portfolio_summary(session: Session, user: User) -> dict:
+    """Open holdings valued at current quotes, with totals"""
+    holdings = get_open_positions(session, user.id)
+    return _summary_body(holdings, market_data.get_quotes(holdings.keys()))
+
+@api_router.get("/portfolio/summary")
+def get_portfolio_summary(
+    request: Request,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    holdings = get_open_positions(session, current_user.id)
+    quotes = market_data.get_quotes(holdings.keys())
+    tag = http_cache.etag(
+        current_user.id, ledger.data_version(session, current_user.id),
+        sorted((ticker, quote["fetched_at"]) for ticker, quote in quotes.items()), weak=True
+    )
+    return http_cache.respond(request, tag, http_cache.PRIVATE, lambda: _summary_body(holdings, quotes))
+
+@api_router.get("/portfolio/analytics")
+def get_portfolio_analytics(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Holdings, weights, realized/unrealized P/L, sector exposure and concentration"""
+    holdings = lot_holdings(session, current_user.id)
+    open_tickers = list(holdings.index[holdings["quantity"] > 0])
+    
+    quotes = market_data.get_quotes(open_tickers)
+    profiles = market_data.get_profiles(open_tickers)
+    
+    return portfolio_analytics(
+        holdings,
+        {ticker: quote["price"] for ticker, quote in quotes.items()},
+        {ticker: profile["sector"] for ticker, profile in profiles.items()}
+    )
+
+@api_router.get("/portfolio/history")
+def get_portfolio_history(
+    period: str = Query(default="1y"),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Daily portfolio value and cash with time- and money-weighted returns"""
+    if period not in HISTORY_PERIODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid period. Use one of: {', '.join(HISTORY_PERIODS)}"
+        )
+    
+    ledger = load_ledger(session, current_user.id)
+    cash_flows = load_cash_flows(session, current_user.id) if current_user.paper_trading_enabled else None
+    start = period_start(period, ledger, cash_flows)
+    
+    # Serve from end-of-day snapshots when they span the period, otherwise rebuild from prices
+    stored = snapshots.load_snapshots(session, current_user.id, start.date())
+    if snapshots.covers_period(session, current_user.id, stored, start.date()):
+        history = snapshot_history(stored, current_user.paper_trading_enabled)
+        return {"period": period, "source": "snapshots", **history}
+    
+    closes = market_data.get_daily_closes(tickers_held_since(ledger, start), start)
+    return {"period": period, "source": "live", **portfolio_history(ledger, closes, start, cash_flows)}
+
+@api_router.get("/portfolio/performance")
+def get_portfolio_performance(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Latest end-of-day snapshot with value changes and returns over standard windows"""
+    as_of = session.exec(
+        select(PortfolioSnapshot)
+        .where(PortfolioSnapshot.user_id == current_user.id)
+        .order_by(PortfolioSnapshot.snapshot_date.desc())
+    ).first()
+    if as_of is None:
+        raise HTTPException(status_code=404, detail="No portfolio snapshots yet")
+    
+    day = as_of.snapshot_date
+    windows = {
+        "1d": day - timedelta(days=1),
+        "1w": day - timedelta(weeks=1),
+        "1mo": day - timedelta(days=30),
+        "ytd": day.replace(month=1, day=1) - timedelta(days=1),
+        "1y": day - timedelta(days=365),
+    }
+    stored = snapshots.load_snapshots(session, current_user.id, min(windows.values()))
+    
+    return {
+        "snapshot": as_of,
+        "changes": snapshots.performance(stored, windows),
+    }
+
+@api_router.get("/portfolio/risk")
+def get_portfolio_risk(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Volatility, beta, Sharpe, max drawdown, correlation and 1-day VaR of current holdings"""
+    holdings = get_open_positions(session, current_user.id)
+    quotes = market_data.get_quotes(holdings.keys())
+    market_values = {
+        ticker: data["quantity"] * quotes[ticker.upper()]["price"]
+        for ticker, data in holdings.items()
+        if ticker.upper() in quotes
+    }
+    
+    risk = portfolio_risk(market_values)
+    if risk is None:
+        raise HTTPException(status_code=404, detail="Not enough holdings or price history to compute risk")
+    return risk
+
+@api_router.post("/portfolio/rebalance")
+def rebalance_portfolio(
+    targets: Optional[Dict[str, float]] = Body(default=None),
+    mode: str = Body(default="target"),
+    tickers: Optional[List[str]] = Body(default=None),
+    risk_aversion: float = Body(default=3.0),
+    max_weight: float = Body(default=1.0),
+    cash_weight: float = Body(default=0.0),
+    max_turnover: Optional[float] = Body(default=None),
+    fractional: bool = Body(default=True),
+    min_trade_value: float = Body(default=1.0),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Buy and sell orders that move holdings to target weights.
+    
+    In "target" mode the weights are given as {ticker: weight}. In
+    "min_variance" and "mean_variance" modes they are optimized over tickers
+    (default: current holdings), long-only, capped at max_weight, with
+    cash_weight left in cash. Orders are computed, not placed.
+    """
+    if mode not in rebalance.REBALANCE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid mode. Use one of: {', '.join(rebalance.REBALANCE_MODES)}"
+        )
+    if max_turnover is not None and max_turnover <= 0:
+        raise HTTPException(status_code=400, detail="max_turnover must be positive")
+    if not 0 < max_weight <= 1 or not 0 <= cash_weight < 1 or risk_aversion <= 0:
+        raise HTTPException(
+            status_code=400,
+            detail="max_weight must be in (0, 1], cash_weight in [0, 1) and risk_aversion positive"
+        )
+    
+    try:
+        if mode == "target":
+            if not targets:
+                raise ValueError("targets are required in target mode")
+        else:
+            universe = tickers or list(get_open_positions(session, current_user.id).keys())
+            targets = rebalance.optimized_targets(
+                list({t.upper() for t in universe}), mode, risk_aversion, max_weight, cash_weight
+            )
+        plan = rebalance.plan_rebalance(
+            session, current_user, targets, max_turnover, fractional, min_trade_value
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"mode": mode, **plan}
+
+@api_router.post("/backtest")
+def run_backtest(
+    tickers: List[str] = Body(...),
+    start: str = Body(...),
+    end: Optional[str] = Body(default=None),
+    strategy: str = Body(default="buy_and_hold"),
+    params: Dict = Body(default={}),
+    param_sets: Optional[List[Dict]] = Body(default=None),
+    initial_cash: float = Body(default=10000.0),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Replay a strategy over historical daily closes.
+    
+    Strategies: buy_and_hold, rebalance (params: weights, frequency), dca
+    (weights, contribution, frequency) and sma_cross (weights, fast, slow).
+    A single run returns its metrics, daily history, holdings and the
+    transactions and cash transactions it would have made; with param_sets,
+    each set overrides params (and optionally strategy) and only metrics are
+    returned, computed in parallel.
+    """
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d") if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if initial_cash < 0:
+        raise HTTPException(status_code=400, detail="initial_cash must not be negative")
+    
+    try:
+        if param_sets is not None:
+            return backtest.run_sweep(tickers, start_date, end_date, strategy, params, param_sets, initial_cash)
+        return backtest.run_backtest(tickers, start_date, end_date, strategy, params, initial_cash)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/portfolio/lots")
+def get_open_lots(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Open tax lots with remaining quantity and cost basis"""
+    if lots.ensure_lots(session, current_user.id):
+        session.commit()
+    return {"lots": lots.open_lots(session, current_user.id)}
+
+@api_router.get("/portfolio/realized")
+def get_realized_gains(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Realized P/L per sale and per ticker from the relieved tax lots"""
+    if lots.ensure_lots(session, current_user.id):
+        session.commit()
+    return lots.realized_sales(session, current_user.id)
+
+# --- Reports ---
+
+@api_router.get("/reports/{kind}")
+def download_report(
+    kind: str,
+    format: str = Query(default="csv", description="csv or xlsx"),
+    start: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    end: Optional[str] = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Holdings, realized P/L, transactions or cash history as a streamed CSV or XLSX download"""
+    if kind not in reports.REPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f"Invalid report. Use one of: {', '.join(reports.REPORT_KINDS)}")
+    if format not in reports.REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(reports.REPORT_FORMATS)}")
+
+    if kind == "holdings":
+        header, batches = reports.holdings_report(get_portfolio_analytics(session, current_user))
+    else:
+        if kind == "cash" and not current_user.paper_trading_enabled:
+            raise HTTPException(status_code=400, detail="Paper trading not enabled")
+        if kind == "realized" and lots.ensure_lots(session, current_user.id):
+            session.commit()
+        conditions = _date_range(reports.LEDGER_REPORT_MODELS[kind], start, end)
+        header, batches = reports.ledger_report(kind, current_user.id, conditions)
+
+    filename = f"portfolio-{kind}-{datetime.now().strftime('%Y-%m-%d')}.{format}"
+    return StreamingResponse(
+        reports.render(format, kind.capitalize(), header, batches),
+        media_type=reports.REPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# --- Batch Endpoint ---
+
+MAX_BATCH_OPERATIONS = 50
+
+def _batch_trade(trade_type: str):
+    def run(session: Session, user: User, args: dict):
+        transaction = Transaction(
+            ticker=args["ticker"].upper(),
+            type=trade_type,
+            quantity=args["quantity"],
+            price=args["price"],
+        )
+        if args.get("date"):
+            transaction.date = args["date"]
+        return add_transaction(transaction, session, user, args.get("lot_method", "fifo"), args.get("lot_ids"))
+    return run
+
+# Read-only operations run concurrently, each in its own session
+BATCH_READ_OPERATIONS = {
+    "get_stock_price": lambda session, user, args: _price_body(args["ticker"].upper(), _quote_or_404(args["ticker"].upper())),
+    "get_stock_quotes": lambda session, user, args: get_stock_quotes(
+        args["tickers"] if isinstance(args["tickers"], str) else ",".join(args["tickers"])
+    ),
+    "get_stock_info": lambda session, user, args: _info_body(args["ticker"], market_data.get_info(args["ticker"])[0]),
+    "get_stock_history": lambda session, user, args: market_data.get_history(args["ticker"], args.get("period", "1mo"))[0],
+    "get_portfolio_summary": lambda session, user, args: portfolio_summary(session, user),
+    "get_watchlist": lambda session, user, args: get_watchlist_quotes(session, user),
+    "get_transactions": lambda session, user, args: get_transactions(
+        session, user, args.get("ticker"), args.get("type"), args.get("start"), args.get("end"),
+        args.get("order", "desc"), min(int(args["limit"]), MAX_PAGE_SIZE) if args.get("limit") else None,
+        args.get("cursor"), bool(args.get("paginate", False)), "json"
+    ),
+    "get_paper_trading_status": lambda session, user, args: get_paper_trading_status(session, user),
+    "get_profit_loss": lambda session, user, args: get_profit_loss(session, user),
+}
+# The in-app chat tool has this name for it
+BATCH_READ_OPERATIONS["get_transaction_history"] = BATCH_READ_OPERATIONS["get_transactions"]
+
+# Writes run one at a time, in request order, and act as barriers between reads
+BATCH_WRITE_OPERATIONS = {
+    "buy_stock": _batch_trade("buy"),
+    "sell_stock": _batch_trade("sell"),
+    "add_to_watchlist": lambda session, user, args: add_to_watchlist(Watchlist(ticker=args["ticker"]), session, user),
+    "remove_from_watchlist": lambda session, user, args: remove_ticker_from_watchlist(args["ticker"], session, user),
+}
+
+BATCH_REQUIRED_ARGS = {
+    "get_stock_price": ("ticker",),
+    "get_stock_quotes": ("tickers",),
+    "get_stock_info": ("ticker",),
+    "get_stock_history": ("ticker",),
+    "buy_stock": ("ticker", "quantity", "price"),
+    "sell_stock": ("ticker", "quantity", "price"),
+    "add_to_watchlist": ("ticker",),
+    "remove_from_watchlist": ("ticker",),
+}
+
+def _prepare_batch(user_id: int):
+    """Backfill lots once up front, so concurrent reads that need them don't each write them."""
+    with Session(engine) as session:
+        if lots.ensure_lots(session, user_id):
+            session.commit()
+
+def _run_batch_operation(user_id: int, operation: dict) -> dict:
+    name = operation.get("op")
+    handler = BATCH_READ_OPERATIONS.get(name) or BATCH_WRITE_OPERATIONS.get(name)
+    result = {"id": operation.get("id"), "op": name}
+    
+    if handler is None:
+        return {**result, "ok": False, "status": 400, "error": f"Unknown operation: {name}"}
+    args = operation.get("args") or {}
+    missing = [arg for arg in BATCH_REQUIRED_ARGS.get(name, ()) if arg not in args]
+    if missing:
+        return {**result, "ok": False, "status": 400, "error": f"Missing argument: {', '.join(missing)}"}
+    
+    try:
+        with Session(engine) as session:
+            user = session.get(User, user_id)
+            # Encode while the session is open so ORM rows are fully loaded
+            data = handler(session, user, args)
+            data = orjson.loads(data.body) if isinstance(data, Response) else jsonable_encoder(data)
+        return {**result, "ok": True, "result": data}
+    except HTTPException as e:
+        return {**result, "ok": False, "status": e.status_code, "error": e.detail}
+    except Exception as e:
+        logger.error(f"Batch operation {name} failed: {e}")
+        return {**result, "ok": False, "status": 500, "error": str(e)}
+
+@api_router.post("/batch")
+async def run_batch(
+    operations: List[Dict] = Body(..., embed=True),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Run several operations in one request.
+    
+    Each operation is {"op": name, "args": {...}, "id": optional}. Consecutive
+    read-only operations run concurrently; writes run sequentially in order.
+    Results are returned in the same order as the operations.
+    """
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+    
+    await run_in_threadpool(_prepare_batch, current_user.id)
+    results = []
+    pending_reads = []
+    
+    async def flush_reads():
+        results.extend(await asyncio.gather(*(
+            run_in_threadpool(_run_batch_operation, current_user.id, op) for op in pending_reads
+        )))
+        pending_reads.clear()
+    
+    for operation in operations:
+        if operation.get("op") in BATCH_WRITE_OPERATIONS:
+            await flush_reads()
+            results.append(await run_in_threadpool(_run_batch_operation, current_user.id, operation))
+        else:
+            pending_reads.append(operation)
+    await flush_reads()
+    
+    return {"results": results}
+
 # --- Chatbot Endpoint ---
 
 from llm import LLMService
+from chat_context import SYSTEM_PREFIX, build_context_fields, conversations
 
 # Initialize LLM Service
 llm_service = LLMService()
@@ -785,64 +1453,42 @@ async def chat_endpoint(
     if authorization and authorization.startswith("Bearer "):
         access_token = authorization.split(" ")[1]
     
-    # Get portfolio context
-    summary_data = get_portfolio_summary(session, current_user)
-    holdings_text = ", ".join([f"{h['ticker']} ({h['quantity']} shares)" for h in summary_data['holdings'] if h['quantity'] > 0])
-    total_value = summary_data['total_value']
-    
-    
-    # Build context with paper trading info if enabled
-    current_date = datetime.now().strftime("%A, %B %d, %Y")
-    context_parts = [
-        f"Today is {current_date}.",
-        "You are a helpful financial advisor assistant for NVest AI, an AI-powered portfolio tracking app.",
-    ]
-    
-    if current_user.paper_trading_enabled:
-        context_parts.append(f"The user is using Virtual Trading mode (practice with virtual money).")
-        context_parts.append(f"Cash Balance: ${current_user.cash_balance:,.2f}")
-        context_parts.append(f"Portfolio Value (stocks): ${total_value:,.2f}")
-        total_account = current_user.cash_balance + total_value
-        context_parts.append(f"Total Account Value: ${total_account:,.2f}")
-    else:
-        context_parts.append(f"The user's portfolio value is ${total_value:,.2f}.")
-    
-    context_parts.append(f"Current holdings: {holdings_text if holdings_text else 'None'}.")
-    context_parts.append("")
-    context_parts.append("Provide insights based on the user's portfolio and market trends.")
-    context_parts.append("Keep answers short, concise and helpful.")
-    
-    context = "\n".join(context_parts)
-    
+    # Portfolio context from cached positions/quotes; only changed fields are
+    # appended to the server-side conversation on follow-up turns
+    conversation = conversations.get_or_create(current_user.id, query.get("conversation_id"))
+    fields = await run_in_threadpool(build_context_fields, session, current_user)
+    history = conversation.prepare_turn(fields, user_query)
     
     try:
-        response_text = await llm_service.generate_response(context, user_query, access_token)
-        return {"response": response_text}
+        response_text = await llm_service.generate_response(
+            SYSTEM_PREFIX,
+            user_query,
+            access_token,
+            history=history,
+            cache_key=f"nvest-chat-{current_user.id}"
+        )
+        conversation.record_reply(response_text)
+        return {"response": response_text, "conversation_id": conversation.id}
     except Exception as e:
-        return {"response": f"Error communicating with AI: {str(e)}"}
+        conversation.discard_turn()
+        return {"response": f"Error communicating with AI: {str(e)}", "conversation_id": conversation.id}
 
 # Include API router
 app.include_router(api_router)
 
 # --- Serve Frontend (Must be last) ---
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-import os
-
 FRONTEND_DIST = os.path.abspath(os.path.join(os.path.dirname(__file__), "../frontend/dist"))
+frontend = spa.Manifest(FRONTEND_DIST)
 
-if os.path.exists(os.path.join(FRONTEND_DIST, "assets")):
-    app.mount("/assets", StaticFiles(directory=os.path.join(FRONTEND_DIST, "assets")), name="assets")
-else:
-    logger.warning(f"Warning: Assets directory not found at {os.path.join(FRONTEND_DIST, 'assets')}")
+@app.on_event("startup")
+def load_frontend():
+    frontend.load()
 
 @app.get("/{full_path:path}")
-async def serve_spa(full_path: str):
-    dist_path = os.path.join(FRONTEND_DIST, full_path)
-    if os.path.exists(dist_path) and os.path.isfile(dist_path):
-        return FileResponse(dist_path)
-    
-    index_path = os.path.join(FRONTEND_DIST, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
-    return {"error": f"Frontend not built. Looking for: {index_path}"}
+async def serve_spa(full_path: str, request: Request):
+    static = frontend.lookup(full_path)
+    if static is not None:
+        return frontend.response(request, static)
+    if full_path.startswith(spa.HASHED_PREFIX):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {"error": f"Frontend not built. Looking for: {os.path.join(FRONTEND_DIST, spa.INDEX)}"}
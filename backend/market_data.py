@@ -0,0 +1,352 @@
+"""
+Market Data Cache
+
+Process-wide cache for quotes and company names fetched from Yahoo Finance.
+Quotes are short-lived and refreshed on demand; company names rarely change
+and are kept for much longer. Misses in bulk lookups are fetched concurrently.
+
+Components that react to prices (leaderboard, orders, alerts) register a
+quote listener and are called with every freshly fetched quote. Tickers
+they depend on can be registered as watched; run_refresher() keeps those
+quotes fresh even when no user is requesting them.
+
+Daily closes are cached per ticker and shared by every user, so portfolio
+history and risk calculations over overlapping holdings download each
+ticker's price series once.
+
+Chart history and research info are cached the same way. Every cached entry
+carries its fetch time, which the API uses as the data version for ETags.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+import yfinance as yf
+
+
+logger = logging.getLogger(__name__)
+
+QUOTE_TTL_SECONDS = float(os.getenv("QUOTE_TTL_SECONDS", "60"))
+NAME_TTL_SECONDS = float(os.getenv("NAME_TTL_SECONDS", str(24 * 3600)))
+MAX_FETCH_WORKERS = int(os.getenv("QUOTE_FETCH_WORKERS", "8"))
+QUOTE_REFRESH_SECONDS = float(os.getenv("QUOTE_REFRESH_SECONDS", "30"))
+CLOSES_TTL_SECONDS = float(os.getenv("CLOSES_TTL_SECONDS", "3600"))
+CLOSES_MIN_LOOKBACK_DAYS = 366
+HISTORY_TTL_SECONDS = float(os.getenv("HISTORY_TTL_SECONDS", "900"))
+INFO_TTL_SECONDS = float(os.getenv("INFO_TTL_SECONDS", "3600"))
+
+_quotes: Dict[str, dict] = {}
+_names: Dict[str, Tuple[str, float]] = {}
+_profiles: Dict[str, Tuple[dict, float]] = {}
+_closes: Dict[str, Tuple[pd.Series, pd.Timestamp, float]] = {}
+_histories: Dict[Tuple[str, str], Tuple[List[dict], float]] = {}
+_infos: Dict[str, Tuple[dict, float]] = {}
+_listeners: List[Callable[[dict], None]] = []
+_watchers: List[Callable[[], Iterable[str]]] = []
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="quotes")
+
+
+def _display_name(name: str) -> str:
+    if len(name) > 30:
+        return name[:27] + "..."
+    return name
+
+
+def _fetch_price(ticker: str) -> Tuple[Optional[float], Optional[float]]:
+    """Fetch (price, previous_close) using the most reliable source first."""
+    stock = yf.Ticker(ticker)
+    price = None
+    previous_close = None
+
+    # 1. Try fast_info (Most reliable for Docker/Server environments)
+    try:
+        price = stock.fast_info.last_price
+        previous_close = stock.fast_info.previous_close
+    except Exception:
+        logger.warning(f"fast_info failed for {ticker}", exc_info=False)
+
+    # 2. Fallback to history if fast_info failed
+    if price is None:
+        try:
+            hist = stock.history(period="5d")
+            if not hist.empty:
+                price = float(hist["Close"].iloc[-1])
+                previous_close = float(hist["Close"].iloc[-2]) if len(hist) > 1 else price
+        except Exception:
+            logger.warning(f"history fetch failed for {ticker}", exc_info=False)
+
+    # 3. Last resort: .info (often fails in Docker/Cloud)
+    if price is None:
+        try:
+            info = stock.info
+            price = info.get("currentPrice") or info.get("regularMarketPrice")
+            previous_close = info.get("previousClose") or info.get("regularMarketPreviousClose")
+        except Exception:
+            logger.warning(f"info fetch failed for {ticker}", exc_info=False)
+
+    return price, previous_close
+
+
+def _fetch_name(ticker: str) -> str:
+    # Indices and some ETFs often fail this, keep the ticker as the name
+    try:
+        info = yf.Ticker(ticker).info
+        return info.get("shortName") or info.get("longName") or ticker
+    except Exception:
+        return ticker
+
+
+def get_company_name(ticker: str) -> str:
+    """Get a display name for a ticker, cached for NAME_TTL_SECONDS."""
+    ticker = ticker.upper()
+    now = time.time()
+    with _lock:
+        cached = _names.get(ticker)
+    if cached and now - cached[1] < NAME_TTL_SECONDS:
+        return cached[0]
+
+    name = _display_name(_fetch_name(ticker))
+    with _lock:
+        _names[ticker] = (name, now)
+    return name
+
+
+def _fetch_profile(ticker: str) -> dict:
+    try:
+        info = yf.Ticker(ticker).info
+        return {"sector": info.get("sector"), "industry": info.get("industry")}
+    except Exception:
+        return {"sector": None, "industry": None}
+
+
+def get_profiles(tickers: Iterable[str]) -> Dict[str, dict]:
+    """Sector and industry per ticker, cached for NAME_TTL_SECONDS and fetched concurrently on miss."""
+    now = time.time()
+    results: Dict[str, dict] = {}
+    missing = []
+
+    for ticker in dict.fromkeys(t.upper() for t in tickers):
+        with _lock:
+            cached = _profiles.get(ticker)
+        if cached and now - cached[1] < NAME_TTL_SECONDS:
+            results[ticker] = cached[0]
+        else:
+            missing.append(ticker)
+
+    for ticker, profile in zip(missing, _executor.map(_fetch_profile, missing)):
+        with _lock:
+            _profiles[ticker] = (profile, now)
+        results[ticker] = profile
+    return results
+
+
+def get_history(ticker: str, period: str) -> Tuple[List[dict], float]:
+    """
+    Daily closes over a yfinance period as [{"date", "close"}] for charts,
+    cached for HISTORY_TTL_SECONDS. Returns (rows, fetched_at).
+    """
+    key = (ticker.upper(), period)
+    now = time.time()
+    with _lock:
+        cached = _histories.get(key)
+    if cached and now - cached[1] < HISTORY_TTL_SECONDS:
+        return cached
+
+    hist = yf.Ticker(ticker).history(period=period)
+    # Whole columns to plain str/float at once, instead of a Series per row
+    dates = hist.index.strftime("%Y-%m-%d").tolist() if not hist.empty else []
+    closes = hist["Close"].to_numpy(dtype=float).tolist() if not hist.empty else []
+    rows = [{"date": date, "close": close} for date, close in zip(dates, closes)]
+    with _lock:
+        _histories[key] = (rows, now)
+    return rows, now
+
+
+def get_info(ticker: str) -> Tuple[dict, float]:
+    """yfinance's info dict for a ticker, cached for INFO_TTL_SECONDS. Returns (info, fetched_at)."""
+    ticker = ticker.upper()
+    now = time.time()
+    with _lock:
+        cached = _infos.get(ticker)
+    if cached and now - cached[1] < INFO_TTL_SECONDS:
+        return cached
+
+    info = yf.Ticker(ticker).info
+    with _lock:
+        _infos[ticker] = (info, now)
+    return info, now
+
+
+def add_quote_listener(listener: Callable[[dict], None]):
+    """Call listener(quote) after every fresh quote fetch."""
+    _listeners.append(listener)
+
+
+def _notify(quote: dict):
+    for listener in list(_listeners):
+        try:
+            listener(quote)
+        except Exception:
+            logger.exception(f"quote listener failed for {quote['ticker']}")
+
+
+def add_watched_tickers(provider: Callable[[], Iterable[str]]):
+    """Register a callable returning tickers whose quotes run_refresher() keeps fresh."""
+    _watchers.append(provider)
+
+
+def watched_tickers() -> List[str]:
+    tickers = set()
+    for provider in list(_watchers):
+        try:
+            tickers.update(t.upper() for t in provider())
+        except Exception:
+            logger.exception("watched ticker provider failed")
+    return sorted(tickers)
+
+
+async def run_refresher():
+    """Refetch watched tickers every QUOTE_REFRESH_SECONDS, notifying listeners, until cancelled."""
+    while True:
+        await asyncio.sleep(QUOTE_REFRESH_SECONDS)
+        tickers = watched_tickers()
+        if not tickers:
+            continue
+        try:
+            await asyncio.to_thread(get_quotes, tickers, QUOTE_REFRESH_SECONDS)
+        except Exception:
+            logger.exception("watched quote refresh failed")
+
+
+def peek_quote(ticker: str) -> Optional[dict]:
+    """Return the cached quote for a ticker without fetching, even if stale."""
+    with _lock:
+        return _quotes.get(ticker.upper())
+
+
+def get_quote(ticker: str, max_age: Optional[float] = None) -> Optional[dict]:
+    """
+    Get a quote for a ticker, serving from cache when fresh enough.
+
+    Returns a dict with ticker, price, previous_close, company_name and
+    fetched_at, or None if no price could be found.
+    """
+    ticker = ticker.upper()
+    max_age = QUOTE_TTL_SECONDS if max_age is None else max_age
+
+    cached = peek_quote(ticker)
+    if cached and time.time() - cached["fetched_at"] < max_age:
+        return cached
+
+    price, previous_close = _fetch_price(ticker)
+    if price is None:
+        return None
+
+    quote = {
+        "ticker": ticker,
+        "price": float(price),
+        "previous_close": float(previous_close) if previous_close is not None else None,
+        "company_name": get_company_name(ticker),
+        "fetched_at": time.time(),
+    }
+    with _lock:
+        _quotes[ticker] = quote
+    _notify(quote)
+    return quote
+
+
+def get_quotes(tickers: Iterable[str], max_age: Optional[float] = None) -> Dict[str, dict]:
+    """
+    Get quotes for several tickers at once.
+
+    Fresh cache entries are returned directly and the misses are fetched
+    concurrently. Tickers without a price are left out of the result.
+    """
+    max_age = QUOTE_TTL_SECONDS if max_age is None else max_age
+    now = time.time()
+    results: Dict[str, dict] = {}
+    missing = []
+
+    for ticker in dict.fromkeys(t.upper() for t in tickers):
+        cached = peek_quote(ticker)
+        if cached and now - cached["fetched_at"] < max_age:
+            results[ticker] = cached
+        else:
+            missing.append(ticker)
+
+    if missing:
+        fetched = _executor.map(lambda t: get_quote(t, max_age=0), missing)
+        for ticker, quote in zip(missing, fetched):
+            if quote is not None:
+                results[ticker] = quote
+
+    return results
+
+
+def _download_closes(tickers: List[str], start: pd.Timestamp) -> pd.DataFrame:
+    """Download daily closes for several tickers in one request, one column per ticker."""
+    try:
+        data = yf.download(
+            tickers, start=start.strftime("%Y-%m-%d"), auto_adjust=False,
+            progress=False, threads=True
+        )
+    except Exception:
+        logger.warning(f"daily close download failed for {tickers}", exc_info=False)
+        return pd.DataFrame()
+    if data is None or data.empty:
+        return pd.DataFrame()
+
+    closes = data["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(tickers[0])
+    if closes.index.tz is not None:
+        closes.index = closes.index.tz_localize(None)
+    closes.index = closes.index.normalize()
+    return closes
+
+
+def get_daily_closes(tickers: Iterable[str], start: pd.Timestamp) -> pd.DataFrame:
+    """
+    Daily closes from start onwards as a date x ticker DataFrame.
+
+    Each ticker's series is cached for CLOSES_TTL_SECONDS and reused by any
+    request whose start falls inside it. Misses are downloaded together, at
+    least CLOSES_MIN_LOOKBACK_DAYS back so different periods share one fetch.
+    Tickers without data are left out.
+    """
+    start = pd.Timestamp(start).normalize()
+    now = time.time()
+    series: Dict[str, pd.Series] = {}
+    missing = []
+
+    for ticker in dict.fromkeys(t.upper() for t in tickers):
+        with _lock:
+            cached = _closes.get(ticker)
+        if cached and cached[1] <= start and now - cached[2] < CLOSES_TTL_SECONDS:
+            series[ticker] = cached[0]
+        else:
+            missing.append(ticker)
+
+    if missing:
+        fetch_start = min(start, pd.Timestamp.now().normalize() - pd.Timedelta(days=CLOSES_MIN_LOOKBACK_DAYS))
+        downloaded = _download_closes(missing, fetch_start)
+        for ticker in missing:
+            if ticker not in downloaded.columns:
+                continue
+            closes = downloaded[ticker].dropna()
+            if closes.empty:
+                continue
+            with _lock:
+                _closes[ticker] = (closes, fetch_start, now)
+            series[ticker] = closes
+
+    if not series:
+        return pd.DataFrame()
+    frame = pd.DataFrame(series).sort_index()
+    return frame[frame.index >= start]
@@ -9,6 +9,7 @@ import asyncio
 import os
 from typing import Dict, Any, Optional
 import httpx
+from http_client import get_client
 
 
 class InAppMCPClient:
@@ -28,7 +29,8 @@ class InAppMCPClient:
         
         self.access_token = access_token
         self.api_base_url = api_base_url
-        self.client = httpx.AsyncClient(timeout=30.0)
+        # Shared connection pool; its lifecycle belongs to the app, not this client
+        self.client = get_client()
     
     async def get_headers(self) -> Dict[str, str]:
         """Get headers with authentication token."""
@@ -134,54 +136,61 @@ class InAppMCPClient:
     
     async def get_watchlist(self) -> str:
         """Get watchlist."""
-        result = await self.api_request("GET", "/api/watchlist")
+        result = await self.api_request("GET", "/api/watchlist/quotes")
         
         if not result:
             return "👁️ Your watchlist is empty."
         
         output = "👁️ **Watchlist**\n\n"
         
-        for item in result:
-            ticker = item['ticker']
-            try:
-                price_data = await self.api_request("GET", f"/api/stock/{ticker}/current")
-                change = price_data['price'] - price_data.get('previous_close', price_data['price'])
-                change_pct = (change / price_data.get('previous_close', price_data['price'])) * 100 if price_data.get('previous_close') else 0
-                change_emoji = "📈" if change >= 0 else "📉"
-                
-                output += f"{ticker} - {price_data.get('company_name', ticker)}\n"
-                output += f"  ${price_data['price']:.2f} {change_emoji} ${change:+.2f} ({change_pct:+.2f}%)\n\n"
-            except:
+        for price_data in result:
+            ticker = price_data['ticker']
+            if price_data.get('price') is None:
                 output += f"{ticker}\n  (Price unavailable)\n\n"
+                continue
+            
+            previous_close = price_data.get('previous_close') or price_data['price']
+            change = price_data['price'] - previous_close
+            change_pct = (change / previous_close) * 100 if price_data.get('previous_close') else 0
+            change_emoji = "📈" if change >= 0 else "📉"
+            
+            output += f"{ticker} - {price_data.get('company_name', ticker)}\n"
+            output += f"  ${price_data['price']:.2f} {change_emoji} ${change:+.2f} ({change_pct:+.2f}%)\n\n"
         
         return output
     
     async def remove_from_watchlist(self, ticker: str) -> str:
         """Remove stock from watchlist."""
-        watchlist = await self.api_request("GET", "/api/watchlist")
-        item = next((w for w in watchlist if w['ticker'] == ticker.upper()), None)
-        
-        if not item:
-            return f"❌ {ticker.upper()} is not in your watchlist."
-        
-        await self.api_request("DELETE", f"/api/watchlist/{item['id']}")
+        try:
+            await self.api_request("DELETE", f"/api/watchlist/ticker/{ticker.upper()}")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return f"❌ {ticker.upper()} is not in your watchlist."
+            raise
         return f"✅ Removed {ticker.upper()} from your watchlist."
     
     async def get_transaction_history(self) -> str:
         """Get transaction history."""
-        result = await self.api_request("GET", "/api/transactions")
+        result = await self.api_request("GET", "/api/transactions", params={"limit": 20})
         
         if not result:
             return "📜 No transaction history found."
         
         output = "📜 **Transaction History**\n\n"
         
-        for txn in sorted(result, key=lambda x: x['date'], reverse=True)[:20]:
+        for txn in result:
             emoji = "🟢" if txn['type'] == 'buy' else "🔴"
             output += f"{emoji} {txn['date']} - {txn['type'].upper()} {txn['quantity']} {txn['ticker']} @ ${txn['price']:.2f}\n"
         
         return output
     
+    async def batch(self, operations: list) -> str:
+        """Run several operations in one request."""
+        import json
+        
+        result = await self.api_request("POST", "/api/batch", json={"operations": operations})
+        return json.dumps(result["results"], indent=2)
+    
     async def execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
         """
         Execute a tool by name with given arguments.
@@ -222,14 +231,16 @@ class InAppMCPClient:
                 return await self.remove_from_watchlist(arguments["ticker"])
             elif tool_name == "get_transaction_history":
                 return await self.get_transaction_history()
+            elif tool_name == "batch":
+                return await self.batch(arguments["operations"])
             else:
                 return f"❌ Unknown tool: {tool_name}"
         except Exception as e:
             return f"❌ Error: {str(e)}"
     
     async def close(self):
-        """Close the HTTP client."""
-        await self.client.aclose()
+        """Release the client. The shared connection pool is closed on app shutdown."""
+        self.client = None
 
 
 # Tool definitions for the LLM to understand what tools are available
@@ -289,5 +300,17 @@ AVAILABLE_TOOLS = [
         "name": "get_transaction_history",
         "description": "Get transaction history",
         "parameters": {}
+    },
+    {
+        "name": "batch",
+        "description": "Run several operations in one call; read-only operations run concurrently",
+        "parameters": {
+            "operations": (
+                "List of {\"op\": name, \"args\": {...}}. Operations: get_stock_price, get_stock_quotes, "
+                "get_stock_info, get_stock_history, get_portfolio_summary, get_watchlist, get_transactions "
+                "(or get_transaction_history), get_paper_trading_status, get_profit_loss, buy_stock, "
+                "sell_stock, add_to_watchlist, remove_from_watchlist"
+            )
+        }
     }
 ]
@@ -7,6 +7,7 @@ It connects to the NVest AI FastAPI backend.
 """
 
 import asyncio
+import json
 import os
 from datetime import datetime
 from typing import Any, Optional, List
@@ -15,12 +16,8 @@ from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
 import logging
-import requests
 from lxml import html
-import urllib3
-
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from http_client import get_client, close_client
 
 # Configure logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -40,7 +37,6 @@ ACCESS_TOKEN = os.getenv("PORTFOLIO_ACCESS_TOKEN", "")
 
 # Global variables for authentication
 access_token: Optional[str] = None
-client = httpx.AsyncClient(timeout=30.0)
 
 
 async def authenticate() -> str:
@@ -54,7 +50,7 @@ async def authenticate() -> str:
     if not USER_EMAIL or not USER_PASSWORD:
         raise ValueError("Either PORTFOLIO_ACCESS_TOKEN or (PORTFOLIO_USER_EMAIL and PORTFOLIO_USER_PASSWORD) must be set")
     
-    response = await client.post(
+    response = await get_client().post(
         f"{API_BASE_URL}/api/auth/token",
         data={
             "username": USER_EMAIL,
@@ -80,6 +76,7 @@ async def get_headers() -> dict:
 async def api_request(method: str, endpoint: str, **kwargs) -> dict:
     """Make an authenticated API request."""
     headers = await get_headers()
+    client = get_client()
     
     try:
         response = await client.request(
@@ -105,6 +102,37 @@ async def api_request(method: str, endpoint: str, **kwargs) -> dict:
         raise
 
 
+def _parse_search_results(content: bytes, max_results: int) -> List[str]:
+    """Extract title, snippet and link from a DuckDuckGo HTML results page."""
+    tree = html.fromstring(content)
+    result_elements = tree.xpath('//div[contains(@class, "result__body")]')
+    
+    results = []
+    for elem in result_elements[:max_results]:
+        title_elem = elem.xpath('.//a[contains(@class, "result__a")]')
+        snippet_elem = elem.xpath('.//a[contains(@class, "result__snippet")]')
+        
+        if title_elem:
+            title = title_elem[0].text_content().strip()
+            href = title_elem[0].get('href')
+            snippet = snippet_elem[0].text_content().strip() if snippet_elem else ""
+            results.append(f"**{title}**\n{snippet}\n{href}")
+    return results
+
+
+async def web_search(query: str, max_results: int = 5) -> List[str]:
+    """Search DuckDuckGo over the shared connection pool without blocking the event loop."""
+    response = await get_client().post(
+        "https://html.duckduckgo.com/html/",
+        data={"q": query},
+        headers={"User-Agent": "Mozilla/5.0"},
+        timeout=15
+    )
+    response.raise_for_status()
+    # Parsing is CPU-bound, keep it off the event loop
+    return await asyncio.to_thread(_parse_search_results, response.content, max_results)
+
+
 # Initialize MCP server
 app = Server("portfolio-tracker")
 
@@ -201,6 +229,34 @@ async def list_tools() -> List[Tool]:
                 },
                 "required": ["query"]
             }
+        ),
+        Tool(
+            name="batch",
+            description=(
+                "Run several operations in one call. Read-only operations run concurrently on the server. "
+                "Operations: get_stock_price, get_stock_quotes, get_stock_info, get_stock_history, "
+                "get_portfolio_summary, get_watchlist, get_transactions, get_paper_trading_status, "
+                "get_profit_loss, buy_stock, sell_stock, add_to_watchlist, remove_from_watchlist."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "operations": {
+                        "type": "array",
+                        "description": "Operations to run, in order",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "op": {"type": "string", "description": "Operation name"},
+                                "args": {"type": "object", "description": "Operation arguments, e.g. {\"ticker\": \"AAPL\"}"},
+                                "id": {"type": "string", "description": "Optional id echoed back in the result"}
+                            },
+                            "required": ["op"]
+                        }
+                    }
+                },
+                "required": ["operations"]
+            }
         )
     ]
 
@@ -273,30 +329,40 @@ async def call_tool(name: str, arguments: Any) -> List[TextContent]:
             return [TextContent(type="text", text=f"👁️ Added {arguments['ticker'].upper()} to watchlist")]
         
         elif name == "get_watchlist":
-            result = await api_request("GET", "/api/watchlist")
+            # Items and prices in one round trip
+            result = await api_request("GET", "/api/watchlist/quotes")
             if not result:
                 return [TextContent(type="text", text="👁️ Watchlist is empty")]
             
             output = "👁️ **Watchlist**\n\n"
             for item in result:
-                output += f"{item['ticker']}\n"
+                if item.get('price') is None:
+                    output += f"{item['ticker']}: (price unavailable)\n"
+                    continue
+                output += f"{item['ticker']}: ${item['price']:.2f}"
+                if item.get('previous_close'):
+                    change = item['price'] - item['previous_close']
+                    change_pct = (change / item['previous_close']) * 100
+                    output += f" ({change:+.2f}, {change_pct:+.2f}%)"
+                output += "\n"
             return [TextContent(type="text", text=output)]
         
         elif name == "remove_from_watchlist":
-            watchlist = await api_request("GET", "/api/watchlist")
-            item = next((w for w in watchlist if w['ticker'] == arguments['ticker'].upper()), None)
-            if not item:
-                return [TextContent(type="text", text=f"❌ {arguments['ticker'].upper()} not in watchlist")]
-            await api_request("DELETE", f"/api/watchlist/{item['id']}")
+            try:
+                await api_request("DELETE", f"/api/watchlist/ticker/{arguments['ticker'].upper()}")
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 404:
+                    return [TextContent(type="text", text=f"❌ {arguments['ticker'].upper()} not in watchlist")]
+                raise
             return [TextContent(type="text", text=f"✅ Removed {arguments['ticker'].upper()} from watchlist")]
         
         elif name == "get_transaction_history":
-            result = await api_request("GET", "/api/transactions")
+            result = await api_request("GET", "/api/transactions", params={"limit": 20})
             if not result:
                 return [TextContent(type="text", text="📜 No transactions")]
             
             output = "📜 **Transaction History**\n\n"
-            for txn in sorted(result, key=lambda x: x['date'], reverse=True)[:20]:
+            for txn in result:
                 emoji = "🟢" if txn['type'] == 'buy' else "🔴"
                 output += f"{emoji} {txn['date']}: {txn['type'].upper()} {txn['quantity']} {txn['ticker']} @ ${txn['price']:.2f}\n"
             return [TextContent(type="text", text=output)]
@@ -307,29 +373,7 @@ async def call_tool(name: str, arguments: Any) -> List[TextContent]:
             logger.info(f"Web search: {query}")
             
             try:
-                headers = {"User-Agent": "Mozilla/5.0"}
-                response = requests.post(
-                    "https://html.duckduckgo.com/html/",
-                    data={"q": query},
-                    headers=headers,
-                    timeout=15,
-                    verify=False
-                )
-                response.raise_for_status()
-                
-                tree = html.fromstring(response.content)
-                result_elements = tree.xpath('//div[contains(@class, "result__body")]')
-                
-                results = []
-                for elem in result_elements[:max_results]:
-                    title_elem = elem.xpath('.//a[contains(@class, "result__a")]')
-                    snippet_elem = elem.xpath('.//a[contains(@class, "result__snippet")]')
-                    
-                    if title_elem:
-                        title = title_elem[0].text_content().strip()
-                        href = title_elem[0].get('href')
-                        snippet = snippet_elem[0].text_content().strip() if snippet_elem else ""
-                        results.append(f"**{title}**\n{snippet}\n{href}")
+                results = await web_search(query, max_results)
                 
                 if not results:
                     return [TextContent(type="text", text=f"No results for '{query}'")]
@@ -340,6 +384,10 @@ async def call_tool(name: str, arguments: Any) -> List[TextContent]:
                 logger.error(f"Search failed: {e}", exc_info=True)
                 return [TextContent(type="text", text=f"Search failed: {str(e)}")]
         
+        elif name == "batch":
+            result = await api_request("POST", "/api/batch", json={"operations": arguments["operations"]})
+            return [TextContent(type="text", text=json.dumps(result["results"], indent=2))]
+        
         else:
             return [TextContent(type="text", text=f"Unknown tool: {name}")]
     
@@ -357,6 +405,8 @@ async def main():
     except Exception as e:
         logger.error(f"Server crashed: {e}", exc_info=True)
         raise
+    finally:
+        await close_client()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from sqlmodel import Field, SQLModel, Relationship
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Column, Index, JSON, UniqueConstraint
+from money import Fixed
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -12,20 +13,25 @@ class User(SQLModel, table=True):
     
     # Paper Trading Fields
     paper_trading_enabled: bool = Field(default=False)
-    cash_balance: float = Field(default=0.0)
-    total_deposited: float = Field(default=0.0)  # Track total deposits
-    total_withdrawn: float = Field(default=0.0)  # Track total withdrawals
+    cash_balance: float = Field(default=0.0, sa_type=Fixed)
+    total_deposited: float = Field(default=0.0, sa_type=Fixed)  # Track total deposits
+    total_withdrawn: float = Field(default=0.0, sa_type=Fixed)  # Track total withdrawals
     
     transactions: List["Transaction"] = Relationship(back_populates="user")
     watchlist_items: List["Watchlist"] = Relationship(back_populates="user")
     cash_transactions: List["CashTransaction"] = Relationship(back_populates="user")
 
 class Transaction(SQLModel, table=True):
+    __table_args__ = (
+        # Keyset pagination and date-ordered replays per user
+        Index("ix_transaction_user_date_id", "user_id", "date", "id"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     ticker: str
     type: str  # "buy" or "sell"
-    quantity: float
-    price: float
+    quantity: float = Field(sa_type=Fixed)
+    price: float = Field(sa_type=Fixed)
     date: datetime = Field(default_factory=datetime.utcnow)
     
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
@@ -46,11 +52,141 @@ class Watchlist(SQLModel, table=True):
     user: Optional[User] = Relationship(back_populates="watchlist_items")
 
 class CashTransaction(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_cashtransaction_user_date_id", "user_id", "date", "id"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     type: str  # "deposit" or "withdrawal"
-    amount: float
+    amount: float = Field(sa_type=Fixed)
     date: datetime = Field(default_factory=datetime.utcnow)
     note: Optional[str] = None
     
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
     user: Optional[User] = Relationship(back_populates="cash_transactions")
+
+class TaxLot(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ticker: str = Field(index=True)
+    quantity: float = Field(sa_type=Fixed)  # shares bought
+    remaining_quantity: float = Field(sa_type=Fixed)  # shares not yet sold
+    cost_per_share: float = Field(sa_type=Fixed)
+    open_date: datetime
+    
+    transaction_id: Optional[int] = Field(default=None, foreign_key="transaction.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
+
+class LotRelief(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ticker: str
+    quantity: float = Field(sa_type=Fixed)
+    cost_per_share: float = Field(sa_type=Fixed)
+    proceeds_per_share: float = Field(sa_type=Fixed)
+    realized_pl: float = Field(sa_type=Fixed)
+    date: datetime
+    
+    lot_id: Optional[int] = Field(default=None, foreign_key="taxlot.id")
+    transaction_id: Optional[int] = Field(default=None, foreign_key="transaction.id", index=True)
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
+
+class PortfolioSnapshot(SQLModel, table=True):
+    __tablename__ = "portfolio_snapshot"
+    __table_args__ = (
+        UniqueConstraint("user_id", "snapshot_date", name="uq_user_snapshot_date"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    snapshot_date: date = Field(index=True)
+    holdings_value: float = Field(sa_type=Fixed)
+    cost_basis: float = Field(sa_type=Fixed)
+    cash_balance: float = Field(sa_type=Fixed)
+    total_value: float = Field(sa_type=Fixed)
+    net_contributions: float = Field(sa_type=Fixed)  # deposits - withdrawals (paper) or buys - sells
+    unrealized_pl: float = Field(sa_type=Fixed)
+    realized_pl: float = Field(sa_type=Fixed)
+    profit_loss: float = Field(sa_type=Fixed)
+    holdings: Optional[list] = Field(default=None, sa_column=Column(JSON))  # per-ticker breakdown
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
+
+class Order(SQLModel, table=True):
+    __tablename__ = "paper_order"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ticker: str = Field(index=True)
+    side: str  # "buy" or "sell"
+    order_type: str  # "limit", "stop" or "stop_limit"
+    quantity: float = Field(sa_type=Fixed)
+    limit_price: Optional[float] = Field(default=None, sa_type=Fixed)
+    stop_price: Optional[float] = Field(default=None, sa_type=Fixed)
+    triggered: bool = Field(default=False)  # stop-limit whose stop has been hit
+    reserved_cash: float = Field(default=0.0, sa_type=Fixed)  # held for open buy orders
+    status: str = Field(default="open", index=True)  # open, filling, filled, cancelled, rejected
+    note: Optional[str] = None
+    fill_price: Optional[float] = Field(default=None, sa_type=Fixed)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    transaction_id: Optional[int] = Field(default=None, foreign_key="transaction.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
+
+class PriceAlert(SQLModel, table=True):
+    __tablename__ = "price_alert"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ticker: str = Field(index=True)
+    direction: str  # "above" or "below"
+    threshold: float = Field(sa_type=Fixed)
+    note: Optional[str] = None
+    status: str = Field(default="active", index=True)  # pending, active, triggered
+    triggered_price: Optional[float] = Field(default=None, sa_type=Fixed)
+    triggered_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    watchlist_id: Optional[int] = Field(default=None, foreign_key="watchlist.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
+
+class GuestSession(SQLModel, table=True):
+    __tablename__ = "guest_session"
+    
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)  # guests expire GUEST_TTL_DAYS after
+
+class LedgerEvent(SQLModel, table=True):
+    __tablename__ = "ledger_event"
+    __table_args__ = (
+        # Snapshot tails and keyset pages per user
+        Index("ix_ledger_event_user_id", "user_id", "id"),
+        Index("ix_ledger_event_user_date_id", "user_id", "date", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    epoch: int = Field(default=0)  # incremented by each paper-trading reset
+    kind: str  # opening, reset, deposit, withdrawal, buy, sell
+    ticker: Optional[str] = None
+    quantity: Optional[float] = Field(default=None, sa_type=Fixed)
+    price: Optional[float] = Field(default=None, sa_type=Fixed)
+    cash_delta: float = Field(default=0.0, sa_type=Fixed)
+    note: Optional[str] = None
+    date: datetime = Field(default_factory=datetime.utcnow)  # when it happened; imports can backdate
+    recorded_at: datetime = Field(default_factory=datetime.utcnow)  # when it was appended
+    
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+
+class LedgerSnapshot(SQLModel, table=True):
+    __tablename__ = "ledger_snapshot"
+    __table_args__ = (
+        UniqueConstraint("user_id", "event_id", name="uq_user_ledger_event"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    epoch: int
+    cash_balance: float = Field(sa_type=Fixed)
+    total_deposited: float = Field(sa_type=Fixed)
+    total_withdrawn: float = Field(sa_type=Fixed)
+    positions: dict = Field(default_factory=dict, sa_column=Column(JSON))  # {ticker: quantity}
+    recorded_at: datetime  # of the last event included
+    
+    event_id: int = Field(foreign_key="ledger_event.id")  # last event included
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
@@ -0,0 +1,56 @@
+"""
+Fixed-Point Money
+
+Prices, quantities and amounts are fixed-point numbers with PLACES decimal
+places. In the database they are DECIMAL columns (the Fixed column type),
+and every value is rounded to PLACES on its way in and out, so balances
+updated in SQL and values read back never carry binary-float residue.
+
+In analytics they become int64 counts of 10^-PLACES units (to_units), so
+positions, cash and P/L over any number of trades are exact integer sums
+and cumsums on whole arrays; from_units converts results back for JSON.
+With 6 places an int64 holds values up to about 9.2 trillion.
+"""
+
+from typing import Union
+import numpy as np
+from sqlalchemy import Numeric, cast, func
+from sqlalchemy.types import TypeDecorator
+
+
+PLACES = 6
+SCALE = 10 ** PLACES
+
+
+def quantize(value: float) -> float:
+    """The nearest fixed-point value, as a float."""
+    return round(float(value), PLACES)
+
+
+def to_units(values) -> np.ndarray:
+    """Fixed-point int64 units of an array (or scalar) of floats."""
+    return np.rint(np.asarray(values, dtype=float) * SCALE).astype(np.int64)
+
+
+def from_units(units) -> Union[np.ndarray, float]:
+    """Floats from int64 units; a plain float for a scalar."""
+    values = np.asarray(units, dtype=np.int64) / SCALE
+    return float(values) if values.ndim == 0 else values
+
+
+def rounded(expression):
+    """A SQL expression rounded to PLACES, for values updated in place like cash_balance + x."""
+    return func.round(cast(expression, Numeric), PLACES)
+
+
+class Fixed(TypeDecorator):
+    """DECIMAL(20, PLACES) column read and written as floats rounded to PLACES."""
+
+    impl = Numeric(20, PLACES, asdecimal=False)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else round(float(value), PLACES)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else round(float(value), PLACES)
@@ -0,0 +1,276 @@
+"""
+Paper Trading Orders
+
+Resting limit, stop and stop-limit orders for paper trading accounts. Buy
+orders reserve cash and sell orders reserve shares while they are open.
+
+Open orders are kept in a PriceLevelIndex by ticker and trigger level: buy
+limits and sell stops fire when the price falls to their level, sell limits
+and buy stops when it rises to it. A quote update only touches orders that
+can actually fire. A stop-limit is re-indexed at its limit once its stop is
+hit.
+
+Fills run on a single worker thread and go through trading.record_transaction
+like any other trade. An order is claimed with a conditional status update
+before it is filled, so several app workers never fill it twice; each worker
+re-syncs its index from the database every ORDER_BOOK_SYNC_SECONDS.
+
+A fill that fails for any reason other than a rejected trade puts the order
+back to open, with its reservation. The sync also reopens orders left
+"filling" for ORDER_FILL_TIMEOUT_SECONDS by a worker that died mid-fill: a
+fill marks its order filled in the same commit as the trade, so such an
+order was never filled.
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlmodel import Session, select, update, delete
+from database import engine
+from models import Order, Transaction, User
+from trading import TradeError, adjust_cash, available_cash, record_transaction, reserved_shares, owned_shares
+from price_levels import PriceLevelIndex, fires
+import market_data
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_TYPES = ("limit", "stop", "stop_limit")
+ORDER_SIDES = ("buy", "sell")
+ORDER_STATUSES = ("open", "filling", "filled", "cancelled", "rejected")
+ORDER_BOOK_SYNC_SECONDS = float(os.getenv("ORDER_BOOK_SYNC_SECONDS", "60"))
+ORDER_FILL_TIMEOUT_SECONDS = float(os.getenv("ORDER_FILL_TIMEOUT_SECONDS", "300"))
+
+
+def _trigger(order: Order) -> Tuple[str, float]:
+    """
+    The list an order waits in and its level: "below" orders fire when the
+    price is at or under the level, "above" orders when it is at or over.
+    """
+    if order.order_type == "limit" or (order.order_type == "stop_limit" and order.triggered):
+        return ("below", order.limit_price) if order.side == "buy" else ("above", order.limit_price)
+    return ("above", order.stop_price) if order.side == "buy" else ("below", order.stop_price)
+
+
+class OrderBook:
+    def __init__(self):
+        self._loaded = False
+        self._index = PriceLevelIndex()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders")
+
+    def add(self, order: Order):
+        self._index.add(order.id, order.ticker, *_trigger(order))
+
+    def remove(self, order_id: int):
+        self._index.remove(order_id)
+
+    def load(self, session: Session):
+        """Rebuild the index from the open orders in the database."""
+        open_orders = session.exec(select(Order).where(Order.status == "open")).all()
+        self._index.replace([(order.id, order.ticker, *_trigger(order)) for order in open_orders])
+        self._loaded = True
+
+    def tickers(self) -> List[str]:
+        return self._index.tickers()
+
+    def on_quote(self, quote: dict):
+        """Quote listener: hand any orders that can fire to the fill worker."""
+        if not self._loaded:
+            return
+        order_ids = self._index.due(quote["ticker"], quote["price"])
+        if order_ids:
+            self._executor.submit(self._process, order_ids, quote["price"])
+
+    def check(self, ticker: str):
+        """Evaluate a ticker's orders against its cached quote, e.g. right after placing one."""
+        quote = market_data.peek_quote(ticker)
+        if quote:
+            self.on_quote(quote)
+
+    def _process(self, order_ids: List[int], price: float):
+        with Session(engine) as session:
+            for order_id in order_ids:
+                try:
+                    self._execute(session, order_id, price)
+                except Exception:
+                    session.rollback()
+                    logger.exception(f"Failed to process order {order_id}")
+
+    def _execute(self, session: Session, order_id: int, price: float):
+        order = session.get(Order, order_id)
+        if order is None or order.status != "open":
+            self.remove(order_id)
+            return
+
+        side, level = _trigger(order)
+        if not fires(side, level, price):
+            self.add(order)
+            return
+
+        if order.order_type == "stop_limit" and not order.triggered:
+            order.triggered = True
+            order.updated_at = datetime.utcnow()
+            session.add(order)
+            session.commit()
+            self.add(order)
+            side, level = _trigger(order)
+            if not fires(side, level, price):
+                return
+
+        claimed = session.exec(
+            update(Order)
+            .where(Order.id == order_id)
+            .where(Order.status == "open")
+            .values(status="filling", updated_at=datetime.utcnow())
+        ).rowcount
+        session.commit()
+        self.remove(order_id)
+        if not claimed:
+            return
+
+        order = session.get(Order, order_id)
+        session.refresh(order)
+        user = session.get(User, order.user_id)
+        transaction = Transaction(ticker=order.ticker, type=order.side, quantity=order.quantity, price=price)
+        try:
+            record_transaction(session, user, transaction, order=order)
+            logger.info(f"Filled order {order_id}: {order.side} {order.quantity} {order.ticker} @ {price}")
+        except TradeError as e:
+            order = session.get(Order, order_id)
+            order.status = "rejected"
+            order.note = str(e)
+            order.updated_at = datetime.utcnow()
+            session.add(order)
+            session.commit()
+            logger.info(f"Rejected order {order_id}: {e}")
+        except Exception:
+            session.rollback()
+            session.exec(
+                update(Order)
+                .where(Order.id == order_id)
+                .where(Order.status == "filling")
+                .values(status="open", updated_at=datetime.utcnow())
+            )
+            session.commit()
+            order = session.get(Order, order_id)
+            session.refresh(order)
+            if order.status == "open":
+                self.add(order)
+            logger.exception(f"Failed to fill order {order_id}, reopened it")
+
+
+book = OrderBook()
+market_data.add_quote_listener(book.on_quote)
+market_data.add_watched_tickers(book.tickers)
+
+
+def place_order(session: Session, user: User, request: Order) -> Order:
+    """Validate an order, reserve cash or shares for it and add it to the book. Raises TradeError."""
+    side = (request.side or "").lower()
+    order_type = (request.order_type or "").lower()
+    if side not in ORDER_SIDES:
+        raise TradeError(f"Invalid side. Use one of: {', '.join(ORDER_SIDES)}")
+    if order_type not in ORDER_TYPES:
+        raise TradeError(f"Invalid order type. Use one of: {', '.join(ORDER_TYPES)}")
+    if not request.quantity or request.quantity <= 0:
+        raise TradeError("Quantity must be positive")
+    if order_type in ("limit", "stop_limit") and not (request.limit_price and request.limit_price > 0):
+        raise TradeError("A positive limit_price is required")
+    if order_type in ("stop", "stop_limit") and not (request.stop_price and request.stop_price > 0):
+        raise TradeError("A positive stop_price is required")
+
+    order = Order(
+        ticker=request.ticker.upper(),
+        side=side,
+        order_type=order_type,
+        quantity=request.quantity,
+        limit_price=request.limit_price if order_type != "stop" else None,
+        stop_price=request.stop_price if order_type != "limit" else None,
+        user_id=user.id,
+    )
+
+    if side == "buy":
+        # Stop orders fill at the market, so their reservation is only an estimate at the stop price
+        order.reserved_cash = order.quantity * (order.limit_price or order.stop_price)
+        # Checks the reservation fits and locks the account until the order is committed
+        if not adjust_cash(session, user, 0.0, reserve=order.reserved_cash):
+            available = available_cash(session, user.id)
+            session.rollback()
+            raise TradeError(
+                f"Insufficient cash balance. Available: ${available:.2f}, Required: ${order.reserved_cash:.2f}"
+            )
+    else:
+        adjust_cash(session, user, 0.0)
+        available = owned_shares(session, user.id, order.ticker) - reserved_shares(session, user.id, order.ticker)
+        if available < order.quantity:
+            session.rollback()
+            raise TradeError(f"Insufficient shares. Available: {available}, Selling: {order.quantity}")
+
+    session.add(order)
+    session.commit()
+    session.refresh(order)
+    book.add(order)
+    book.check(order.ticker)
+    return order
+
+
+def cancel_order(session: Session, user_id: int, order_id: int) -> bool:
+    """Cancel an open order, releasing its reservation. False if it isn't open or isn't the user's."""
+    cancelled = session.exec(
+        update(Order)
+        .where(Order.id == order_id)
+        .where(Order.user_id == user_id)
+        .where(Order.status == "open")
+        .values(status="cancelled", updated_at=datetime.utcnow())
+    ).rowcount
+    session.commit()
+    book.remove(order_id)
+    return bool(cancelled)
+
+
+def list_orders(session: Session, user_id: int, status: Optional[str] = None) -> List[Order]:
+    query = select(Order).where(Order.user_id == user_id)
+    if status:
+        query = query.where(Order.status == status)
+    return session.exec(query.order_by(Order.created_at.desc(), Order.id.desc())).all()
+
+
+def delete_orders(session: Session, user_id: int):
+    """Remove a user's orders, ahead of deleting their transactions."""
+    for order_id in session.exec(select(Order.id).where(Order.user_id == user_id).where(Order.status == "open")).all():
+        book.remove(order_id)
+    session.exec(delete(Order).where(Order.user_id == user_id))
+
+
+def recover_stuck_fills(session: Session) -> int:
+    """Reopen orders claimed for a fill more than ORDER_FILL_TIMEOUT_SECONDS ago that never finished."""
+    now = datetime.utcnow()
+    reopened = session.exec(
+        update(Order)
+        .where(Order.status == "filling")
+        .where(Order.updated_at < now - timedelta(seconds=ORDER_FILL_TIMEOUT_SECONDS))
+        .values(status="open", updated_at=now)
+    ).rowcount
+    session.commit()
+    if reopened:
+        logger.warning(f"Reopened {reopened} orders left filling by an interrupted fill")
+    return reopened
+
+
+def _sync():
+    with Session(engine) as session:
+        recover_stuck_fills(session)
+        book.load(session)
+
+
+async def run_book_sync():
+    """Load the order book, then re-sync it from the database periodically until cancelled."""
+    while True:
+        try:
+            await asyncio.to_thread(_sync)
+        except Exception:
+            logger.exception("Order book sync failed")
+        await asyncio.sleep(ORDER_BOOK_SYNC_SECONDS)
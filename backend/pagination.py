@@ -0,0 +1,96 @@
+"""
+Ledger Pagination
+
+Keyset (cursor) pagination and NDJSON export for date-ordered ledgers such
+as transactions and cash transactions. Pages are ordered by (date, id) and
+the cursor is the last row's (date, id), so fetching any page is an index
+range scan on (user_id, date, id) regardless of how deep it is, and rows
+added meanwhile never shift a page.
+
+Without a limit, the endpoints return every matching row as a plain list,
+as they always have. Lists, pages and exports select only the listed columns and return plain rows,
+not ORM instances, so they skip model construction and response-model
+validation and are serialized directly with orjson.
+
+Exports stream the same ordered query in batches of EXPORT_BATCH_ROWS from
+a server-side cursor, one JSON object per line, without loading the ledger.
+"""
+
+import base64
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+import orjson
+from sqlalchemy import tuple_
+from sqlmodel import Session, select
+from database import engine
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_ROWS = 1000
+PAGE_ORDERS = ("desc", "asc")
+
+
+def encode_cursor(date: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """The (date, id) a cursor points after. Raises ValueError if it isn't one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date, row_id = raw.split("|")
+        return datetime.fromisoformat(date), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def _ordered(query, model, order: str):
+    if order == "asc":
+        return query.order_by(model.date.asc(), model.id.asc())
+    return query.order_by(model.date.desc(), model.id.desc())
+
+
+def select_rows(session: Session, model, columns: List[str], conditions: list, order: str = "desc") -> List[dict]:
+    """Every row matching conditions, as dicts of columns, in (date, id) order."""
+    query = select(*(getattr(model, column) for column in columns)).where(*conditions)
+    return [dict(zip(columns, row)) for row in session.exec(_ordered(query, model, order)).all()]
+
+
+def keyset_page(
+    session: Session,
+    model,
+    columns: List[str],
+    conditions: list,
+    order: str = "desc",
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> dict:
+    """
+    One page of rows matching conditions, as {"items", "next_cursor"}, each
+    item a dict of columns (which must include date and id). next_cursor is
+    None on the last page. Raises ValueError for a bad cursor.
+    """
+    query = select(*(getattr(model, column) for column in columns)).where(*conditions)
+    if cursor:
+        date, row_id = decode_cursor(cursor)
+        key = tuple_(model.date, model.id)
+        query = query.where(key > tuple_(date, row_id) if order == "asc" else key < tuple_(date, row_id))
+
+    # One extra row tells whether there is a next page without a count query
+    rows = session.exec(_ordered(query, model, order).limit(limit + 1)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [dict(zip(columns, row)) for row in rows],
+        "next_cursor": encode_cursor(rows[-1].date, rows[-1].id) if more else None,
+    }
+
+
+def export_ndjson(model, columns: List[str], conditions: list, order: str = "desc") -> Iterator[bytes]:
+    """Every matching row as NDJSON, read and sent in batches from a server-side cursor."""
+    query = _ordered(select(*(getattr(model, column) for column in columns)).where(*conditions), model, order)
+    with Session(engine) as session:
+        result = session.exec(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        for rows in result.partitions():
+            yield b"".join(orjson.dumps(dict(zip(columns, row))) + b"\n" for row in rows)
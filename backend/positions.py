@@ -0,0 +1,80 @@
+"""
+Cached Positions
+
+Per-user holdings derived from the transaction ledger: quantities from a
+replay of the transactions, cost basis and realized P/L from the tax lots,
+so summaries, analytics and reports agree with /portfolio/lots and
+/portfolio/realized. Results are cached in-process and invalidated whenever
+a user's transactions change, with a TTL as a safety net for multi-worker
+deployments.
+"""
+
+import os
+import time
+import threading
+from typing import Dict
+import numpy as np
+import pandas as pd
+from sqlmodel import Session
+from analytics import compute_holdings, load_ledger
+import lots
+
+
+POSITIONS_TTL_SECONDS = float(os.getenv("POSITIONS_TTL_SECONDS", "300"))
+
+_positions: Dict[int, tuple] = {}
+_lock = threading.Lock()
+
+
+def lot_holdings(session: Session, user_id: int) -> pd.DataFrame:
+    """
+    compute_holdings for a user, with total_cost, avg_cost and realized_pl
+    taken from their tax lots. Backfills (and commits) lots for accounts
+    from before lot tracking.
+    """
+    if lots.ensure_lots(session, user_id):
+        session.commit()
+    holdings = compute_holdings(load_ledger(session, user_id))
+    cost_basis = lots.lot_cost_basis(session, user_id)
+    realized = lots.realized_by_ticker(session, user_id)
+    holdings["total_cost"] = [cost_basis.get(ticker, 0.0) for ticker in holdings.index]
+    holdings["realized_pl"] = [realized.get(ticker, 0.0) for ticker in holdings.index]
+    holdings["avg_cost"] = np.divide(
+        holdings["total_cost"].to_numpy(dtype=float), holdings["quantity"].to_numpy(dtype=float),
+        out=np.zeros(len(holdings)), where=holdings["quantity"].to_numpy(dtype=float) > 0
+    )
+    return holdings
+
+
+def compute_positions(session: Session, user_id: int) -> Dict[str, dict]:
+    """A user's holdings as {ticker: {"quantity", "total_cost"}}, costs from their open lots."""
+    holdings = lot_holdings(session, user_id)
+    return {
+        ticker: {"quantity": float(row["quantity"]), "total_cost": float(row["total_cost"])}
+        for ticker, row in holdings.iterrows()
+    }
+
+
+def get_positions(session: Session, user_id: int) -> Dict[str, dict]:
+    """Get a user's positions, serving from cache when possible."""
+    now = time.time()
+    with _lock:
+        cached = _positions.get(user_id)
+    if cached and now - cached[1] < POSITIONS_TTL_SECONDS:
+        return cached[0]
+
+    holdings = compute_positions(session, user_id)
+    with _lock:
+        _positions[user_id] = (holdings, now)
+    return holdings
+
+
+def get_open_positions(session: Session, user_id: int) -> Dict[str, dict]:
+    """Positions with a positive quantity only."""
+    return {t: p for t, p in get_positions(session, user_id).items() if p["quantity"] > 0}
+
+
+def invalidate_positions(user_id: int):
+    """Drop the cached positions for a user after their transactions change."""
+    with _lock:
+        _positions.pop(user_id, None)
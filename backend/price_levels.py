@@ -0,0 +1,74 @@
+"""
+Price Level Index
+
+In-memory index of price triggers by ticker, shared by resting orders and
+price alerts. Each ticker keeps two sorted lists of (level, id): "below"
+entries fire when the price is at or under their level, "above" entries
+when it is at or over. Finding everything a quote fires is two bisections
+and a slice, however many triggers the ticker has, and adding or removing a
+trigger is logarithmic (sortedcontainers.SortedList).
+"""
+
+import threading
+from typing import Dict, List, Tuple
+from sortedcontainers import SortedList
+
+
+class PriceLevelIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels: Dict[str, Dict[str, SortedList]] = {}  # ticker -> {"below"/"above": sorted (level, id)}
+        self._entries: Dict[int, Tuple[str, str, tuple]] = {}  # id -> (ticker, side, entry)
+
+    def _remove_locked(self, item_id: int):
+        entry = self._entries.pop(item_id, None)
+        if entry is None:
+            return
+        ticker, side, key = entry
+        self._levels[ticker][side].discard(key)
+
+    def _add_locked(self, item_id: int, ticker: str, side: str, level: float):
+        self._remove_locked(item_id)
+        ticker = ticker.upper()
+        key = (level, item_id)
+        self._levels.setdefault(ticker, {"below": SortedList(), "above": SortedList()})[side].add(key)
+        self._entries[item_id] = (ticker, side, key)
+
+    def add(self, item_id: int, ticker: str, side: str, level: float):
+        """Index (or re-index) an id under a ticker; side is "below" or "above"."""
+        with self._lock:
+            self._add_locked(item_id, ticker, side, level)
+
+    def remove(self, item_id: int):
+        with self._lock:
+            self._remove_locked(item_id)
+
+    def replace(self, items: List[Tuple[int, str, str, float]]):
+        """Rebuild the whole index from (id, ticker, side, level) tuples."""
+        with self._lock:
+            self._levels = {}
+            self._entries = {}
+            for item in items:
+                self._add_locked(*item)
+
+    def tickers(self) -> List[str]:
+        with self._lock:
+            return [ticker for ticker, sides in self._levels.items() if sides["below"] or sides["above"]]
+
+    def due(self, ticker: str, price: float) -> List[int]:
+        """IDs on a ticker whose trigger fires at this price."""
+        with self._lock:
+            sides = self._levels.get(ticker.upper())
+            if not sides:
+                return []
+            below, above = sides["below"], sides["above"]
+            fired = below[below.bisect_left((price, -1)):] + above[:above.bisect_right((price, float("inf")))]
+        return [item_id for _, item_id in fired]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+def fires(side: str, level: float, price: float) -> bool:
+    return price <= level if side == "below" else price >= level
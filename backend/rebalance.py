@@ -0,0 +1,232 @@
+"""
+Portfolio Rebalancing
+
+Turns target weights into the buy and sell orders that reach them. Each
+ticker's trade is the gap between its target and current value, so the
+order set is minimal: one order per ticker that is off target by more than
+min_trade_value, none for the rest. Buys are funded by available cash
+(paper trading cash net of open-order reservations) plus the sells, and a
+turnover limit moves every position the same fraction of the way.
+
+Targets can also come from an optimizer over the cached risk universe
+(risk.get_universe): minimum variance, or mean-variance with a risk
+aversion, both long-only with an optional per-ticker cap. The optimizer is
+accelerated projected gradient on whole arrays; each step is one
+matrix-vector product and a projection onto the capped simplex.
+"""
+
+from typing import Dict, List, Optional
+import numpy as np
+from sqlmodel import Session
+from models import User
+from positions import get_open_positions
+from trading import reserved_cash, reserved_shares_by_ticker
+from risk import get_universe, TRADING_DAYS
+import market_data
+
+
+REBALANCE_MODES = ("target", "min_variance", "mean_variance")
+OPTIMIZER_ITERATIONS = 500
+OPTIMIZER_TOLERANCE = 1e-10
+EPSILON = 1e-9
+
+
+# --- Optimizer ---
+
+def project_capped_simplex(v: np.ndarray, total: float, cap: float) -> np.ndarray:
+    """Closest w to v with 0 <= w <= cap and sum(w) == total, by bisection on the shift."""
+    lo, hi = float(v.min()) - cap, float(v.max())
+    for _ in range(100):
+        shift = (lo + hi) / 2
+        if np.clip(v - shift, 0.0, cap).sum() > total:
+            lo = shift
+        else:
+            hi = shift
+        if hi - lo < 1e-12:
+            break
+    return np.clip(v - (lo + hi) / 2, 0.0, cap)
+
+
+def _largest_eigenvalue(matrix: np.ndarray, iterations: int = 50) -> float:
+    x = np.full(len(matrix), 1.0 / np.sqrt(len(matrix)))
+    value = 0.0
+    for _ in range(iterations):
+        y = matrix @ x
+        value = float(np.linalg.norm(y))
+        if value == 0:
+            return 0.0
+        x = y / value
+    return value
+
+
+def optimize_weights(
+    cov: np.ndarray,
+    mean: Optional[np.ndarray] = None,
+    risk_aversion: float = 1.0,
+    total: float = 1.0,
+    cap: float = 1.0
+) -> np.ndarray:
+    """
+    Long-only weights summing to total, each at most cap.
+
+    Without mean: minimize w'Σw. With mean: maximize w'μ - (risk_aversion/2) w'Σw.
+    """
+    n = len(cov)
+    if cap * n < total - EPSILON:
+        raise ValueError(f"max_weight {cap} is too small for {n} tickers")
+
+    scale = risk_aversion if mean is not None else 2.0
+    lipschitz = scale * _largest_eigenvalue(cov)
+    step = 1.0 / lipschitz if lipschitz > 0 else 1.0
+
+    w = project_capped_simplex(np.full(n, total / n), total, cap)
+    y, t = w.copy(), 1.0
+    for _ in range(OPTIMIZER_ITERATIONS):
+        gradient = scale * (cov @ y)
+        if mean is not None:
+            gradient -= mean
+        w_next = project_capped_simplex(y - step * gradient, total, cap)
+        t_next = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+        y = w_next + ((t - 1.0) / t_next) * (w_next - w)
+        converged = np.abs(w_next - w).max() < OPTIMIZER_TOLERANCE
+        w, t = w_next, t_next
+        if converged:
+            break
+    return w
+
+
+def optimized_targets(
+    tickers: List[str],
+    mode: str,
+    risk_aversion: float,
+    max_weight: float,
+    cash_weight: float
+) -> Dict[str, float]:
+    """Target weights for a ticker universe from its cached annualized return statistics."""
+    tickers = sorted(tickers)
+    if len(tickers) < 2:
+        raise ValueError("Optimization needs at least two tickers")
+    universe = get_universe(tickers)
+    if universe is None:
+        raise ValueError("Not enough price history to optimize these tickers")
+
+    n = len(tickers)
+    cov = universe["cov"][:n, :n] * TRADING_DAYS
+    missing = [t for t, variance in zip(tickers, np.diag(cov)) if variance <= 0]
+    if missing:
+        raise ValueError(f"No price history for: {', '.join(missing)}")
+
+    mean = universe["mean"][:n] * TRADING_DAYS if mode == "mean_variance" else None
+    weights = optimize_weights(cov, mean, risk_aversion, 1.0 - cash_weight, max_weight)
+    return {t: float(w) for t, w in zip(tickers, weights)}
+
+
+# --- Orders ---
+
+def plan_rebalance(
+    session: Session,
+    user: User,
+    targets: Dict[str, float],
+    max_turnover: Optional[float] = None,
+    fractional: bool = True,
+    min_trade_value: float = 1.0
+) -> dict:
+    """
+    The orders that move a user's holdings to target weights of total value.
+
+    Held tickers missing from targets are sold; weights summing to less than
+    1 leave the rest in cash. Turnover is traded value over total value.
+    Raises ValueError on bad targets or missing quotes.
+    """
+    targets = {t.upper(): float(w) for t, w in targets.items()}
+    if any(w < 0 for w in targets.values()):
+        raise ValueError("Target weights must not be negative")
+    if sum(targets.values()) > 1.0 + EPSILON:
+        raise ValueError("Target weights must sum to at most 1")
+
+    held: Dict[str, float] = {}
+    for ticker, position in get_open_positions(session, user.id).items():
+        held[ticker.upper()] = held.get(ticker.upper(), 0.0) + position["quantity"]
+
+    tickers = sorted(set(held) | set(targets))
+    if not tickers:
+        raise ValueError("Nothing to rebalance")
+    quotes = market_data.get_quotes(tickers)
+    missing = [t for t in tickers if t not in quotes]
+    if missing:
+        raise ValueError(f"No quote for: {', '.join(missing)}")
+
+    prices = np.array([quotes[t]["price"] for t in tickers])
+    shares = np.array([held.get(t, 0.0) for t in tickers])
+    reserved = reserved_shares_by_ticker(session, user.id)
+    sellable = np.maximum(shares - np.array([reserved.get(t, 0.0) for t in tickers]), 0.0)
+    weights = np.array([targets.get(t, 0.0) for t in tickers])
+    cash = user.cash_balance - reserved_cash(session, user.id) if user.paper_trading_enabled else 0.0
+
+    values = shares * prices
+    total_value = cash + values.sum()
+    if total_value <= 0:
+        raise ValueError("Nothing to rebalance")
+
+    # Minimal order set: every ticker off target by more than min_trade_value, nothing else
+    delta = weights * total_value - values
+    delta[np.abs(delta) < min_trade_value] = 0.0
+    delta = np.maximum(delta, -sellable * prices)
+
+    turnover = np.abs(delta).sum() / total_value
+    limited = max_turnover is not None and turnover > max_turnover + EPSILON
+    if limited:
+        delta *= max_turnover / turnover
+
+    quantity = delta / prices
+    if not fractional:
+        quantity = np.trunc(quantity)
+
+    # Buys can only spend cash plus what the sells raise
+    sells = -np.minimum(quantity, 0.0) @ prices
+    buys = np.maximum(quantity, 0.0) @ prices
+    if buys > cash + sells + EPSILON:
+        ratio = max(cash + sells, 0.0) / buys
+        quantity = np.where(quantity > 0, quantity * ratio, quantity)
+        if not fractional:
+            quantity = np.trunc(quantity)
+        buys = np.maximum(quantity, 0.0) @ prices
+
+    trade_value = quantity * prices
+    after = values + trade_value
+    cash_after = cash + sells - buys
+    orders = [
+        {
+            "ticker": tickers[i],
+            "side": "buy" if quantity[i] > 0 else "sell",
+            "quantity": float(abs(quantity[i])),
+            "price": float(prices[i]),
+            "value": float(abs(trade_value[i])),
+        }
+        # Sells first, so their proceeds fund the buys when submitted in order
+        for i in sorted(np.flatnonzero(np.abs(quantity) > EPSILON), key=lambda i: quantity[i] > 0)
+    ]
+
+    return {
+        "orders": orders,
+        "allocations": [
+            {
+                "ticker": ticker,
+                "price": float(prices[i]),
+                "current_quantity": float(shares[i]),
+                "current_weight": float(values[i] / total_value),
+                "target_weight": float(weights[i]),
+                "resulting_weight": float(after[i] / total_value),
+            }
+            for i, ticker in enumerate(tickers)
+        ],
+        "summary": {
+            "total_value": float(total_value),
+            "cash_before": float(cash),
+            "cash_after": float(cash_after),
+            "buy_value": float(buys),
+            "sell_value": float(sells),
+            "turnover": float(np.abs(trade_value).sum() / total_value),
+            "turnover_limited": bool(limited),
+        },
+    }
@@ -0,0 +1,216 @@
+"""
+Report Exports
+
+Downloadable CSV and XLSX statements: holdings, realized P/L by lot, the
+transaction ledger and cash history. Ledger reports read rows through a
+server-side cursor in batches of REPORT_BATCH_ROWS and each batch is
+encoded and sent before the next is read, so an export starts downloading
+at once and runs in constant memory however long the history is.
+
+XLSX is written without a spreadsheet library: the workbook is a zip of a
+few fixed XML parts plus one sheet, and the sheet is deflated into the zip
+as rows arrive. zipfile writes to unseekable streams with data
+descriptors, so the archive never has to be rewound or held whole.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+from sqlmodel import Session, select
+from database import engine
+from models import Transaction, CashTransaction, TaxLot, LotRelief
+
+
+REPORT_KINDS = ("holdings", "realized", "transactions", "cash")
+REPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+REPORT_BATCH_ROWS = 1000
+# Reports read straight from a ledger table, as opposed to holdings which are computed
+LEDGER_REPORT_MODELS = {"realized": LotRelief, "transactions": Transaction, "cash": CashTransaction}
+
+Batches = Iterable[Sequence[tuple]]
+
+
+# --- Rows ---
+
+def _query_batches(query) -> Iterator[Sequence[tuple]]:
+    with Session(engine) as session:
+        result = session.exec(query.execution_options(yield_per=REPORT_BATCH_ROWS))
+        for rows in result.partitions():
+            yield rows
+
+
+def ledger_report(kind: str, user_id: int, conditions: Optional[list] = None) -> Tuple[List[str], Batches]:
+    """Header and row batches of a ledger report, oldest first, filtered by extra conditions on its model."""
+    if kind == "transactions":
+        header = ["Date", "Ticker", "Type", "Quantity", "Price", "Value"]
+        query = select(
+            Transaction.date, Transaction.ticker, Transaction.type, Transaction.quantity,
+            Transaction.price, Transaction.quantity * Transaction.price
+        )
+    elif kind == "cash":
+        header = ["Date", "Type", "Amount", "Note"]
+        query = select(CashTransaction.date, CashTransaction.type, CashTransaction.amount, CashTransaction.note)
+    elif kind == "realized":
+        header = ["Date Sold", "Ticker", "Quantity", "Date Acquired", "Cost Per Share", "Proceeds Per Share", "Cost Basis", "Proceeds", "Realized P/L"]
+        query = select(
+            LotRelief.date, LotRelief.ticker, LotRelief.quantity, TaxLot.open_date,
+            LotRelief.cost_per_share, LotRelief.proceeds_per_share,
+            LotRelief.quantity * LotRelief.cost_per_share, LotRelief.quantity * LotRelief.proceeds_per_share,
+            LotRelief.realized_pl
+        ).join(TaxLot, TaxLot.id == LotRelief.lot_id)
+    else:
+        raise ValueError(f"Invalid report. Use one of: {', '.join(REPORT_KINDS)}")
+
+    model = LEDGER_REPORT_MODELS[kind]
+    query = query.where(model.user_id == user_id, *(conditions or []))
+    return header, _query_batches(query.order_by(model.date, model.id))
+
+
+def holdings_report(analytics: dict) -> Tuple[List[str], Batches]:
+    """Header and rows for holdings, from an analytics.portfolio_analytics result."""
+    header = ["Ticker", "Quantity", "Average Cost", "Cost Basis", "Price", "Market Value", "Weight", "Unrealized P/L", "Unrealized P/L %", "Realized P/L", "Sector"]
+    rows = [
+        (
+            h["ticker"], h["quantity"], h["avg_cost"], h["cost_basis"], h["current_price"], h["market_value"],
+            h["weight"], h["unrealized_pl"], h["unrealized_pl_pct"], h["realized_pl"], h["sector"],
+        )
+        for h in analytics["holdings"]
+    ]
+    return header, [rows]
+
+
+# --- CSV ---
+
+def csv_stream(header: List[str], batches: Batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for rows in batches:
+        writer.writerows(
+            [value.isoformat(sep=" ") if isinstance(value, datetime) else value for value in row] for row in rows
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# --- XLSX ---
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+_ILLEGAL_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+# Style 1 is a date-time number format, style 2 bold for the header row
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+
+
+class _Sink:
+    """Write-only file that hands zipfile's output back to the generator in pieces."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _cell(value, style: int = 0) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f"<c><v>{value!r}</v></c>"
+    if isinstance(value, datetime):
+        serial = (value - _EXCEL_EPOCH) / timedelta(days=1)
+        return f'<c s="1"><v>{serial!r}</v></c>'
+    text = escape(_ILLEGAL_XML.sub("", str(value)))
+    attrs = f' s="{style}"' if style else ""
+    return f'<c t="inlineStr"{attrs}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_stream(sheet_name: str, header: List[str], batches: Batches) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _ROOT_RELS)
+        archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        archive.writestr("xl/styles.xml", _STYLES)
+        archive.writestr(
+            "xl/workbook.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        )
+
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(("<row>" + "".join(_cell(name, style=2) for name in header) + "</row>").encode())
+            for rows in batches:
+                sheet.write("".join("<row>" + "".join(map(_cell, row)) + "</row>" for row in rows).encode())
+                yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+def render(file_format: str, title: str, header: List[str], batches: Batches) -> Iterator[bytes]:
+    """Encode a report as a stream of bytes in one of REPORT_FORMATS."""
+    if file_format == "xlsx":
+        return xlsx_stream(title, header, batches)
+    return csv_stream(header, batches)
@@ -0,0 +1,161 @@
+"""
+Chat Response Cache
+
+Opt-in cache for answers to generic market questions ("how is the market
+today", "what is AAPL's P/E"), so near-identical questions from different
+users don't each trigger a full model call.
+
+Queries are normalized and compared with MinHash signatures over character
+trigrams. Anything that is not a common word (tickers, company names,
+numbers) is an anchor that must match exactly, so "AAPL P/E" never serves
+an answer cached for "MSFT P/E". Entries expire with market data freshness:
+quickly while the US market is open, at the next open otherwise.
+
+Prompts about the user's own account or that could trade are never cached.
+"""
+
+import os
+import re
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+import numpy as np
+
+
+CACHE_ENABLED = os.getenv("CHAT_RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+SIMILARITY_THRESHOLD = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.7"))
+TTL_MARKET_OPEN_SECONDS = float(os.getenv("CHAT_CACHE_TTL_OPEN", "300"))
+TTL_MARKET_CLOSED_MAX_SECONDS = float(os.getenv("CHAT_CACHE_TTL_CLOSED_MAX", "3600"))
+MAX_BUCKETS = int(os.getenv("CHAT_CACHE_MAX_BUCKETS", "2000"))
+MAX_ENTRIES_PER_BUCKET = 32
+NUM_PERMUTATIONS = 64
+
+MARKET_TZ = ZoneInfo("America/New_York")
+MARKET_OPEN = (9, 30)
+MARKET_CLOSE = (16, 0)
+
+# Personal or transactional prompts depend on the user's account and must not be shared.
+# "us" only counts in lowercase, so questions about the US market stay cacheable.
+_PERSONAL_PATTERN = re.compile(
+    r"\b(i|i'm|im|i've|ive|me|my|mine|we|our|(?-i:us)|"
+    r"buy|sell|bought|sold|purchase|order|trade|deposit|withdraw\w*|transfer|"
+    r"add|remove|watchlist|portfolio|holdings?|positions?|balance|cash|account)\b",
+    re.IGNORECASE,
+)
+
+# Words that carry no identity; every other token is an anchor that must match exactly
+_COMMON_WORDS = frozenset("""
+a about after all also am an and any are as at be been before best between but by can could
+current currently day daily do does doing down during each explain for from get give good has
+have how if in into is it its just know latest like look looking market markets more most much
+now of on or over please price prices rate rates right s say see should show so some stock
+stocks t tell than that the their them then there these they this those to today todays trading
+trend trends up vs was week what whats when where which who why will with would year yesterday
+you your p e pe ratio eps earnings dividend yield cap valuation outlook news performance
+performing doing going index indices sector sectors overall economy economic
+""".split())
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, _PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize_query(query: str) -> List[str]:
+    text = re.sub(r"['’]s\b", "", query.lower()).replace("'", "").replace("’", "")
+    return re.sub(r"[^a-z0-9]+", " ", text).split()
+
+
+def is_cacheable(user_query: str, history: Optional[List[dict]] = None) -> bool:
+    """Only standalone, non-personal questions are shared across users."""
+    if any(m["role"] == "user" for m in history or []):
+        return False  # follow-ups depend on earlier turns
+    if _PERSONAL_PATTERN.search(user_query):
+        return False
+    return bool(normalize_query(user_query))
+
+
+def minhash_signature(tokens: List[str]) -> np.ndarray:
+    text = " ".join(tokens)
+    shingles = {text[i:i + 3] for i in range(max(len(text) - 2, 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode()) & _PRIME for s in shingles), dtype=np.uint64)
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME
+    return permuted.min(axis=1)
+
+
+def market_freshness(now: Optional[datetime] = None) -> Tuple[str, float]:
+    """
+    Return (fingerprint, ttl_seconds) for the current market session.
+
+    Answers are only shared within one session, and for no longer than the
+    underlying market data stays current.
+    """
+    now = (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    open_at = now.replace(hour=MARKET_OPEN[0], minute=MARKET_OPEN[1], second=0, microsecond=0)
+    close_at = now.replace(hour=MARKET_CLOSE[0], minute=MARKET_CLOSE[1], second=0, microsecond=0)
+
+    if now.weekday() < 5 and open_at <= now < close_at:
+        return f"{now.date()}:open", TTL_MARKET_OPEN_SECONDS
+
+    next_open = open_at if now < open_at else open_at + timedelta(days=1)
+    while next_open.weekday() >= 5:
+        next_open += timedelta(days=1)
+    ttl = min((next_open - now).total_seconds(), TTL_MARKET_CLOSED_MAX_SECONDS)
+    return f"{now.date()}:closed:{now < open_at}", ttl
+
+
+class ResponseCache:
+    """Buckets of (signature, response, expires_at) keyed by provider, session and anchors."""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._buckets: "OrderedDict[tuple, List[tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(provider: str, tokens: List[str]) -> Tuple[tuple, float]:
+        fingerprint, ttl = market_freshness()
+        anchors: FrozenSet[str] = frozenset(t for t in tokens if t not in _COMMON_WORDS)
+        return (provider, fingerprint, anchors), ttl
+
+    def lookup(self, provider: str, query: str) -> Optional[str]:
+        tokens = normalize_query(query)
+        key, _ = self._key(provider, tokens)
+        signature = minhash_signature(tokens)
+        now = time.time()
+
+        with self._lock:
+            entries = [e for e in self._buckets.get(key, []) if e[2] > now]
+            if entries:
+                self._buckets[key] = entries
+                self._buckets.move_to_end(key)
+                similarity = (np.stack([e[0] for e in entries]) == signature).mean(axis=1)
+                best = int(similarity.argmax())
+                if similarity[best] >= self.threshold:
+                    self.hits += 1
+                    return entries[best][1]
+            self.misses += 1
+        return None
+
+    def store(self, provider: str, query: str, response: str):
+        tokens = normalize_query(query)
+        key, ttl = self._key(provider, tokens)
+        entry = (minhash_signature(tokens), response, time.time() + ttl)
+
+        with self._lock:
+            entries = self._buckets.setdefault(key, [])
+            entries.append(entry)
+            del entries[:-MAX_ENTRIES_PER_BUCKET]
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "buckets": len(self._buckets)}
@@ -0,0 +1,142 @@
+"""
+Portfolio Risk
+
+Volatility, beta, Sharpe, drawdown, correlation and value-at-risk for a set
+of holdings. Return statistics (mean, covariance, correlation) are computed
+once per ticker universe per day from the shared daily close cache and
+reused by every user holding that same set of tickers, so a request only
+does the small weight-vector products on top.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from statistics import NormalDist
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+import market_data
+
+
+BENCHMARK_TICKER = os.getenv("RISK_BENCHMARK", "^GSPC")
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.04"))
+RISK_LOOKBACK_DAYS = int(os.getenv("RISK_LOOKBACK_DAYS", "365"))
+MAX_CACHED_UNIVERSES = int(os.getenv("RISK_MAX_UNIVERSES", "500"))
+TRADING_DAYS = 252
+MIN_OBSERVATIONS = 20
+VAR_LEVELS = (0.95, 0.99)
+
+_universes: "OrderedDict[tuple, dict]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _today() -> str:
+    return pd.Timestamp.utcnow().strftime("%Y-%m-%d")
+
+
+def _compute_universe(tickers: List[str]) -> Optional[dict]:
+    start = pd.Timestamp.utcnow().tz_localize(None).normalize() - pd.Timedelta(days=RISK_LOOKBACK_DAYS)
+    closes = market_data.get_daily_closes(tickers + [BENCHMARK_TICKER], start)
+    if closes.empty or BENCHMARK_TICKER not in closes.columns:
+        return None
+
+    # Positional columns: the benchmark sits last even if it is also held
+    n = len(tickers)
+    returns = closes.reindex(columns=tickers + [BENCHMARK_TICKER]).pct_change(fill_method=None).iloc[1:]
+    returns.columns = range(n + 1)
+    returns = returns[returns[n].notna()]
+    if len(returns) < MIN_OBSERVATIONS:
+        return None
+
+    # Pairwise statistics so one recent listing doesn't truncate everyone else's history
+    return {
+        "tickers": tickers,
+        "dates": returns.index,
+        "returns": returns.iloc[:, :n].fillna(0.0).to_numpy(),
+        "mean": returns.mean().fillna(0.0).to_numpy(),
+        "cov": returns.cov(min_periods=MIN_OBSERVATIONS).fillna(0.0).to_numpy(),
+        "corr": returns.iloc[:, :n].corr(min_periods=MIN_OBSERVATIONS).to_numpy(),
+    }
+
+
+def get_universe(tickers: List[str]) -> Optional[dict]:
+    """Return statistics for a sorted ticker universe, computed at most once per day."""
+    key = (tuple(tickers), _today())
+    with _lock:
+        cached = _universes.get(key)
+        if cached is not None:
+            _universes.move_to_end(key)
+            return cached
+
+    universe = _compute_universe(list(tickers))
+    if universe is None:
+        return None
+    with _lock:
+        _universes[key] = universe
+        while len(_universes) > MAX_CACHED_UNIVERSES:
+            _universes.popitem(last=False)
+    return universe
+
+
+def max_drawdown(returns: np.ndarray) -> float:
+    """Largest peak-to-trough fall of the compounded return series, as a positive fraction."""
+    wealth = np.cumprod(1.0 + returns)
+    peaks = np.maximum.accumulate(np.r_[1.0, wealth])[1:]
+    return float(np.max(1.0 - wealth / peaks)) if len(wealth) else 0.0
+
+
+def portfolio_risk(market_values: Dict[str, float]) -> Optional[dict]:
+    """
+    Risk metrics for holdings given as {ticker: market value}.
+
+    Weights are today's market values, applied to the lookback window's daily
+    returns. Returns None if there isn't enough price history.
+    """
+    values = {t.upper(): v for t, v in market_values.items() if v > 0}
+    total_value = float(sum(values.values()))
+    if total_value <= 0:
+        return None
+
+    tickers = sorted(values)
+    universe = get_universe(tickers)
+    if universe is None:
+        return None
+
+    n = len(tickers)
+    weights = np.array([values[t] for t in tickers]) / total_value
+    cov = universe["cov"]
+    asset_cov, benchmark_cov, benchmark_var = cov[:n, :n], cov[:n, n], cov[n, n]
+
+    daily_mean = float(weights @ universe["mean"][:n])
+    daily_vol = float(np.sqrt(max(weights @ asset_cov @ weights, 0.0)))
+    annual_return = daily_mean * TRADING_DAYS
+    annual_vol = daily_vol * np.sqrt(TRADING_DAYS)
+    portfolio_returns = universe["returns"] @ weights
+
+    value_at_risk = {}
+    for level in VAR_LEVELS:
+        z = NormalDist().inv_cdf(level)
+        historical = -float(np.percentile(portfolio_returns, (1 - level) * 100))
+        parametric = z * daily_vol - daily_mean
+        value_at_risk[f"{int(level * 100)}"] = {
+            "historical": max(historical, 0.0) * total_value,
+            "parametric": max(parametric, 0.0) * total_value,
+        }
+
+    return {
+        "as_of": universe["dates"][-1].strftime("%Y-%m-%d"),
+        "observations": len(portfolio_returns),
+        "benchmark": BENCHMARK_TICKER,
+        "total_value": total_value,
+        "weights": {t: float(w) for t, w in zip(tickers, weights)},
+        "annualized_return": annual_return,
+        "annualized_volatility": annual_vol,
+        "beta": float(weights @ benchmark_cov / benchmark_var) if benchmark_var > 0 else None,
+        "sharpe_ratio": (annual_return - RISK_FREE_RATE) / annual_vol if annual_vol > 0 else None,
+        "max_drawdown": max_drawdown(portfolio_returns),
+        "value_at_risk_1d": value_at_risk,
+        "correlation": {
+            "tickers": tickers,
+            "matrix": [[None if np.isnan(x) else float(x) for x in row] for row in universe["corr"]],
+        },
+    }
@@ -0,0 +1,275 @@
+"""
+Portfolio Snapshots
+
+End-of-day job that stores one PortfolioSnapshot per user with value, cost
+basis, cash, P/L and a per-ticker breakdown, so history and performance
+views read precomputed rows instead of replaying transactions against
+Yahoo Finance on every load.
+
+Users are processed in bulk: positions, realized P/L and contributions come
+from a few grouped queries across all accounts, and each distinct ticker is
+priced once no matter how many users hold it.
+
+The app runs the job after the US close (SNAPSHOT_SCHEDULER, SNAPSHOT_TIME
+in New York time). It can also be run once from cron:
+
+    python snapshots.py
+
+Snapshots are built from current positions, cash and quotes, so only
+today's can be taken; days that were missed stay missing, and history
+over them is rebuilt from daily closes instead.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, insert
+from sqlmodel import Session, select, delete, func
+from database import create_db_and_tables, engine
+from models import User, Transaction, CashTransaction, TaxLot, LotRelief, PortfolioSnapshot
+import lots
+import market_data
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SCHEDULER = os.getenv("SNAPSHOT_SCHEDULER", "true").lower() in ("1", "true", "yes")
+SNAPSHOT_TIME = os.getenv("SNAPSHOT_TIME", "16:30")
+MARKET_TZ = ZoneInfo("America/New_York")
+COVERAGE_SLACK_DAYS = 4  # weekends and holidays before the first snapshot
+
+
+def _backfill_lots(session: Session):
+    """Build lots for accounts whose transactions predate lot tracking."""
+    with_lots = select(TaxLot.user_id).distinct()
+    missing = session.exec(
+        select(Transaction.user_id).where(Transaction.user_id.not_in(with_lots)).distinct()
+    ).all()
+    for user_id in missing:
+        lots.ensure_lots(session, user_id)
+    if missing:
+        session.commit()
+
+
+def _open_positions(session: Session) -> pd.DataFrame:
+    rows = session.exec(
+        select(
+            TaxLot.user_id,
+            TaxLot.ticker,
+            func.sum(TaxLot.remaining_quantity),
+            func.sum(TaxLot.remaining_quantity * TaxLot.cost_per_share),
+        )
+        .where(TaxLot.remaining_quantity > lots.EPSILON)
+        .group_by(TaxLot.user_id, TaxLot.ticker)
+    ).all()
+    return pd.DataFrame.from_records(rows, columns=["user_id", "ticker", "quantity", "cost_basis"])
+
+
+def _net_invested(session: Session) -> Dict[int, float]:
+    """Money put into buys minus money taken out by sells, per user."""
+    value = Transaction.quantity * Transaction.price
+    rows = session.exec(
+        select(
+            Transaction.user_id,
+            func.sum(case((Transaction.type == "buy", value), (Transaction.type == "sell", -value), else_=0.0)),
+        ).group_by(Transaction.user_id)
+    ).all()
+    return {user_id: float(total or 0.0) for user_id, total in rows}
+
+
+def build_snapshots(session: Session, snapshot_date: date) -> List[dict]:
+    """Compute snapshot rows for every user with any activity."""
+    _backfill_lots(session)
+
+    positions = _open_positions(session)
+    realized = {
+        user_id: float(total or 0.0)
+        for user_id, total in session.exec(
+            select(LotRelief.user_id, func.sum(LotRelief.realized_pl)).group_by(LotRelief.user_id)
+        ).all()
+    }
+    invested = _net_invested(session)
+    users = session.exec(
+        select(User.id, User.paper_trading_enabled, User.cash_balance, User.total_deposited, User.total_withdrawn)
+    ).all()
+
+    # One price per distinct ticker across all accounts; unpriced holdings are carried at cost
+    positions["ticker_key"] = positions["ticker"].str.upper()
+    quotes = market_data.get_quotes(positions["ticker_key"].unique())
+    prices = positions["ticker_key"].map({t: q["price"] for t, q in quotes.items()}).astype(float)
+    positions["price"] = prices.fillna(positions["cost_basis"] / positions["quantity"])
+    positions["market_value"] = positions["quantity"] * positions["price"]
+
+    totals = positions.groupby("user_id")[["market_value", "cost_basis"]].sum()
+    breakdown: Dict[int, List[dict]] = {}
+    for row in positions.sort_values("market_value", ascending=False).itertuples(index=False):
+        breakdown.setdefault(row.user_id, []).append({
+            "ticker": row.ticker,
+            "quantity": float(row.quantity),
+            "cost_basis": float(row.cost_basis),
+            "price": float(row.price),
+            "market_value": float(row.market_value),
+        })
+
+    snapshots = []
+    for user_id, paper_trading, cash_balance, deposited, withdrawn in users:
+        if not paper_trading and user_id not in invested:
+            continue
+        holdings_value = float(totals["market_value"].get(user_id, 0.0))
+        cost_basis = float(totals["cost_basis"].get(user_id, 0.0))
+        cash = float(cash_balance or 0.0) if paper_trading else 0.0
+        net_contributions = float((deposited or 0.0) - (withdrawn or 0.0)) if paper_trading else invested[user_id]
+        total_value = holdings_value + cash
+
+        snapshots.append({
+            "user_id": user_id,
+            "snapshot_date": snapshot_date,
+            "holdings_value": holdings_value,
+            "cost_basis": cost_basis,
+            "cash_balance": cash,
+            "total_value": total_value,
+            "net_contributions": net_contributions,
+            "unrealized_pl": holdings_value - cost_basis,
+            "realized_pl": realized.get(user_id, 0.0),
+            "profit_loss": total_value - net_contributions,
+            "holdings": breakdown.get(user_id, []),
+            "created_at": datetime.utcnow(),
+        })
+    return snapshots
+
+
+def take_snapshots() -> int:
+    """Write (or rewrite) every user's snapshot for today in New York. Returns the number of rows."""
+    snapshot_date = datetime.now(MARKET_TZ).date()
+    started = time.time()
+
+    with Session(engine) as session:
+        rows = build_snapshots(session, snapshot_date)
+        session.exec(delete(PortfolioSnapshot).where(PortfolioSnapshot.snapshot_date == snapshot_date))
+        if rows:
+            session.execute(insert(PortfolioSnapshot.__table__), rows)
+        session.commit()
+
+    logger.info(f"Stored {len(rows)} portfolio snapshots for {snapshot_date} in {time.time() - started:.1f}s")
+    return len(rows)
+
+
+def load_snapshots(session: Session, user_id: int, start: date) -> pd.DataFrame:
+    """A user's snapshots from start onwards, oldest first."""
+    rows = session.exec(
+        select(
+            PortfolioSnapshot.snapshot_date,
+            PortfolioSnapshot.holdings_value,
+            PortfolioSnapshot.cash_balance,
+            PortfolioSnapshot.total_value,
+            PortfolioSnapshot.net_contributions,
+            PortfolioSnapshot.profit_loss,
+        )
+        .where(PortfolioSnapshot.user_id == user_id)
+        .where(PortfolioSnapshot.snapshot_date >= start)
+        .order_by(PortfolioSnapshot.snapshot_date)
+    ).all()
+    return pd.DataFrame.from_records(
+        rows, columns=["snapshot_date", "holdings_value", "cash_balance", "total_value", "net_contributions", "profit_loss"]
+    )
+
+
+def last_snapshot_day(now: Optional[datetime] = None) -> date:
+    """The latest day the scheduler has snapshotted by now: today after SNAPSHOT_TIME, else the weekday before."""
+    now = now or datetime.now(MARKET_TZ)
+    hour, minute = (int(part) for part in SNAPSHOT_TIME.split(":"))
+    day = now.date()
+    if (now.hour, now.minute) < (hour, minute):
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def covers_period(session: Session, user_id: int, snapshots: pd.DataFrame, start: date) -> bool:
+    """
+    Whether stored snapshots span the period: the first one falls at the
+    start of the period, or of the account's activity if that began later,
+    the last one is from the latest day the scheduler has run, and there is
+    one for every weekday in between. Days the scheduler missed, or whose
+    snapshots a backdated trade deleted, leave gaps that mean a rebuild.
+    """
+    dates = snapshots["snapshot_date"]
+    if len(dates) < 2 or dates.iloc[-1] < last_snapshot_day():
+        return False
+    if not set(pd.bdate_range(dates.iloc[0], dates.iloc[-1]).date) <= set(dates):
+        return False
+    first_activity = min(
+        (d for d in (
+            session.exec(select(func.min(Transaction.date)).where(Transaction.user_id == user_id)).one(),
+            session.exec(select(func.min(CashTransaction.date)).where(CashTransaction.user_id == user_id)).one(),
+        ) if d is not None),
+        default=None,
+    )
+    expected = max(start, first_activity.date()) if first_activity else start
+    return dates.iloc[0] <= expected + timedelta(days=COVERAGE_SLACK_DAYS)
+
+
+def delete_snapshots(session: Session, user_id: int, since: Optional[date] = None):
+    """Drop a user's snapshots (from a date on), e.g. when a paper-trading account is reset."""
+    query = delete(PortfolioSnapshot).where(PortfolioSnapshot.user_id == user_id)
+    if since is not None:
+        query = query.where(PortfolioSnapshot.snapshot_date >= since)
+    session.exec(query)
+
+
+def performance(snapshots: pd.DataFrame, windows: Dict[str, date]) -> dict:
+    """Value change and time-weighted return over each window, ending at the latest snapshot."""
+    dates = pd.DatetimeIndex(pd.to_datetime(snapshots["snapshot_date"]))
+    values = snapshots["total_value"].to_numpy(dtype=float)
+    flows = np.r_[0.0, np.diff(snapshots["net_contributions"].to_numpy(dtype=float))]
+
+    # Growth factor of each day, so any window's TWR is a ratio of cumulative products
+    base = values[:-1] + flows[1:]
+    growth = np.r_[1.0, np.divide(values[1:], base, out=np.ones(len(base)), where=base > 1e-9)]
+    cumulative = np.cumprod(growth)
+
+    changes = {}
+    for name, since in windows.items():
+        # Latest snapshot on or before the window start; the earliest one if none is that old
+        i = max(int(dates.searchsorted(pd.Timestamp(since), side="right")) - 1, 0)
+        changes[name] = {
+            "since": dates[i].strftime("%Y-%m-%d"),
+            "value_change": float(values[-1] - values[i]),
+            "net_contributions": float(flows[i + 1:].sum()),
+            "time_weighted_return": float(cumulative[-1] / cumulative[i] - 1.0),
+        }
+    return changes
+
+
+def _next_run(now: datetime) -> datetime:
+    hour, minute = (int(part) for part in SNAPSHOT_TIME.split(":"))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    while run_at.weekday() >= 5:
+        run_at += timedelta(days=1)
+    return run_at
+
+
+async def run_scheduler():
+    """Take snapshots every weekday at SNAPSHOT_TIME (New York) until cancelled."""
+    while True:
+        now = datetime.now(MARKET_TZ)
+        await asyncio.sleep((_next_run(now) - now).total_seconds())
+        try:
+            await asyncio.to_thread(take_snapshots)
+        except Exception:
+            logger.exception("Portfolio snapshot job failed")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    create_db_and_tables()
+    take_snapshots()
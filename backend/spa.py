@@ -0,0 +1,141 @@
+"""
+Frontend Static Files
+
+Serves the built React app (frontend/dist) from memory. The dist directory
+is indexed once at startup into a manifest of path -> file, each holding
+its bytes, media type, ETag and gzip/brotli variants, so requests never
+touch the filesystem. Compressed variants come from .gz/.br files the build
+left next to the original, or are compressed once while indexing (brotli
+only when the brotli package is installed).
+
+Vite puts a content hash in every file name under assets/, so those are
+cached as immutable for a year. Everything else, index.html included, is
+revalidated on each use with its ETag. Unknown paths outside assets/ get
+index.html so client-side routes work on reload.
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from fastapi import Request, Response
+import http_cache
+
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+SPA_COMPRESS_MIN_BYTES = int(os.getenv("SPA_COMPRESS_MIN_BYTES", "1024"))
+SPA_BROTLI_QUALITY = int(os.getenv("SPA_BROTLI_QUALITY", "11"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+HASHED_PREFIX = "assets/"
+INDEX = "index.html"
+
+# Preferred first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+
+
+@dataclass
+class StaticFile:
+    body: bytes
+    media_type: str
+    etag: str
+    cache_control: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)  # {encoding: body}
+
+
+def _compress(body: bytes, encoding: str) -> Optional[bytes]:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    if encoding == "br" and BROTLI_AVAILABLE:
+        return brotli.compress(body, quality=SPA_BROTLI_QUALITY)
+    return None
+
+
+def _index_file(root: str, path: str) -> StaticFile:
+    with open(os.path.join(root, path), "rb") as f:
+        body = f.read()
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    static = StaticFile(
+        body=body,
+        media_type=media_type,
+        etag='"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"',
+        cache_control=IMMUTABLE if path.startswith(HASHED_PREFIX) else REVALIDATE,
+    )
+    if len(body) < SPA_COMPRESS_MIN_BYTES or not media_type.startswith(_COMPRESSIBLE):
+        return static
+
+    for encoding, suffix in ENCODINGS.items():
+        prebuilt = os.path.join(root, path + suffix)
+        if os.path.isfile(prebuilt):
+            with open(prebuilt, "rb") as f:
+                encoded = f.read()
+        else:
+            encoded = _compress(body, encoding)
+        if encoded is not None and len(encoded) < len(body):
+            static.encoded[encoding] = encoded
+    return static
+
+
+class Manifest:
+    """The dist directory indexed into memory."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files: Dict[str, StaticFile] = {}
+
+    def load(self):
+        """Index every file under root. Compressed siblings are variants, not files of their own."""
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, "/")
+                if path.endswith(tuple(ENCODINGS.values())) and os.path.isfile(os.path.join(directory, name[:-3])):
+                    continue
+                files[path] = _index_file(self.root, path)
+        self.files = files
+        if INDEX not in files:
+            logger.warning(f"Frontend not built: {os.path.join(self.root, INDEX)} not found")
+        else:
+            compressed = sum(1 for static in files.values() if static.encoded)
+            logger.info(f"Indexed {len(files)} frontend files ({compressed} precompressed, brotli: {BROTLI_AVAILABLE})")
+
+    def lookup(self, path: str) -> Optional[StaticFile]:
+        """The file for a request path; index.html for client-side routes, None for missing assets."""
+        path = path.lstrip("/")
+        static = self.files.get(path)
+        if static is None and not path.startswith(HASHED_PREFIX):
+            static = self.files.get(INDEX)
+        return static
+
+    def response(self, request: Request, static: StaticFile) -> Response:
+        """The file in the best encoding the client accepts, or a 304 if its copy is current."""
+        encoding = None
+        accepted = http_cache.accepted_encodings(request.headers.get("accept-encoding", ""))
+        for candidate in ENCODINGS:
+            if candidate in static.encoded and candidate in accepted:
+                encoding = candidate
+                break
+
+        # Each encoding is its own representation, so it gets its own tag
+        tag = static.etag if encoding is None else f'{static.etag[:-1]}-{encoding}"'
+        headers = {"ETag": tag, "Cache-Control": static.cache_control}
+        if static.encoded:
+            headers["Vary"] = "Accept-Encoding"
+        if http_cache.matches(request, tag):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(static.body, media_type=static.media_type, headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(static.encoded[encoding], media_type=static.media_type, headers=headers)
@@ -0,0 +1,133 @@
+"""
+Concurrency stress test for paper-trading cash.
+
+Fires a few hundred buys, withdrawals and deposits at one account from a
+thread pool, each in its own session against a file-backed SQLite
+database, then checks that no update was lost or overspent:
+
+    cd backend && python -m pytest test_trading_concurrency.py
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, select, func
+
+from models import User, Transaction, CashTransaction, LedgerEvent
+from money import quantize
+from trading import TradeError, adjust_cash, record_transaction
+import ledger
+
+
+START_CASH = 10_000.0
+OPERATIONS = 300
+WORKERS = 16
+RETRIES = 20
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'stress.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def user_id(engine):
+    with Session(engine) as session:
+        user = User(
+            email="stress@example.com", paper_trading_enabled=True,
+            cash_balance=START_CASH, total_deposited=START_CASH,
+        )
+        session.add(user)
+        session.flush()
+        ledger.record(session, user.id, "reset", note="Paper trading reset")
+        ledger.record(session, user.id, "deposit", cash_delta=START_CASH, note="Initial paper trading deposit")
+        session.add(CashTransaction(type="deposit", amount=START_CASH, user_id=user.id))
+        session.commit()
+        return user.id
+
+
+def _buy(session: Session, user: User, amount: float) -> bool:
+    try:
+        record_transaction(session, user, Transaction(ticker="AAA", type="buy", quantity=1, price=amount))
+    except TradeError:
+        return False
+    return True
+
+
+def _cash(session: Session, user: User, kind: str, amount: float) -> bool:
+    # As POST /paper-trading/cash does it
+    if kind == "deposit":
+        adjust_cash(session, user, amount, deposited=amount)
+    elif not adjust_cash(session, user, -amount, withdrawn=amount):
+        session.rollback()
+        return False
+    ledger.record(session, user.id, kind, cash_delta=amount if kind == "deposit" else -amount)
+    session.add(CashTransaction(type=kind, amount=amount, user_id=user.id))
+    session.commit()
+    return True
+
+
+def _run(engine, user_id: int, kind: str, amount: float):
+    """(kind, amount, succeeded, balance after); retried when SQLite reports a lock conflict."""
+    for attempt in range(RETRIES):
+        with Session(engine) as session:
+            user = session.get(User, user_id)
+            try:
+                ok = _buy(session, user, amount) if kind == "buy" else _cash(session, user, kind, amount)
+                return kind, amount, ok, session.get(User, user_id).cash_balance
+            except OperationalError:
+                session.rollback()
+                time.sleep(0.01 * (attempt + 1))
+    raise AssertionError(f"{kind} of {amount} still locked out after {RETRIES} attempts")
+
+
+def test_concurrent_cash_operations_keep_balance_exact(engine, user_id):
+    rng = random.Random(42)
+    # Buys and withdrawals outweigh deposits, so the balance runs out and some must be refused
+    operations = [
+        (kind, round(rng.uniform(*bounds), 2))
+        for kind, bounds in (
+            rng.choice([("buy", (50, 400)), ("buy", (50, 400)), ("withdrawal", (20, 300)), ("deposit", (10, 150))])
+            for _ in range(OPERATIONS)
+        )
+    ]
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = list(pool.map(lambda op: _run(engine, user_id, *op), operations))
+
+    succeeded = [(kind, amount) for kind, amount, ok, _ in results if ok]
+    net = sum(amount if kind == "deposit" else -amount for kind, amount in succeeded)
+    assert any(not ok for _, _, ok, _ in results), "expected some operations to be refused"
+    assert all(balance >= 0 for _, _, _, balance in results)
+
+    with Session(engine) as session:
+        user = session.get(User, user_id)
+        assert user.cash_balance >= 0
+        assert user.cash_balance == pytest.approx(quantize(START_CASH + net), abs=1e-6)
+
+        deposits = sum(amount for kind, amount in succeeded if kind == "deposit")
+        withdrawals = sum(amount for kind, amount in succeeded if kind == "withdrawal")
+        assert user.total_deposited == pytest.approx(START_CASH + deposits, abs=1e-6)
+        assert user.total_withdrawn == pytest.approx(withdrawals, abs=1e-6)
+
+        # The ledger holds exactly the operations that went through, and replays to the balance
+        epoch = session.exec(select(func.max(LedgerEvent.epoch)).where(LedgerEvent.user_id == user_id)).one()
+        ledger_cash = session.exec(
+            select(func.sum(LedgerEvent.cash_delta))
+            .where(LedgerEvent.user_id == user_id, LedgerEvent.epoch == epoch)
+        ).one()
+        assert ledger_cash == pytest.approx(user.cash_balance, abs=1e-6)
+        assert ledger.account_state(session, user_id)["cash_balance"] == pytest.approx(user.cash_balance, abs=1e-6)
+
+        buys = session.exec(select(func.count()).select_from(Transaction).where(Transaction.user_id == user_id)).one()
+        assert buys == sum(1 for kind, _ in succeeded if kind == "buy")
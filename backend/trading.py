@@ -0,0 +1,229 @@
+"""
+Trade Execution
+
+Records a buy or sell for a user: paper-trading cash and share checks,
+cash movement, the ledger event, tax lots, and the derived caches
+(positions, leaderboard, and snapshots a backdated trade makes stale).
+Used by both immediate trades from the API and fills of resting orders,
+so both go through the same checks.
+
+Cash and shares held by open paper-trading orders are reserved and not
+available to other trades.
+
+Balances change only through adjust_cash: a single conditional UPDATE that
+checks and moves cash in the database, so concurrent trades from several
+tabs, the chat tools or order fills can't overspend or lose an update. The
+UPDATE also takes the user's row lock until commit, which serializes the
+share checks that follow it against that user's other trades.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import case
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session, select, func, update
+from models import Transaction, User, Order
+from money import quantize, rounded
+from positions import get_positions, invalidate_positions
+from leaderboard import board as leaderboard
+import lots
+import ledger
+import snapshots
+
+
+# A filling order keeps its reservation until its fill commits, or it's reopened
+RESERVING_STATUSES = ("open", "filling")
+
+
+class TradeError(Exception):
+    """A trade was rejected; the message is safe to show to the user."""
+
+
+def reserved_cash(session: Session, user_id: int, exclude_order_id: Optional[int] = None) -> float:
+    """Cash held by a user's open (or filling) buy orders."""
+    query = (
+        select(func.sum(Order.reserved_cash))
+        .where(Order.user_id == user_id)
+        .where(Order.status.in_(RESERVING_STATUSES))
+    )
+    if exclude_order_id is not None:
+        query = query.where(Order.id != exclude_order_id)
+    return float(session.exec(query).one() or 0.0)
+
+
+def reserved_shares(session: Session, user_id: int, ticker: str, exclude_order_id: Optional[int] = None) -> float:
+    """Shares of a ticker held by a user's open (or filling) sell orders."""
+    query = (
+        select(func.sum(Order.quantity))
+        .where(Order.user_id == user_id)
+        .where(Order.ticker == ticker)
+        .where(Order.side == "sell")
+        .where(Order.status.in_(RESERVING_STATUSES))
+    )
+    if exclude_order_id is not None:
+        query = query.where(Order.id != exclude_order_id)
+    return float(session.exec(query).one() or 0.0)
+
+
+def reserved_shares_by_ticker(session: Session, user_id: int) -> Dict[str, float]:
+    """Shares held by a user's open sell orders, for every ticker at once."""
+    rows = session.exec(
+        select(Order.ticker, func.sum(Order.quantity))
+        .where(Order.user_id == user_id)
+        .where(Order.side == "sell")
+        .where(Order.status.in_(RESERVING_STATUSES))
+        .group_by(Order.ticker)
+    ).all()
+    return {ticker.upper(): float(quantity or 0.0) for ticker, quantity in rows}
+
+
+def adjust_cash(
+    session: Session,
+    user: User,
+    amount: float,
+    deposited: float = 0.0,
+    withdrawn: float = 0.0,
+    reserve: float = 0.0,
+    exclude_order_id: Optional[int] = None
+) -> bool:
+    """
+    Atomically add amount (negative to spend) to a user's cash balance.
+
+    A spend, or a nonzero reserve, only applies if the new balance still
+    covers the user's open-order reservations plus reserve; returns False
+    without changing anything otherwise. Nothing is committed, and the
+    user's loaded balance is updated to what the database now holds.
+    """
+    statement = (
+        update(User)
+        .where(User.id == user.id)
+        .values(
+            cash_balance=rounded(User.cash_balance + amount),
+            total_deposited=rounded(User.total_deposited + deposited),
+            total_withdrawn=rounded(User.total_withdrawn + withdrawn),
+        )
+        .returning(User.cash_balance, User.total_deposited, User.total_withdrawn)
+        .execution_options(synchronize_session=False)
+    )
+    if amount < 0 or reserve > 0:
+        held = select(func.coalesce(func.sum(Order.reserved_cash), 0.0)).where(
+            Order.user_id == user.id, Order.status.in_(RESERVING_STATUSES)
+        )
+        if exclude_order_id is not None:
+            held = held.where(Order.id != exclude_order_id)
+        statement = statement.where(User.cash_balance + amount >= held.scalar_subquery() + reserve)
+
+    row = session.exec(statement).first()
+    if row is None:
+        return False
+    for name, value in zip(("cash_balance", "total_deposited", "total_withdrawn"), row):
+        set_committed_value(user, name, value)
+    return True
+
+
+def available_cash(session: Session, user_id: int, exclude_order_id: Optional[int] = None) -> float:
+    """Cash balance not held by open orders, as committed."""
+    balance = session.exec(select(User.cash_balance).where(User.id == user_id)).one()
+    return balance - reserved_cash(session, user_id, exclude_order_id)
+
+
+def owned_shares(session: Session, user_id: int, ticker: str) -> float:
+    """Net shares bought of a ticker, summed in the database as fixed-point."""
+    signed = case((Transaction.type == "buy", Transaction.quantity), else_=-Transaction.quantity)
+    total = session.exec(
+        select(func.sum(signed))
+        .where(Transaction.user_id == user_id)
+        .where(Transaction.ticker == ticker)
+    ).one()
+    return quantize(total or 0.0)
+
+
+def record_transaction(
+    session: Session,
+    user: User,
+    transaction: Transaction,
+    lot_method: str = "fifo",
+    lot_ids: Optional[List[int]] = None,
+    order: Optional[Order] = None
+) -> Transaction:
+    """
+    Validate, apply and commit a transaction for a user.
+
+    When filling an order, that order's own reservation is available to it
+    and the order is marked filled in the same commit. Raises TradeError
+    (after rolling back) if the trade is not allowed.
+    """
+    if lot_method not in lots.RELIEF_METHODS:
+        raise TradeError(f"Invalid lot method. Use one of: {', '.join(lots.RELIEF_METHODS)}")
+
+    # Accounts from before lot tracking get their lots built once
+    lots.ensure_lots(session, user.id)
+    order_id = order.id if order else None
+
+    transaction_value = transaction.quantity * transaction.price
+
+    # Paper trading: Check cash balance and update
+    if user.paper_trading_enabled:
+        if transaction.type == "buy":
+            if not adjust_cash(session, user, -transaction_value, exclude_order_id=order_id):
+                available = available_cash(session, user.id, order_id)
+                session.rollback()
+                raise TradeError(
+                    f"Insufficient cash balance. Available: ${available:.2f}, Required: ${transaction_value:.2f}"
+                )
+
+        elif transaction.type == "sell":
+            # Credit first: the row lock it takes keeps a concurrent sell from passing the same share check
+            adjust_cash(session, user, transaction_value)
+            current_qty = owned_shares(session, user.id, transaction.ticker)
+            current_qty -= reserved_shares(session, user.id, transaction.ticker, order_id)
+            if current_qty < transaction.quantity:
+                session.rollback()
+                raise TradeError(f"Insufficient shares. Owned: {current_qty}, Selling: {transaction.quantity}")
+
+    signed_value = transaction_value if transaction.type == "sell" else -transaction_value
+    ledger.record(
+        session, user.id, transaction.type,
+        cash_delta=signed_value if user.paper_trading_enabled else 0.0,
+        ticker=transaction.ticker, quantity=transaction.quantity, price=transaction.price, date=transaction.date
+    )
+
+    # A trade dated before the ticker's later ones changes which lots they relieved, so those
+    # are redone FIFO from its date; lot_method applies to trades recorded in date order
+    later = session.exec(
+        select(Transaction.id)
+        .where(Transaction.user_id == user.id, Transaction.ticker == transaction.ticker)
+        .where(Transaction.date > transaction.date)
+        .limit(1)
+    ).first()
+
+    transaction.user_id = user.id
+    session.add(transaction)
+    session.flush()
+
+    try:
+        if later is not None:
+            lots.rebuild_lots(session, user.id, transaction.ticker, transaction.date)
+        else:
+            lots.apply_transaction(session, transaction, lot_method, lot_ids)
+    except ValueError as e:
+        session.rollback()
+        raise TradeError(str(e))
+
+    # A backdated trade changes every snapshot from its date on
+    if transaction.date.date() < datetime.utcnow().date():
+        snapshots.delete_snapshots(session, user.id, since=transaction.date.date())
+
+    if order is not None:
+        order.status = "filled"
+        order.fill_price = transaction.price
+        order.transaction_id = transaction.id
+        order.updated_at = datetime.utcnow()
+        session.add(order)
+
+    session.commit()
+    session.refresh(transaction)
+    invalidate_positions(user.id)
+    if user.paper_trading_enabled:
+        leaderboard.update_account(user, get_positions(session, user.id))
+    return transaction
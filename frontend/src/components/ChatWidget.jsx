@@ -8,6 +8,7 @@ const ChatWidget = ({ show, onHide, onTransactionComplete, theme }) => {
     const [messages, setMessages] = useState([]);
     const [input, setInput] = useState('');
     const [loading, setLoading] = useState(false);
+    const [conversationId, setConversationId] = useState(null);
 
     const sendMessage = async () => {
         if (!input.trim()) return;
@@ -19,7 +20,10 @@ const ChatWidget = ({ show, onHide, onTransactionComplete, theme }) => {
         setLoading(true);
 
         try {
-            const response = await axios.post('/api/chat', { query: currentInput });
+            const payload = { query: currentInput };
+            if (conversationId) payload.conversation_id = conversationId;
+            const response = await axios.post('/api/chat', payload);
+            if (response.data.conversation_id) setConversationId(response.data.conversation_id);
             const botMsg = { text: response.data.response, sender: "bot" };
             setMessages(prev => [...prev, botMsg]);
 